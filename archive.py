@@ -0,0 +1,155 @@
+import os
+
+from db_helpers import get_connection
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+
+# Завершённые заказы, которые можно переносить в архив
+ARCHIVABLE_STATUSES = ("delivered", "cancelled", "expired")
+
+
+def _columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [(row[1], row[2]) for row in cursor.fetchall()]
+
+
+def _sync_archive_columns(cursor, table, archive_table):
+    """
+    Добавляет в архивную таблицу колонки, появившиеся в основной после её создания.
+    """
+    archived = {name for name, _ in _columns(cursor, archive_table)}
+    for name, col_type in _columns(cursor, table):
+        if name not in archived:
+            cursor.execute(f"ALTER TABLE {archive_table} ADD COLUMN {name} {col_type}")
+
+
+def ensure_archive_tables():
+    """
+    Архивные таблицы покупок и платежей и представления purchases_all / payments_all,
+    объединяющие горячие и архивные строки.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS purchases_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            product_id INTEGER,
+            payment_status TEXT,
+            status TEXT,
+            created_at DATETIME,
+            archived_at DATETIME DEFAULT (datetime('now'))
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS payments_archive (
+            id INTEGER PRIMARY KEY,
+            purchase_id INTEGER,
+            invoice_id TEXT,
+            pay_url TEXT,
+            method TEXT,
+            status TEXT,
+            created_at TEXT
+        )
+    """)
+    _sync_archive_columns(cursor, "purchases", "purchases_archive")
+    _sync_archive_columns(cursor, "payments", "payments_archive")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_purchases_archive_user ON purchases_archive(user_id)")
+    # Выгрузка заказов за период читает purchases_all по created_at
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_purchases_archive_created ON purchases_archive(created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_archive_purchase ON payments_archive(purchase_id)")
+
+    # Счётчики AUTOINCREMENT не ниже наибольшего id в архиве: иначе новая покупка или платёж
+    # получили бы id уже перенесённой строки (например, после пересборки таблицы)
+    for table, archive_table in (("purchases", "purchases_archive"), ("payments", "payments_archive")):
+        cursor.execute(f"SELECT MAX(id) FROM {archive_table}")
+        top = cursor.fetchone()[0]
+        if top is None:
+            continue
+        cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?", (top, table, top))
+        cursor.execute(
+            "INSERT INTO sqlite_sequence(name, seq) SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)",
+            (table, top, table)
+        )
+
+    for view, table, archive_table in (("purchases_all", "purchases", "purchases_archive"),
+                                       ("payments_all", "payments", "payments_archive")):
+        cols = ", ".join(name for name, _ in _columns(cursor, table))
+        cursor.execute(f"DROP VIEW IF EXISTS {view}")
+        cursor.execute(f"CREATE VIEW {view} AS SELECT {cols} FROM {table} UNION ALL SELECT {cols} FROM {archive_table}")
+    conn.commit()
+    conn.close()
+
+
+def archive_old_orders(max_age_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Переносит одну пачку завершённых заказов старше max_age_days вместе с их платежами в архив.
+    Одна короткая транзакция на пачку. Возвращает число перенесённых заказов; 0 — переносить нечего.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    statuses = ",".join("?" * len(ARCHIVABLE_STATUSES))
+    cursor.execute(
+        f"""
+        SELECT id FROM purchases
+        WHERE status IN ({statuses}) AND created_at < datetime('now', ?)
+        ORDER BY id LIMIT ?
+        """,
+        (*ARCHIVABLE_STATUSES, f"-{int(max_age_days)} days", batch_size)
+    )
+    ids = [row[0] for row in cursor.fetchall()]
+    if not ids:
+        conn.close()
+        return 0
+
+    move_to_archive(cursor, ids)
+    conn.commit()
+    conn.close()
+    return len(ids)
+
+
+def move_to_archive(cursor, purchase_ids) -> None:
+    """
+    Переносит покупки с их платежами в архивные таблицы в текущей транзакции курсора.
+    Вставка без OR REPLACE: id, уже занятый в архиве, — ошибка, и транзакция не должна её скрыть.
+    """
+    ids = list(purchase_ids)
+    if not ids:
+        return
+    placeholders = ",".join("?" * len(ids))
+    purchase_cols = ", ".join(name for name, _ in _columns(cursor, "purchases"))
+    payment_cols = ", ".join(name for name, _ in _columns(cursor, "payments"))
+    cursor.execute(
+        f"INSERT INTO purchases_archive ({purchase_cols}) SELECT {purchase_cols} FROM purchases WHERE id IN ({placeholders})",
+        ids
+    )
+    cursor.execute(
+        f"INSERT INTO payments_archive ({payment_cols}) SELECT {payment_cols} FROM payments WHERE purchase_id IN ({placeholders})",
+        ids
+    )
+    cursor.execute(f"DELETE FROM payments WHERE purchase_id IN ({placeholders})", ids)
+    cursor.execute(f"DELETE FROM purchases WHERE id IN ({placeholders})", ids)
+
+
+def restore_from_archive(cursor, purchase_ids) -> None:
+    """
+    Возвращает покупки с их платежами из архива в горячие таблицы в текущей транзакции курсора —
+    например, когда истёкший и уже перенесённый в архив счёт всё-таки оказался оплачен.
+    """
+    ids = list(purchase_ids)
+    if not ids:
+        return
+    placeholders = ",".join("?" * len(ids))
+    purchase_cols = ", ".join(name for name, _ in _columns(cursor, "purchases"))
+    payment_cols = ", ".join(name for name, _ in _columns(cursor, "payments"))
+    cursor.execute(
+        f"INSERT INTO purchases ({purchase_cols}) SELECT {purchase_cols} FROM purchases_archive WHERE id IN ({placeholders})",
+        ids
+    )
+    cursor.execute(
+        f"INSERT INTO payments ({payment_cols}) SELECT {payment_cols} FROM payments_archive WHERE purchase_id IN ({placeholders})",
+        ids
+    )
+    cursor.execute(f"DELETE FROM payments_archive WHERE purchase_id IN ({placeholders})", ids)
+    cursor.execute(f"DELETE FROM purchases_archive WHERE id IN ({placeholders})", ids)
@@ -0,0 +1,146 @@
+"""
+Микробенчмарк маршрутизации кнопок: прежняя цепочка фильтров F.data против callback_router.
+
+Оба варианта собираются в отдельных Dispatcher'ах с пустыми обработчиками, обновления прогоняются
+через dp.feed_update — то есть замеряется путь aiogram целиком, без сети и базы.
+
+    python benchmarks/bench_callback_router.py --updates 20000
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from callbacks import ACTIONS, CallbackRouter, cb
+
+# Фильтры в порядке регистрации в main.py до перехода на callback_router: (startswith, префикс)
+LEGACY_FILTERS = [
+    (True, "catalog"), (True, "category_"), (True, "product_"), (True, "buy_"),
+    (False, "apply_promo_in_purchase"), (False, "skip_promo_purchase"), (False, "confirm_purchase_with_promo"),
+    (False, "cancel_purchase"), (False, "manage_promos"), (False, "add_promo"), (True, "list_promos"),
+    (True, "promo_info_"), (True, "delete_promo_"), (True, "toggle_promo_"), (False, "promo"),
+    (False, "admin_panel"), (False, "manage_categories"), (False, "add_category"), (True, "list_categories"),
+    (True, "category_info_"), (True, "delete_category_"), (False, "manage_products"), (False, "add_product_menu"),
+    (False, "import_catalog"), (True, "list_products"), (True, "cat_products_"), (True, "product_detail_"),
+    (True, "stock_upload_"), (True, "delete_product_"), (False, "back_to_main"), (False, "back_to_start"),
+    (True, "cancel_buy_"), (False, "start_command"), (False, "profile"), (False, "support"),
+    (False, "calculator"), (False, "faq"), (False, "delete_catalog"), (False, "confirm_delete_catalog"),
+    (True, "checkpay_"),
+]
+
+# Аргументы, с которыми действие встречается в кнопках
+ACTION_ARGS = {
+    "category": (12,), "product": (12, 3), "buy": (345,), "promo_info": (7,), "delete_promo": (7,),
+    "toggle_promo": (7,), "category_info": (12,), "delete_category": (12,), "cat_products": (12,),
+    "product_detail": (345,), "stock_upload": (345,), "delete_product": (345,), "cancel_buy": (9876,),
+    "checkpay": (5432,),
+}
+
+
+class NullSession(BaseSession):
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        return True
+
+
+async def _noop(callback: CallbackQuery):
+    return None
+
+
+def legacy_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    for startswith, prefix in LEGACY_FILTERS:
+        flt = F.data.startswith(prefix) if startswith else F.data == prefix
+        dp.callback_query.register(_noop, flt)
+    return dp
+
+
+async def _noop_id(callback: CallbackQuery, first: int):
+    return None
+
+
+async def _noop_two_ids(callback: CallbackQuery, first: int, second: int):
+    return None
+
+
+def router_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    router = CallbackRouter()
+    handlers = {0: _noop, 1: _noop_id, 2: _noop_two_ids}
+    for action in ACTIONS:
+        router(action)(handlers[len(ACTION_ARGS.get(action, ()))])
+
+    async def route_callback(callback: CallbackQuery, callback_route, callback_args):
+        await callback_route(callback, callback_args)
+
+    dp.callback_query.register(route_callback, router.resolve)
+    return dp
+
+
+def legacy_data(action: str) -> str:
+    args = ACTION_ARGS.get(action, ())
+    return "_".join([action, *map(str, args)])
+
+
+def make_updates(datas):
+    user = User(id=42, is_bot=False, first_name="bench")
+    message = Message(message_id=1, date=datetime.datetime.now(), chat=Chat(id=42, type="private"), text="x")
+    return [
+        Update(update_id=i, callback_query=CallbackQuery(id=str(i), from_user=user, chat_instance="c", message=message, data=data))
+        for i, data in enumerate(datas)
+    ]
+
+
+async def measure(dp: Dispatcher, bot: Bot, updates) -> float:
+    for update in updates[:200]:
+        await dp.feed_update(bot, update)
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / len(updates) * 1e6
+
+
+async def run(count: int):
+    bot = Bot(token="123456:BENCH", session=NullSession())
+    legacy, routed = legacy_dispatcher(), router_dispatcher()
+    actions = list(ACTIONS)
+    rnd = random.Random(1)
+    mix = [rnd.choice(actions) for _ in range(count)]
+
+    scenarios = [
+        ("uniform mix of all actions", mix),
+        ("first registered (catalog)", ["catalog"] * count),
+        ("last registered (checkpay)", ["checkpay"] * count),
+    ]
+    print(f"{'scenario':32s} {'F.data chain':>14s} {'router':>10s} {'speedup':>8s}   (µs per update)")
+    for title, names in scenarios:
+        legacy_us = await measure(legacy, bot, make_updates([legacy_data(name) for name in names]))
+        router_us = await measure(routed, bot, make_updates([cb(name, *ACTION_ARGS.get(name, ())) for name in names]))
+        print(f"{title:32s} {legacy_us:14.1f} {router_us:10.1f} {legacy_us / router_us:7.2f}x")
+    await bot.session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Callback routing benchmark")
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(run(args.updates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Задержка создания счёта Crypto Pay: общий пул соединений против нового соединения на каждый запрос.
+
+Запросы идут в локальный фейковый сервер (benchmarks/fake_cryptopay.py), запущенный в том же процессе.
+--handshake-ms задерживает первый запрос на каждом новом соединении — так имитируется установка
+TCP+TLS до настоящего API, которой на localhost нет. Печатает p50/p95/max для последовательных
+и параллельных запросов.
+
+    python benchmarks/bench_cryptopay_pool.py --requests 300 --concurrency 20 --handshake-ms 40
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+
+from benchmarks.fake_cryptopay import FakeCryptoPay, start_server
+from crypto_payments import CryptoPayClient
+
+
+async def create_cold(url: str):
+    # Новая сессия на каждый счёт — пул не переиспользуется
+    client = CryptoPayClient("fake", api_url=url)
+    try:
+        await client.create_invoice(amount=1.5, currency_type="crypto", asset="USDT", description="bench")
+    finally:
+        await client.close()
+
+
+def make_warm(client: CryptoPayClient):
+    async def create_warm(url: str):
+        await client.create_invoice(amount=1.5, currency_type="crypto", asset="USDT", description="bench")
+    return create_warm
+
+
+async def measure(create, url: str, count: int, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await create(url)
+            timings.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(count)))
+    return timings
+
+
+def report(title: str, timings: list, connections: int):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"  {title:14s} p50 {statistics.median(timings):7.2f}   p95 {p95:7.2f}   max {timings[-1]:7.2f}   "
+          f"connections {connections}")
+
+
+async def run(args):
+    fake = FakeCryptoPay(latency_ms=args.latency_ms, handshake_ms=args.handshake_ms, pay_after=-1)
+    runner, url = await start_server(fake)
+    try:
+        for concurrency in (1, args.concurrency):
+            print(f"\n{args.requests} createInvoice, concurrency {concurrency} (ms)")
+            before = fake.stats["connections"]
+            report("cold (no pool)", await measure(create_cold, url, args.requests, concurrency),
+                   fake.stats["connections"] - before)
+
+            client = CryptoPayClient("fake", api_url=url)
+            try:
+                # Прогрев: открыть соединения пула до замера
+                await measure(make_warm(client), url, concurrency, concurrency)
+                before = fake.stats["connections"]
+                report("warm pool", await measure(make_warm(client), url, args.requests, concurrency),
+                       fake.stats["connections"] - before)
+            finally:
+                await client.close()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crypto Pay connection pool benchmark")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=5, help="server processing time per request")
+    parser.add_argument("--handshake-ms", type=float, default=40, help="simulated TCP+TLS setup per new connection")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Фото товара: исходный файл против нормализованного (images.store_photo) и повторной отправки по file_id.
+
+Генерирует снимок --width×--height с шумом (плохо сжимается, как настоящая фотография),
+печатает время нормализации и размеры файлов, затем отправляет фото --sends раз в локальный
+фейковый Bot API (benchmarks/fake_botapi.py) тремя способами и печатает p50 отправки и число
+загруженных байт. На localhost загрузка почти бесплатна, поэтому разница во времени здесь
+занижена — смотрите на байты.
+
+    python benchmarks/bench_photo_pipeline.py --width 4000 --height 3000 --sends 50
+"""
+import io
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+WORKDIR = tempfile.mkdtemp(prefix="shop-photo-bench-")
+os.environ["DB_PATH"] = os.path.join(WORKDIR, "bench.db")
+os.environ["PHOTO_DIR"] = os.path.join(WORKDIR, "photos")
+
+from PIL import Image
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import FSInputFile
+
+from benchmarks.fake_botapi import FakeBotAPI, start_server
+from images import ensure_photo_tables, store_photo
+from utils import send_cached_photo
+
+
+def make_photo(width: int, height: int) -> bytes:
+    image = Image.effect_noise((width, height), 40).convert("RGB")
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=95)
+    return out.getvalue()
+
+
+async def measure(fake: FakeBotAPI, send, count: int):
+    before = fake.stats["upload_bytes"]
+    timings = []
+    for chat_id in range(1, count + 1):
+        started = time.perf_counter()
+        await send(chat_id)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), fake.stats["upload_bytes"] - before
+
+
+async def run(args):
+    ensure_photo_tables()
+    original = make_photo(args.width, args.height)
+    raw_path = os.path.join(WORKDIR, "original.jpg")
+    with open(raw_path, "wb") as f:
+        f.write(original)
+
+    started = time.perf_counter()
+    stored_path = store_photo(original)
+    normalize_ms = (time.perf_counter() - started) * 1000
+    print(f"{args.width}×{args.height}: original {len(original) // 1024} KB, "
+          f"normalized {os.path.getsize(stored_path) // 1024} KB in {normalize_ms:.0f} ms")
+
+    fake = FakeBotAPI(latency_ms=args.latency_ms)
+    runner, url = await start_server(fake)
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+    try:
+        cases = (
+            ("original", lambda chat_id: bot.send_photo(chat_id=chat_id, photo=FSInputFile(raw_path))),
+            ("normalized", lambda chat_id: bot.send_photo(chat_id=chat_id, photo=FSInputFile(stored_path))),
+            ("file_id cache", lambda chat_id: send_cached_photo(bot, chat_id, stored_path)),
+        )
+        print(f"\n{args.sends} sendPhoto each")
+        for title, send in cases:
+            p50, uploaded = await measure(fake, send, args.sends)
+            print(f"  {title:14s} p50 {p50:7.2f} ms   uploaded {uploaded // 1024:8d} KB")
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Product photo pipeline benchmark")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--sends", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=0, help="fake Bot API response delay")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
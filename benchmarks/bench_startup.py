@@ -0,0 +1,136 @@
+"""
+Замер холодного старта бота.
+
+Для каждого прогона запускается отдельный процесс с `python -X importtime`, который импортирует main,
+проверяет схему, создаёт Bot и прогоняет через диспетчер одно обновление /start (Bot API подменён
+заглушкой, сеть не нужна). Печатает время до первого обработанного обновления для пустой базы (схема
+создаётся) и для уже развёрнутой (проверки пропускаются по PRAGMA user_version), а также самые дорогие
+импорты по суммарному времени.
+
+    python benchmarks/bench_startup.py --runs 5 --top 15
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import time
+started = time.perf_counter()
+import json, asyncio, datetime
+
+import main
+imported = time.perf_counter()
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Message, Chat, User, Update
+
+main.ensure_schema()
+schema_ready = time.perf_counter()
+
+
+class StubSession(BaseSession):
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            return Message(message_id=1, date=datetime.datetime.now(), chat=Chat(id=method.chat_id, type="private"), text=method.text)
+        return True
+
+
+async def first_update():
+    main.bot = Bot(token=main.BOT_TOKEN, session=StubSession())
+    user = User(id=42, is_bot=False, first_name="bench")
+    update = Update(update_id=1, message=Message(
+        message_id=1, date=datetime.datetime.now(), chat=Chat(id=42, type="private"), from_user=user, text="/start"
+    ))
+    await main.dp.feed_update(main.bot, update)
+
+asyncio.run(first_update())
+handled = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "schema_ms": (schema_ready - imported) * 1000,
+    "first_update_ms": (handled - started) * 1000,
+}))
+"""
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    Строки `import time: self [us] | cumulative | module` -> {module: cumulative_us}.
+    """
+    result = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            cumulative_us = int(parts[1])
+        except ValueError:
+            continue
+        name = parts[2].strip()
+        result[name] = max(result.get(name, 0), cumulative_us)
+    return result
+
+
+def run_once(db_path: str) -> tuple:
+    env = dict(os.environ, DB_PATH=db_path, BOT_TOKEN=os.getenv("BOT_TOKEN", "123456:BENCH"), WORKERS="1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=False
+    )
+    if proc.returncode != 0:
+        sys.exit(f"benchmark child failed:\n{proc.stderr[-3000:]}")
+    timings = json.loads(proc.stdout.strip().splitlines()[-1])
+    return timings, parse_importtime(proc.stderr)
+
+
+def summarize(label: str, samples: list):
+    print(f"\n{label} ({len(samples)} runs, median / min ms)")
+    for key in ("import_ms", "schema_ms", "first_update_ms"):
+        values = [sample[key] for sample in samples]
+        print(f"  {key:16s} {statistics.median(values):8.1f} / {min(values):8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="how many imports to list")
+    args = parser.parse_args()
+
+    cold, warm, imports = [], [], {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for run in range(args.runs):
+            db_path = os.path.join(tmp, f"cold{run}.db")
+            timings, _ = run_once(db_path)
+            cold.append(timings)
+            timings, modules = run_once(db_path)
+            warm.append(timings)
+            for name, cumulative in modules.items():
+                imports.setdefault(name, []).append(cumulative)
+
+    summarize("Empty database: schema is created", cold)
+    summarize("Existing database: schema checks skipped", warm)
+
+    print(f"\nSlowest imports by cumulative time (median ms, top {args.top})")
+    ranked = sorted(((statistics.median(values) / 1000, name) for name, values in imports.items()), reverse=True)
+    for ms, name in ranked[:args.top]:
+        print(f"  {ms:8.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
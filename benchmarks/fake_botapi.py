@@ -0,0 +1,210 @@
+"""
+Локальный фейковый сервер Telegram Bot API для нагрузочных тестов.
+
+Принимает sendMessage / sendPhoto / sendDocument / deleteMessage / editMessageText / answerCallbackQuery
+и отдаёт обновления через getUpdates (long polling). Обновления — сообщения и нажатия кнопок
+синтетических пользователей: их ставит драйвер (benchmarks/loadtest.py) или, при запуске отдельно,
+встроенный генератор /start от --users пользователей с частотой --rate в секунду.
+--latency-ms задерживает каждый ответ, --rate-limit — доля отправок, на которые сервер отвечает 429.
+
+    python benchmarks/fake_botapi.py --port 8082 --users 1000 --rate 50
+    TELEGRAM_API_URL=http://127.0.0.1:8082 BOT_TOKEN=123:fake python main.py
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "Shop", "username": "fake_shop_bot"}
+SEND_METHODS = {"sendmessage", "sendphoto", "senddocument"}
+
+
+class FakeBotAPI:
+    def __init__(self, latency_ms: float = 0, rate_limit: float = 0, retry_after: int = 1, seed: int = 1):
+        self.latency = latency_ms / 1000
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.updates = []
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.callback_ids = itertools.count(1)
+        self.new_updates = asyncio.Event()
+        # chat_id -> очередь того, что бот отправил в чат: ("message", dict) или ("answer", (callback_id, text))
+        self.inbox = defaultdict(asyncio.Queue)
+        self.callback_chats = {}
+        self.file_ids = set()
+        self.stats = Counter()
+
+    # --- синтетические пользователи ---
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "language_code": "ru"}
+
+    def _push(self, **update):
+        update["update_id"] = next(self.update_ids)
+        self.updates.append(update)
+        self.new_updates.set()
+
+    def push_message(self, user_id: int, text: str):
+        message = {
+            "message_id": next(self.message_ids), "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+            "from": self._user(user_id), "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        self._push(message=message)
+
+    def push_callback(self, user_id: int, message: dict, data: str) -> str:
+        callback_id = str(next(self.callback_ids))
+        self.callback_chats[callback_id] = user_id
+        self._push(callback_query={
+            "id": callback_id, "from": self._user(user_id), "chat_instance": str(user_id),
+            "message": message, "data": data,
+        })
+        return callback_id
+
+    # --- Bot API ---
+
+    async def _params(self, request: web.Request) -> dict:
+        params = dict(request.query)
+        if request.content_type == "application/json":
+            params.update(await request.json())
+        elif request.can_read_body:
+            for key, value in (await request.post()).items():
+                if isinstance(value, str):
+                    params[key] = value
+                else:
+                    self.stats["upload_bytes"] += len(value.file.read())
+                    params[key] = "<file>"
+        return params
+
+    def _bot_message(self, params: dict, **content) -> dict:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": next(self.message_ids), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER, **content,
+        }
+        if params.get("reply_markup"):
+            markup = params["reply_markup"]
+            message["reply_markup"] = json.loads(markup) if isinstance(markup, str) else markup
+        self.inbox[chat_id].put_nowait(("message", message))
+        return message
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:int(params.get("limit") or 100)]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.stats[method] += 1
+        params = await self._params(request)
+        if method == "getupdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method in SEND_METHODS and self.random.random() < self.rate_limit:
+            self.stats["429"] += 1
+            return web.json_response({
+                "ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+
+        if method == "getme":
+            result = BOT_USER
+        elif method == "sendmessage":
+            result = self._bot_message(params, text=params.get("text", ""))
+        elif method == "sendphoto":
+            # Загруженный файл получает file_id, по которому его можно отправлять повторно без загрузки
+            file_id = params.get("photo")
+            if file_id.startswith("attach://"):
+                file_id = f"photo-{next(self.message_ids)}"
+                self.file_ids.add(file_id)
+            elif file_id in self.file_ids:
+                self.stats["photo_by_file_id"] += 1
+            else:
+                return web.json_response({
+                    "ok": False, "error_code": 400, "description": "Bad Request: wrong file identifier/HTTP URL specified",
+                }, status=400)
+            result = self._bot_message(params, caption=params.get("caption", ""), photo=[
+                {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 1280},
+            ])
+        elif method == "senddocument":
+            result = self._bot_message(params, caption=params.get("caption", ""))
+        elif method == "editmessagetext":
+            result = self._bot_message(params, text=params.get("text", ""))
+        elif method == "answercallbackquery":
+            callback_id = params.get("callback_query_id")
+            chat_id = self.callback_chats.pop(callback_id, None)
+            if chat_id is not None:
+                self.inbox[chat_id].put_nowait(("answer", (callback_id, params.get("text") or "")))
+            result = True
+        else:
+            # deleteMessage, deleteWebhook, getWebhookInfo и прочее
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        return app
+
+
+async def start_server(fake: FakeBotAPI, host: str = "127.0.0.1", port: int = 0):
+    """
+    Запускает сервер в текущем цикле событий. Возвращает (runner, base_url) для TELEGRAM_API_URL.
+    """
+    runner = web.AppRunner(fake.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+async def _serve(args):
+    fake = FakeBotAPI(args.latency_ms, args.rate_limit)
+    runner, url = await start_server(fake, args.host, args.port)
+    print(f"Fake Bot API on {url}, {args.users} users sending /start at {args.rate}/s")
+    population = range(1, args.users + 1)
+    try:
+        while True:
+            fake.push_message(random.choice(population), "/start")
+            await asyncio.sleep(1 / args.rate)
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--rate-limit", type=float, default=0, help="share of sends answered with 429")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=10, help="/start updates per second")
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Локальный фейковый сервер Crypto Pay API для бенчмарков и нагрузочных тестов.
+
+Поддерживает createInvoice и getInvoices в формате настоящего API ({"ok": true, "result": ...}).
+Счёт становится оплаченным через --pay-after секунд после создания (отрицательное значение — никогда),
+истекает через expires_in. --latency-ms добавляет задержку к каждому ответу, --handshake-ms — к первому
+запросу на новом соединении (имитация TCP+TLS рукопожатия до настоящего API).
+
+    python benchmarks/fake_cryptopay.py --port 8081 --pay-after 5
+    CRYPTOPAY_TOKEN=fake CRYPTOPAY_API_URL=http://127.0.0.1:8081/api python main.py
+"""
+import time
+import asyncio
+import argparse
+import itertools
+import weakref
+
+from aiohttp import web
+
+
+class FakeCryptoPay:
+    def __init__(self, latency_ms: float = 0, handshake_ms: float = 0, pay_after: float = 5):
+        self.latency = latency_ms / 1000
+        self.handshake = handshake_ms / 1000
+        self.pay_after = pay_after
+        self.invoices = {}
+        self.ids = itertools.count(1)
+        self.connections = weakref.WeakSet()
+        self.stats = {"requests": 0, "connections": 0}
+
+    def _status(self, invoice: dict) -> str:
+        age = time.monotonic() - invoice["created"]
+        if self.pay_after >= 0 and age >= self.pay_after:
+            return "paid"
+        if invoice["expires_in"] and age >= invoice["expires_in"]:
+            return "expired"
+        return "active"
+
+    def _public(self, invoice_id: int) -> dict:
+        invoice = self.invoices[invoice_id]
+        return {
+            "invoice_id": invoice_id,
+            "status": self._status(invoice),
+            "asset": invoice["asset"],
+            "amount": invoice["amount"],
+            "description": invoice["description"],
+            "pay_url": f"https://t.me/CryptoTestnetBot?start=IV{invoice_id}",
+        }
+
+    async def _params(self, request: web.Request) -> dict:
+        params = dict(request.query)
+        if request.can_read_body:
+            params.update(await request.json())
+        return params
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.stats["requests"] += 1
+        connection = request.transport
+        if connection not in self.connections:
+            self.connections.add(connection)
+            self.stats["connections"] += 1
+            if self.handshake:
+                await asyncio.sleep(self.handshake)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if not request.headers.get("Crypto-Pay-API-Token"):
+            return web.json_response({"ok": False, "error": {"code": 401, "name": "UNAUTHORIZED"}}, status=401)
+
+        params = await self._params(request)
+        method = request.match_info["method"]
+        if method == "createInvoice":
+            invoice_id = next(self.ids)
+            self.invoices[invoice_id] = {
+                "created": time.monotonic(),
+                "expires_in": int(params.get("expires_in") or 0),
+                "asset": params.get("asset", "USDT"),
+                "amount": str(params.get("amount")),
+                "description": params.get("description", ""),
+            }
+            return web.json_response({"ok": True, "result": self._public(invoice_id)})
+        if method == "getInvoices":
+            ids = [int(value) for value in str(params.get("invoice_ids", "")).split(",") if value.strip().isdigit()]
+            items = [self._public(invoice_id) for invoice_id in ids if invoice_id in self.invoices]
+            return web.json_response({"ok": True, "result": {"items": items[:int(params.get("count", 100))]}})
+        return web.json_response({"ok": False, "error": {"code": 405, "name": "METHOD_NOT_FOUND"}}, status=405)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/api/{method}", self.handle)
+        return app
+
+
+async def start_server(fake: FakeCryptoPay, host: str = "127.0.0.1", port: int = 0):
+    """
+    Запускает сервер в текущем цикле событий. Возвращает (runner, base_url) — runner.cleanup() останавливает.
+    """
+    runner = web.AppRunner(fake.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}/api"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Crypto Pay API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--handshake-ms", type=float, default=0)
+    parser.add_argument("--pay-after", type=float, default=5, help="seconds until an invoice is paid; <0 never")
+    args = parser.parse_args()
+    fake = FakeCryptoPay(args.latency_ms, args.handshake_ms, args.pay_after)
+    web.run_app(fake.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
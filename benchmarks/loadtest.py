@@ -0,0 +1,242 @@
+"""
+Нагрузочный тест полного сценария покупки через main.py без настоящих Telegram и Crypto Pay.
+
+Поднимает в этом процессе фейковые Bot API (benchmarks/fake_botapi.py) и Crypto Pay
+(benchmarks/fake_cryptopay.py), готовит временную БД с категорией и товаром с пулом единиц
+и запускает `python main.py`, направленный на них через TELEGRAM_API_URL и CRYPTOPAY_API_URL.
+Затем --buyers синтетических покупателей приходят с частотой --rate в секунду и проходят
+/start → категория → товар → «Оплатить без промокода» → «Проверить оплату» (пока счёт не оплачен)
+→ сообщение с товаром. Печатает пропускную способность, время до оплаты и до выдачи (p50/p95/max)
+и число неудачных покупок.
+
+    python benchmarks/loadtest.py --buyers 2000 --rate 50 --pay-after 3 --workers 4
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import tempfile
+import statistics
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import fake_botapi, fake_cryptopay
+
+BOT_TOKEN = "123456:LOADTEST"
+ADMIN_ID = 1
+FIRST_BUYER_ID = 1_000_000
+DELIVERY_MARK = "по заказу #"
+
+
+class BuyerFailed(Exception):
+    pass
+
+
+def seed_database(db_path: str, stock: int):
+    """
+    Схема и каталог для теста: одна категория, один товар с stock уникальными единицами.
+    DB_PATH читается при импорте db_helpers, поэтому модули БД импортируются только здесь.
+    """
+    os.environ["DB_PATH"] = db_path
+    os.environ.setdefault("BOT_TOKEN", BOT_TOKEN)
+    from database import ensure_schema, load_stock_items
+    from db_helpers import add_category, add_product, get_connection
+
+    ensure_schema()
+    add_category("Нагрузка")
+    conn = get_connection()
+    category_id = conn.execute("SELECT id FROM categories WHERE name = ?", ("Нагрузка",)).fetchone()[0]
+    conn.close()
+    add_product("Тестовый товар", "Товар для нагрузочного теста", 100, category_id, None)
+    conn = get_connection()
+    product_id = conn.execute("SELECT id FROM products WHERE category_id = ?", (category_id,)).fetchone()[0]
+    conn.close()
+    load_stock_items(product_id, (f"KEY-{n:08d}" for n in range(stock)))
+
+
+def find_button(message: dict, action: str):
+    from callbacks import decode
+
+    for row in (message.get("reply_markup") or {}).get("inline_keyboard", []):
+        for button in row:
+            decoded = decode(button.get("callback_data"))
+            if decoded and decoded[0] == action:
+                return button["callback_data"]
+    return None
+
+
+class Buyer:
+    def __init__(self, fake: fake_botapi.FakeBotAPI, user_id: int, args):
+        self.fake = fake
+        self.user_id = user_id
+        self.args = args
+        self.inbox = fake.inbox[user_id]
+
+    async def _next(self, deadline: float):
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            raise asyncio.TimeoutError
+        return await asyncio.wait_for(self.inbox.get(), timeout)
+
+    async def expect_button(self, action: str, deadline: float):
+        """
+        Ждёт сообщение бота с кнопкой action; возвращает (сообщение, callback_data).
+        """
+        while True:
+            kind, payload = await self._next(deadline)
+            if kind == "message":
+                data = find_button(payload, action)
+                if data:
+                    return payload, data
+
+    async def click(self, message: dict, data: str, deadline: float) -> str:
+        """
+        Нажимает кнопку и возвращает текст ответа на нажатие (answerCallbackQuery).
+        """
+        callback_id = self.fake.push_callback(self.user_id, message, data)
+        while True:
+            kind, payload = await self._next(deadline)
+            if kind == "answer" and payload[0] == callback_id:
+                return payload[1]
+
+    async def run(self) -> dict:
+        started = time.monotonic()
+        deadline = started + self.args.timeout
+        step = "start"
+        try:
+            self.fake.push_message(self.user_id, "/start")
+            step = "category"
+            message, data = await self.expect_button("category", deadline)
+            self.fake.push_callback(self.user_id, message, data)
+            step = "buy"
+            message, data = await self.expect_button("buy", deadline)
+            self.fake.push_callback(self.user_id, message, data)
+            step = "skip_promo_purchase"
+            message, data = await self.expect_button("skip_promo_purchase", deadline)
+            self.fake.push_callback(self.user_id, message, data)
+            step = "checkpay"
+            invoice, data = await self.expect_button("checkpay", deadline)
+            while True:
+                await asyncio.sleep(self.args.check_interval)
+                answer = await self.click(invoice, data, deadline)
+                if answer.startswith("✅"):
+                    break
+                if not answer.startswith("⏳"):
+                    raise BuyerFailed(f"checkpay: {answer}")
+            paid = time.monotonic()
+            step = "delivery"
+            while True:
+                kind, payload = await self._next(deadline)
+                if kind == "message" and DELIVERY_MARK in (payload.get("text") or payload.get("caption") or ""):
+                    break
+            return {"paid": paid - started, "delivered": time.monotonic() - started}
+        except asyncio.TimeoutError:
+            raise BuyerFailed(f"timeout waiting for {step}")
+
+
+def percentiles(values: list) -> str:
+    if not values:
+        return "-"
+    values = sorted(values)
+    p95 = values[max(0, int(len(values) * 0.95) - 1)]
+    return f"p50 {statistics.median(values):7.2f}s   p95 {p95:7.2f}s   max {values[-1]:7.2f}s"
+
+
+async def wait_for_bot(fake: fake_botapi.FakeBotAPI, process, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while not fake.stats["getupdates"]:
+        if process.returncode is not None:
+            raise RuntimeError(f"main.py exited with code {process.returncode}")
+        if time.monotonic() > deadline:
+            raise RuntimeError("main.py did not start polling")
+        await asyncio.sleep(0.1)
+
+
+async def run(args, workdir: str):
+    db_path = os.path.join(workdir, "loadtest.db")
+    seed_database(db_path, args.buyers)
+
+    bot_api = fake_botapi.FakeBotAPI(args.latency_ms, args.rate_limit)
+    crypto = fake_cryptopay.FakeCryptoPay(latency_ms=args.latency_ms, pay_after=args.pay_after)
+    bot_runner, bot_url = await fake_botapi.start_server(bot_api)
+    crypto_runner, crypto_url = await fake_cryptopay.start_server(crypto)
+
+    env = dict(
+        os.environ, BOT_TOKEN=BOT_TOKEN, ADMIN_IDS=str(ADMIN_ID), DB_PATH=db_path,
+        TELEGRAM_API_URL=bot_url, CRYPTOPAY_TOKEN="fake", CRYPTOPAY_API_URL=crypto_url,
+        WORKERS=str(args.workers),
+    )
+    log_path = os.path.join(workdir, "bot.log")
+    with open(log_path, "wb") as log:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, "main.py"), cwd=workdir, env=env, stdout=log, stderr=log
+        )
+    try:
+        await wait_for_bot(bot_api, process)
+        print(f"{args.buyers} buyers at {args.rate}/s, invoices paid after {args.pay_after}s, "
+              f"{args.workers} worker(s), Bot API latency {args.latency_ms} ms, 429 share {args.rate_limit}")
+
+        results, failures = [], Counter()
+
+        async def one(user_id: int):
+            try:
+                results.append(await Buyer(bot_api, user_id, args).run())
+            except BuyerFailed as e:
+                failures[str(e)] += 1
+
+        started = time.monotonic()
+        tasks = []
+        for n in range(args.buyers):
+            tasks.append(asyncio.create_task(one(FIRST_BUYER_ID + n)))
+            await asyncio.sleep(1 / args.rate)
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+
+        print(f"\ncompleted {len(results)}/{args.buyers} purchases in {elapsed:.1f}s "
+              f"({len(results) / elapsed:.1f} purchases/s)")
+        print(f"  to payment   {percentiles([r['paid'] for r in results])}")
+        print(f"  to delivery  {percentiles([r['delivered'] for r in results])}")
+        for reason, count in failures.most_common():
+            print(f"  failed: {reason} × {count}")
+        print(f"Bot API calls: {dict(bot_api.stats)}")
+        print(f"Crypto Pay requests: {crypto.stats['requests']}, connections: {crypto.stats['connections']}")
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(process.wait(), 15)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        await bot_runner.cleanup()
+        await crypto_runner.cleanup()
+        if args.keep:
+            print(f"database and bot log kept in {workdir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Purchase flow load test against fake Telegram and Crypto Pay")
+    parser.add_argument("--buyers", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=20, help="new buyers per second")
+    parser.add_argument("--pay-after", type=float, default=3, help="seconds until a fake invoice is paid")
+    parser.add_argument("--check-interval", type=float, default=2, help="pause between «check payment» clicks")
+    parser.add_argument("--latency-ms", type=float, default=0, help="fake API response delay")
+    parser.add_argument("--rate-limit", type=float, default=0, help="share of Bot API sends answered with 429")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120, help="per-buyer timeout, seconds")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary database and bot log")
+    args = parser.parse_args()
+
+    if args.keep:
+        asyncio.run(run(args, tempfile.mkdtemp(prefix="shop-loadtest-")))
+    else:
+        with tempfile.TemporaryDirectory(prefix="shop-loadtest-") as workdir:
+            asyncio.run(run(args, workdir))
+
+
+if __name__ == "__main__":
+    main()
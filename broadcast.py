@@ -0,0 +1,219 @@
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from config import BROADCAST_RATE, BROADCAST_PAGE_SIZE, BROADCAST_CHECKPOINT
+from db_helpers import get_connection
+
+
+def ensure_broadcast_tables():
+    """
+    Рассылки с сохранённым прогрессом (id последнего обработанного пользователя) и список
+    пользователей, заблокировавших бота.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        last_user_id INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        blocked INTEGER NOT NULL DEFAULT 0,
+        created_by INTEGER,
+        created_at TEXT,
+        finished_at TEXT
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_broadcasts_running ON broadcasts(id) WHERE status = 'running'")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS blocked_users (
+        telegram_id INTEGER PRIMARY KEY,
+        reason TEXT,
+        blocked_at TEXT
+    )
+    """)
+    conn.commit()
+    conn.close()
+
+
+def create_broadcast(text: str, created_by: int) -> Optional[int]:
+    """
+    Ставит рассылку в очередь. None — другая рассылка ещё идёт.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO broadcasts(text, status, created_by, created_at)
+        SELECT ?, 'running', ?, ? WHERE NOT EXISTS (SELECT 1 FROM broadcasts WHERE status = 'running')
+    """, (text, created_by, datetime.utcnow().isoformat()))
+    broadcast_id = cursor.lastrowid if cursor.rowcount else None
+    conn.commit()
+    conn.close()
+    return broadcast_id
+
+
+def get_broadcast(broadcast_id: Optional[int] = None):
+    """
+    (id, status, sent, failed, blocked, created_at, finished_at) рассылки; без id — последней.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    if broadcast_id is None:
+        cursor.execute("SELECT id, status, sent, failed, blocked, created_at, finished_at FROM broadcasts ORDER BY id DESC LIMIT 1")
+    else:
+        cursor.execute("SELECT id, status, sent, failed, blocked, created_at, finished_at FROM broadcasts WHERE id = ?", (broadcast_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+
+def cancel_broadcast(broadcast_id: int) -> bool:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE broadcasts SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'running'",
+        (datetime.utcnow().isoformat(), broadcast_id)
+    )
+    cancelled = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return cancelled
+
+
+def set_user_blocked(telegram_id: int, blocked: bool, reason: str = "blocked"):
+    """
+    Отмечает, что пользователь заблокировал бота (или снова разблокировал).
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    if blocked:
+        cursor.execute(
+            "INSERT OR REPLACE INTO blocked_users(telegram_id, reason, blocked_at) VALUES (?, ?, ?)",
+            (telegram_id, reason, datetime.utcnow().isoformat())
+        )
+    else:
+        cursor.execute("DELETE FROM blocked_users WHERE telegram_id = ?", (telegram_id,))
+    conn.commit()
+    conn.close()
+
+
+def get_running_broadcast():
+    """
+    (id, text, last_user_id, created_by) незавершённой рассылки или None.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, text, last_user_id, created_by FROM broadcasts WHERE status = 'running' ORDER BY id LIMIT 1")
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+
+def _recipients_page(after_user_id: int, limit: int):
+    """
+    Следующая страница получателей по users.id (keyset), без заблокировавших бота.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT u.id, u.telegram_id FROM users u
+        WHERE u.id > ? AND u.telegram_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM blocked_users b WHERE b.telegram_id = u.telegram_id)
+        ORDER BY u.id
+        LIMIT ?
+    """, (after_user_id, limit))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def _checkpoint(broadcast_id: int, last_user_id: int, sent: int, failed: int, blocked_ids, finished: bool = False) -> bool:
+    """
+    Сохраняет прогресс и новых заблокировавших одной транзакцией.
+    False — рассылку отменили, продолжать не нужно.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    now = datetime.utcnow().isoformat()
+    cursor.execute(f"""
+        UPDATE broadcasts
+        SET last_user_id = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ?
+            {", status = 'done', finished_at = ?" if finished else ""}
+        WHERE id = ? AND status = 'running'
+    """, (last_user_id, sent, failed, len(blocked_ids), *((now,) if finished else ()), broadcast_id))
+    running = cursor.rowcount > 0
+    cursor.executemany(
+        "INSERT OR REPLACE INTO blocked_users(telegram_id, reason, blocked_at) VALUES (?, ?, ?)",
+        [(telegram_id, reason, now) for telegram_id, reason in blocked_ids]
+    )
+    conn.commit()
+    conn.close()
+    return running
+
+
+async def _send(bot, telegram_id: int, text: str) -> Optional[str]:
+    """
+    Отправляет одно сообщение. None — доставлено, 'failed' — ошибка, иначе причина блокировки.
+    """
+    for _ in range(3):
+        try:
+            await bot.send_message(chat_id=telegram_id, text=text, parse_mode="HTML")
+            return None
+        except TelegramRetryAfter as e:
+            logging.warning(f"Broadcast hit flood limit, sleeping {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+        except TelegramForbiddenError:
+            return "blocked"
+        except TelegramBadRequest as e:
+            if "chat not found" in str(e).lower():
+                return "chat not found"
+            logging.error(f"Broadcast to {telegram_id} failed: {e}")
+            return "failed"
+        except Exception as e:
+            logging.error(f"Broadcast to {telegram_id} failed: {e}")
+            return "failed"
+    return "failed"
+
+
+async def run_broadcast(bot, broadcast_id: int, text: str, last_user_id: int, rate: float = BROADCAST_RATE) -> bool:
+    """
+    Рассылает text пользователям с id больше last_user_id не чаще rate сообщений в секунду.
+    Прогресс сохраняется каждые BROADCAST_CHECKPOINT получателей, поэтому после перезапуска рассылка
+    продолжится с места остановки (последние несохранённые получатели могут получить сообщение повторно).
+    Возвращает True, если рассылка дошла до конца, False — если её отменили.
+    """
+    interval = 1 / rate
+    next_at = time.monotonic()
+    sent = failed = 0
+    blocked_ids = []
+    while True:
+        page = _recipients_page(last_user_id, BROADCAST_PAGE_SIZE)
+        if not page:
+            return _checkpoint(broadcast_id, last_user_id, sent, failed, blocked_ids, finished=True)
+        for user_id, telegram_id in page:
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_at = max(next_at, time.monotonic()) + interval
+
+            result = await _send(bot, telegram_id, text)
+            if result is None:
+                sent += 1
+            elif result == "failed":
+                failed += 1
+            else:
+                blocked_ids.append((telegram_id, result))
+            last_user_id = user_id
+
+            if sent + failed + len(blocked_ids) >= BROADCAST_CHECKPOINT:
+                if not _checkpoint(broadcast_id, last_user_id, sent, failed, blocked_ids):
+                    return False
+                sent = failed = 0
+                blocked_ids = []
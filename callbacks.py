@@ -0,0 +1,198 @@
+import inspect
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import CallbackQuery
+
+# Версия формата callback_data, первый символ каждой кнопки. Менять при несовместимой смене тегов
+# или порядка аргументов: кнопки прежних версий в старых сообщениях будут считаться устаревшими.
+CALLBACK_VERSION = "1"
+SEP = ":"
+MAX_CALLBACK_BYTES = 64
+
+# Действие -> короткий тег для callback_data. Имена действий совпадают со старыми префиксами
+# callback_data вида «category_5», по ним разбираются кнопки из сообщений, отправленных до кодека.
+ACTIONS = {
+    "catalog": "ca",
+    "category": "c",
+    "product": "pn",
+    "buy": "b",
+    "apply_promo_in_purchase": "ap",
+    "skip_promo_purchase": "sp",
+    "confirm_purchase_with_promo": "cp",
+    "cancel_purchase": "xp",
+    "pay_balance": "pb",
+    "cancel_buy": "xb",
+    "checkpay": "ck",
+    "promo": "up",
+    "manage_promos": "mp",
+    "add_promo": "np",
+    "list_promos": "lp",
+    "promo_info": "pi",
+    "delete_promo": "dp",
+    "toggle_promo": "tp",
+    "admin_panel": "a",
+    "sales_dashboard": "sd",
+    "broadcast": "bc",
+    "new_broadcast": "bn",
+    "confirm_broadcast": "by",
+    "cancel_broadcast": "bx",
+    "manage_categories": "mc",
+    "add_category": "nc",
+    "list_categories": "lc",
+    "category_info": "ci",
+    "delete_category": "dc",
+    "manage_products": "mr",
+    "add_product_menu": "nr",
+    "import_catalog": "ic",
+    "list_products": "lr",
+    "cat_products": "cr",
+    "product_detail": "pd",
+    "stock_upload": "su",
+    "product_photo": "ph",
+    "delete_product": "dr",
+    "delete_catalog": "dx",
+    "confirm_delete_catalog": "dy",
+    "back_to_main": "bm",
+    "back_to_start": "bs",
+    "start_command": "st",
+    "profile": "pf",
+    "support": "hp",
+    "calculator": "cl",
+    "faq": "fq",
+}
+_ACTION_BY_TAG = {tag: action for action, tag in ACTIONS.items()}
+assert len(_ACTION_BY_TAG) == len(ACTIONS), "callback tags must be unique"
+
+_DIGITS36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _to_base36(value: int) -> str:
+    if value < 0:
+        return "-" + _to_base36(-value)
+    digits = []
+    while True:
+        value, rest = divmod(value, 36)
+        digits.append(_DIGITS36[rest])
+        if not value:
+            return "".join(reversed(digits))
+
+
+def _encode_arg(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return _to_base36(value)
+    text = str(value)
+    if SEP in text:
+        raise ValueError(f"callback argument must not contain {SEP!r}: {text!r}")
+    return text
+
+
+def cb(action: str, *args) -> str:
+    """
+    callback_data для кнопки: версия и тег действия, затем аргументы через «:»
+    (целые — в base36). Например, cb("category", 42) -> "1c:16".
+    """
+    data = SEP.join([CALLBACK_VERSION + ACTIONS[action], *(_encode_arg(arg) for arg in args)])
+    if len(data.encode()) > MAX_CALLBACK_BYTES:
+        raise ValueError(f"callback_data longer than {MAX_CALLBACK_BYTES} bytes: {data!r}")
+    return data
+
+
+def decode(data: Optional[str]) -> Optional[Tuple[str, List[str], bool]]:
+    """
+    Разбирает callback_data в (action, сырые аргументы, legacy). Формат старых версий кодека — None.
+    Кнопки без версии («category_info_5») разбираются по самому длинному известному префиксу.
+    """
+    if not data:
+        return None
+    if data[0].isdigit():
+        head, *args = data.split(SEP)
+        if head[0] != CALLBACK_VERSION:
+            return None
+        action = _ACTION_BY_TAG.get(head[1:])
+        return (action, args, False) if action else None
+
+    if data in ACTIONS:
+        return data, [], True
+    position = data.rfind("_")
+    while position > 0:
+        action = data[:position]
+        if action in ACTIONS:
+            return action, data[position + 1:].split("_"), True
+        position = data.rfind("_", 0, position)
+    return None
+
+
+def _decode_arg(value: str, kind, legacy: bool):
+    if kind is bool:
+        return value == "1"
+    if kind is int:
+        return int(value, 10 if legacy else 36)
+    return value
+
+
+class Route:
+    """
+    Обработчик действия. Типы аргументов берутся из аннотаций параметров после callback;
+    параметр state получает FSMContext.
+    """
+
+    def __init__(self, action: str, func):
+        self.action = action
+        self.func = func
+        self.name = func.__name__
+        params = list(inspect.signature(func).parameters.values())[1:]
+        self.wants_state = any(param.name == "state" for param in params)
+        self.arg_types = [param.annotation for param in params if param.name != "state"]
+        self.required = sum(1 for param in params if param.name != "state" and param.default is param.empty)
+
+    def parse(self, raw: List[str], legacy: bool) -> list:
+        if not self.required <= len(raw) <= len(self.arg_types):
+            raise ValueError(f"{self.action}: expected {self.required}..{len(self.arg_types)} args, got {len(raw)}")
+        return [_decode_arg(value, kind, legacy) for value, kind in zip(raw, self.arg_types)]
+
+    async def __call__(self, callback: CallbackQuery, args: list, state=None):
+        if self.wants_state:
+            return await self.func(callback, *args, state=state)
+        return await self.func(callback, *args)
+
+
+class CallbackRouter:
+    """
+    Таблица действие -> обработчик. callback_data разбирается один раз, обработчик находится
+    поиском в словаре вместо перебора цепочки фильтров F.data.
+    """
+
+    def __init__(self):
+        self.routes: Dict[str, Route] = {}
+
+    def __call__(self, action: str):
+        if action not in ACTIONS:
+            raise KeyError(f"unknown callback action: {action}")
+
+        def decorator(func):
+            self.routes[action] = Route(action, func)
+            return func
+        return decorator
+
+    async def resolve(self, callback: CallbackQuery):
+        """
+        Фильтр aiogram: находит маршрут и передаёт его обработчику как callback_route / callback_args.
+        callback_args is None — кнопка с неподходящими аргументами (устаревшая).
+        """
+        decoded = decode(callback.data)
+        if decoded is None:
+            return False
+        action, raw, legacy = decoded
+        route = self.routes.get(action)
+        if route is None:
+            return False
+        try:
+            args = route.parse(raw, legacy)
+        except ValueError:
+            args = None
+        return {"callback_route": route, "callback_args": args}
+
+
+callback_router = CallbackRouter()
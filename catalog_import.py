@@ -0,0 +1,183 @@
+import csv
+import json
+from datetime import datetime
+from typing import Iterator, Optional
+
+from db_helpers import get_connection
+
+IMPORT_CHUNK_SIZE = 500
+MAX_ERRORS_REPORTED = 10
+# Самая длинная запись JSON, которую ждём целиком. Если столько не разбирается, файл повреждён:
+# читать дальше бессмысленно — весь остаток файла оказался бы в памяти.
+MAX_JSON_RECORD_CHARS = 1024 * 1024
+
+# Поля файла импорта. category, name и price обязательны.
+IMPORT_FIELDS = ("category", "name", "description", "price", "delivery_text")
+
+
+def iter_csv_rows(path: str) -> Iterator[dict]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        for row in csv.DictReader(f, dialect=dialect):
+            yield {(k or "").strip().lower(): v for k, v in row.items()}
+
+
+def iter_json_rows(path: str, chunk_size: int = 65536) -> Iterator[dict]:
+    """
+    Читает JSON-массив объектов или JSON Lines по частям, не загружая файл целиком.
+    Бросает JSONDecodeError, если очередная запись не разбирается и к концу файла,
+    и после MAX_JSON_RECORD_CHARS символов.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buf = f.read(chunk_size).lstrip()
+        eof = not buf
+        if buf.startswith("["):
+            buf = buf[1:]
+        while True:
+            buf = buf.lstrip().lstrip(",").lstrip()
+            if buf.startswith("]"):
+                return
+            try:
+                if not buf:
+                    raise json.JSONDecodeError("need more data", buf, 0)
+                obj, end = decoder.raw_decode(buf)
+            except json.JSONDecodeError:
+                if eof or len(buf) > MAX_JSON_RECORD_CHARS:
+                    if buf:
+                        raise
+                    return
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf += chunk
+                continue
+            buf = buf[end:]
+            yield {str(k).strip().lower(): v for k, v in obj.items()} if isinstance(obj, dict) else {}
+
+
+def validate_row(row: dict) -> tuple:
+    """
+    Проверяет строку импорта. Возвращает (category, name, description, price, delivery_text)
+    или бросает ValueError с причиной.
+    """
+    category = str(row.get("category") or "").strip()
+    name = str(row.get("name") or "").strip()
+    if not category:
+        raise ValueError("не указана категория")
+    if not name:
+        raise ValueError("не указано название")
+    try:
+        price = int(str(row.get("price")).strip())
+    except (TypeError, ValueError):
+        raise ValueError(f"неверная цена: {row.get('price')!r}")
+    if price <= 0:
+        raise ValueError(f"цена должна быть положительной: {price}")
+    description = str(row.get("description") or "").strip()
+    delivery_text = str(row.get("delivery_text") or "").strip() or None
+    return category, name, description, price, delivery_text
+
+
+def _resolve_categories(cur, categories: dict, names: set):
+    missing = [name for name in names if name not in categories]
+    if not missing:
+        return 0
+    # Скрытые (мягко удалённые) категории с тем же именем возвращаем в каталог
+    cur.executemany("UPDATE categories SET deleted_at = NULL WHERE name = ? AND deleted_at IS NOT NULL", [(name,) for name in missing])
+    cur.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)", [(name,) for name in missing])
+    created = cur.rowcount if cur.rowcount and cur.rowcount > 0 else 0
+    placeholders = ",".join("?" * len(missing))
+    cur.execute(f"SELECT name, id FROM categories WHERE name IN ({placeholders})", missing)
+    categories.update(cur.fetchall())
+    return created
+
+
+def _lookup_products(cur, names):
+    placeholders = ",".join("?" * len(names))
+    cur.execute(f"SELECT category_id, name, id FROM products WHERE name IN ({placeholders}) AND deleted_at IS NULL", list(names))
+    return {(category_id, name): product_id for category_id, name, product_id in cur.fetchall()}
+
+
+def _flush_chunk(conn, categories: dict, chunk: dict, summary: dict):
+    """
+    Записывает пачку строк одной транзакцией: категории, upsert товаров и автовыдача.
+    chunk: {(category_name, product_name): (description, price, delivery_text)}
+    """
+    cur = conn.cursor()
+    summary["categories_created"] += _resolve_categories(cur, categories, {key[0] for key in chunk})
+
+    rows = {(categories[cat], name): values for (cat, name), values in chunk.items()}
+    existing = _lookup_products(cur, {name for _, name in rows})
+
+    updates = [(desc, price, existing[key]) for key, (desc, price, _) in rows.items() if key in existing]
+    inserts = [(name, desc, price, cat_id) for (cat_id, name), (desc, price, _) in rows.items() if (cat_id, name) not in existing]
+    if updates:
+        cur.executemany("UPDATE products SET description = ?, price = ? WHERE id = ?", updates)
+    if inserts:
+        cur.executemany("INSERT INTO products (name, description, price, category_id) VALUES (?, ?, ?, ?)", inserts)
+        existing = _lookup_products(cur, {name for _, name in rows})
+
+    now = datetime.utcnow().isoformat()
+    deliveries = [
+        (existing[key], 1, delivery_text, None, now)
+        for key, (_, _, delivery_text) in rows.items()
+        if delivery_text and key in existing
+    ]
+    if deliveries:
+        cur.executemany(
+            "INSERT OR REPLACE INTO autodeliveries(product_id, enabled, content_text, file_path, created_at) VALUES (?, ?, ?, ?, ?)",
+            deliveries
+        )
+    conn.commit()
+
+    summary["updated"] += len(updates)
+    summary["inserted"] += len(inserts)
+    summary["deliveries"] += len(deliveries)
+
+
+def import_catalog(path: str, fmt: Optional[str] = None, chunk_size: int = IMPORT_CHUNK_SIZE) -> dict:
+    """
+    Потоковый импорт каталога из CSV или JSON (массив или JSON Lines).
+    Товар определяется парой (категория, название): существующие обновляются, новые добавляются.
+    Синхронная функция — из бота вызывать через asyncio.to_thread.
+    """
+    if fmt is None:
+        fmt = "json" if path.lower().endswith((".json", ".jsonl", ".ndjson")) else "csv"
+    rows = iter_json_rows(path) if fmt == "json" else iter_csv_rows(path)
+
+    summary = {"rows": 0, "inserted": 0, "updated": 0, "skipped": 0, "deliveries": 0,
+               "categories_created": 0, "errors": []}
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT name, id FROM categories WHERE deleted_at IS NULL")
+        categories = dict(cur.fetchall())
+
+        chunk = {}
+        line = 1
+        try:
+            for line, row in enumerate(rows, start=2 if fmt == "csv" else 1):
+                summary["rows"] += 1
+                try:
+                    category, name, description, price, delivery_text = validate_row(row)
+                except ValueError as e:
+                    summary["skipped"] += 1
+                    if len(summary["errors"]) < MAX_ERRORS_REPORTED:
+                        summary["errors"].append(f"строка {line}: {e}")
+                    continue
+                chunk[(category, name)] = (description, price, delivery_text)
+                if len(chunk) >= chunk_size:
+                    _flush_chunk(conn, categories, chunk, summary)
+                    chunk = {}
+        except (csv.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
+            summary["errors"].append(f"файл повреждён после строки {line}: {e}")
+        if chunk:
+            _flush_chunk(conn, categories, chunk, summary)
+    finally:
+        conn.close()
+    return summary
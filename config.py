@@ -10,8 +10,94 @@ try:
 except Exception:
     ADMIN_IDS = set()
 
+# Свой сервер Bot API (локальный telegram-bot-api или фейковый из benchmarks/fake_botapi.py);
+# пусто — api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
 CRYPTOPAY_TOKEN = os.getenv("CRYPTOPAY_TOKEN", "")
 USDT2RUB_RATE = float(os.getenv("USDT2RUB_RATE", "80"))
 
+# HTTP-клиент Crypto Pay: адрес API (по умолчанию тестовая сеть, CRYPTOPAY_TESTNET=0 — боевая),
+# размер пула соединений, сколько секунд держать простаивающее соединение, таймаут запроса
+# и время жизни кэша DNS
+CRYPTOPAY_TESTNET = os.getenv("CRYPTOPAY_TESTNET", "1") not in ("0", "false", "False")
+CRYPTOPAY_API_URL = os.getenv(
+    "CRYPTOPAY_API_URL", "https://testnet-pay.crypt.bot/api" if CRYPTOPAY_TESTNET else "https://pay.crypt.bot/api"
+)
+CRYPTOPAY_POOL_SIZE = int(os.getenv("CRYPTOPAY_POOL_SIZE", "20"))
+CRYPTOPAY_KEEPALIVE = float(os.getenv("CRYPTOPAY_KEEPALIVE", "30"))
+CRYPTOPAY_TIMEOUT = float(os.getenv("CRYPTOPAY_TIMEOUT", "15"))
+CRYPTOPAY_DNS_TTL = int(os.getenv("CRYPTOPAY_DNS_TTL", "300"))
+
+# Размер страницы в каталоге и админских списках (Telegram допускает не больше 100 кнопок)
+CATALOG_PAGE_SIZE = max(1, min(20, int(os.getenv("CATALOG_PAGE_SIZE", "10"))))
+
+# Inline-режим: сколько секунд Telegram может кэшировать ответ и как часто перестраивать индекс
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+INLINE_INDEX_TTL = int(os.getenv("INLINE_INDEX_TTL", "300"))
+
+# Как часто фоновая задача дочищает мягко удалённые товары (SOFT_DELETE)
+PURGE_INTERVAL = int(os.getenv("PURGE_INTERVAL", "60"))
+
+# Как часто переносить старые завершённые заказы в архив (возраст и размер пачки — в archive.py)
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", "3600"))
+
+# Резерв единицы товара под выставленный счёт: срок жизни и период фоновой очистки просроченных
+RESERVATION_TTL = int(os.getenv("RESERVATION_TTL", "900"))
+RESERVATION_SWEEP_INTERVAL = int(os.getenv("RESERVATION_SWEEP_INTERVAL", "30"))
+
+# Срок жизни счёта Crypto Pay (по умолчанию совпадает со сроком резерва). Неоплаченные счета старше
+# PENDING_PAYMENT_TTL фоновая задача раз в PAYMENT_CLEANUP_INTERVAL помечает истёкшими и уносит в архив
+INVOICE_EXPIRES_IN = int(os.getenv("INVOICE_EXPIRES_IN", str(RESERVATION_TTL)))
+PENDING_PAYMENT_TTL = int(os.getenv("PENDING_PAYMENT_TTL", str(INVOICE_EXPIRES_IN + 3600)))
+PAYMENT_CLEANUP_INTERVAL = int(os.getenv("PAYMENT_CLEANUP_INTERVAL", "600"))
+
+# Сколько секунд переиспользовать ответ Crypto Pay о статусе счёта (статус paid кэшируется навсегда)
+# и сколько счетов держать в этом кэше
+INVOICE_STATUS_TTL = float(os.getenv("INVOICE_STATUS_TTL", "5"))
+INVOICE_STATUS_CACHE_SIZE = int(os.getenv("INVOICE_STATUS_CACHE_SIZE", "10000"))
+
+# Число процессов-воркеров (только POSIX). При WORKERS > 1 супервизор получает обновления и раздаёт их
+# воркерам по chat_id; фоновые задачи выполняет один воркер, держащий аренду в БД на LEASE_TTL секунд
+WORKERS = max(1, int(os.getenv("WORKERS", "1")))
+LEASE_TTL = int(os.getenv("LEASE_TTL", "30"))
+
+# Как часто записывать в базу новых пользователей, накопленных add_user()
+USER_FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", "5"))
+
+# Антифлуд: вёдра токенов на пользователя — токенов в секунду и запас. Навигация дешёвая,
+# дорогие действия (оформление заказа, проверка оплаты, промокоды) ограничены сильнее.
+# Вёдра хранятся не более чем для FLOOD_MAX_USERS недавних пользователей.
+FLOOD_NAV_RATE = float(os.getenv("FLOOD_NAV_RATE", "3"))
+FLOOD_NAV_BURST = float(os.getenv("FLOOD_NAV_BURST", "10"))
+FLOOD_EXPENSIVE_RATE = float(os.getenv("FLOOD_EXPENSIVE_RATE", "0.5"))
+FLOOD_EXPENSIVE_BURST = float(os.getenv("FLOOD_EXPENSIVE_BURST", "3"))
+FLOOD_MAX_USERS = int(os.getenv("FLOOD_MAX_USERS", "50000"))
+
+# Рассылка: сообщений в секунду (лимит Telegram — около 30), получателей на страницу выборки
+# и как часто сохранять прогресс
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "500"))
+BROADCAST_CHECKPOINT = int(os.getenv("BROADCAST_CHECKPOINT", "25"))
+BROADCAST_POLL_INTERVAL = int(os.getenv("BROADCAST_POLL_INTERVAL", "5"))
+
+# Фото товаров: каталог хранилища (файлы именуются по sha256 содержимого), длинная сторона
+# после нормализации (Telegram всё равно ужимает фото до 1280) и качество JPEG
+PHOTO_DIR = os.getenv("PHOTO_DIR", "photos")
+PHOTO_MAX_SIDE = int(os.getenv("PHOTO_MAX_SIDE", "1280"))
+PHOTO_JPEG_QUALITY = int(os.getenv("PHOTO_JPEG_QUALITY", "85"))
+
+# Профилирование обработчиков: стек снимается каждые PROFILE_INTERVAL_MS,
+# сохраняется профиль всех вызовов дольше PROFILE_SLOW_MS и доли PROFILE_SAMPLE_RATE остальных
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "500"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+
+# Отчёт по самым тяжёлым SQL-запросам (порог медленного запроса — SQL_SLOW_MS в db_trace)
+SQL_REPORT_INTERVAL = int(os.getenv("SQL_REPORT_INTERVAL", "600"))
+SQL_REPORT_TOP = int(os.getenv("SQL_REPORT_TOP", "10"))
+
 if not BOT_TOKEN:
     raise ValueError("Переменная окружения BOT_TOKEN не задана.")
@@ -1,39 +1,94 @@
-import os
+import time
 import traceback
 import asyncio
-from typing import Optional, Any
+from collections import OrderedDict
+from typing import Optional, Any, Dict
 import uuid
 
-from config import CRYPTOPAY_TOKEN, USDT2RUB_RATE
-
-try:
-    from AsyncPayments.cryptoBot import AsyncCryptoBot
-    CRYPTO_AVAILABLE = True
-except Exception:
-    print(traceback.format_exc())
-    CRYPTO_AVAILABLE = False
-    class AsyncCryptoBot:
-        def __init__(self, token: str, is_testnet: bool = True):
-            self.token = token
-            self.is_testnet = is_testnet
-        async def create_invoice(self, *args, **kwargs):
-            return {"invoice_id": None, "pay_url": None}
-        async def get_invoices(self, *args, **kwargs):
-            return []
+import aiohttp
+
+from config import (
+    CRYPTOPAY_TOKEN, USDT2RUB_RATE, INVOICE_STATUS_TTL, INVOICE_STATUS_CACHE_SIZE,
+    CRYPTOPAY_API_URL, CRYPTOPAY_POOL_SIZE, CRYPTOPAY_KEEPALIVE, CRYPTOPAY_TIMEOUT, CRYPTOPAY_DNS_TTL
+)
+
+# Клиент Crypto Pay настроен, если задан токен. Сам клиент и его пул соединений создаются
+# при первом обращении к платежам — в том процессе и цикле событий, где они будут работать.
+CRYPTO_AVAILABLE: bool = bool(CRYPTOPAY_TOKEN)
 
 crypto_client: Optional[Any] = None
 
+# invoice_id -> (status, expires_at); у paid expires_at = None, такой ответ уже не изменится.
+# Вытесняются давно не запрошенные счета, чтобы кэш не рос бесконечно.
+_status_cache: "OrderedDict[str, tuple]" = OrderedDict()
+# invoice_id -> задача запроса статуса, которую ждут все параллельные проверки этого счёта
+_status_inflight: Dict[str, asyncio.Task] = {}
+
+
+class CryptoPayError(Exception):
+    pass
+
+
+class CryptoPayClient:
+    """
+    Minimal Crypto Pay API client on one long-lived aiohttp session: keep-alive connections
+    are reused between requests, the pool size, DNS cache and timeouts come from config.
+    """
+
+    def __init__(self, token: str, api_url: str = CRYPTOPAY_API_URL):
+        self.token = token
+        self.api_url = api_url.rstrip("/")
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=CRYPTOPAY_POOL_SIZE,
+                keepalive_timeout=CRYPTOPAY_KEEPALIVE,
+                ttl_dns_cache=CRYPTOPAY_DNS_TTL,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=CRYPTOPAY_TIMEOUT),
+                headers={"Crypto-Pay-API-Token": self.token},
+            )
+        return self._session
+
+    async def _call(self, method: str, **params) -> Any:
+        async with self._get_session().post(f"{self.api_url}/{method}", json=params) as response:
+            data = await response.json(content_type=None)
+        if not data.get("ok"):
+            raise CryptoPayError(f"{method} failed: {data.get('error')}")
+        return data["result"]
+
+    async def create_invoice(self, amount: float, currency_type: str, asset: str, description: str = "", **extra) -> dict:
+        return await self._call(
+            "createInvoice", amount=str(amount), currency_type=currency_type, asset=asset, description=description, **extra
+        )
+
+    async def get_invoices(self, invoice_ids, count: int = 100) -> list:
+        result = await self._call("getInvoices", invoice_ids=",".join(map(str, invoice_ids)), count=count)
+        return result.get("items", []) if isinstance(result, dict) else result
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
 def _get_crypto_client():
     global crypto_client
-    if crypto_client is None and CRYPTOPAY_TOKEN and CRYPTO_AVAILABLE:
-        try:
-            is_testnet = os.getenv("CRYPTOPAY_TESTNET", "1") not in ("0", "false", "False")
-            crypto_client = AsyncCryptoBot(CRYPTOPAY_TOKEN, is_testnet=is_testnet)
-        except Exception:
-            print(traceback.format_exc())
-            crypto_client = None
+    if crypto_client is None and CRYPTO_AVAILABLE:
+        crypto_client = CryptoPayClient(CRYPTOPAY_TOKEN)
     return crypto_client
 
+async def close_crypto_client():
+    """
+    Закрывает пул соединений Crypto Pay; вызывается при остановке бота.
+    """
+    if crypto_client is not None:
+        await crypto_client.close()
+
 def _create_mock_invoice(amount_usdt: float) -> tuple:
     """Create a mock invoice for testing when API is unavailable."""
     invoice_id = str(uuid.uuid4())[:12]
@@ -41,9 +96,10 @@ def _create_mock_invoice(amount_usdt: float) -> tuple:
     pay_url = f"https://pay.example.com/invoice/{invoice_id}"
     return (invoice_id, pay_url)
 
-async def create_cryptopay_invoice(amount_rub: float, description: str = "") -> Optional[tuple]:
+async def create_cryptopay_invoice(amount_rub: float, description: str = "", expires_in: Optional[int] = None) -> Optional[tuple]:
     """
     Create a cryptocurrency invoice for payment.
+    expires_in - invoice lifetime in seconds; after it Crypto Pay will not accept the payment.
     Falls back to mock invoice if API is unavailable.
     """
     client = _get_crypto_client()
@@ -57,15 +113,14 @@ async def create_cryptopay_invoice(amount_rub: float, description: str = "") ->
             return _create_mock_invoice(amount_usdt)
         
         try:
-            # Add timeout to prevent hanging
-            invoice = await asyncio.wait_for(
-                client.create_invoice(
-                    amount=amount_usdt,
-                    currency_type="crypto",
-                    asset="USDT",
-                    description=description
-                ),
-                timeout=15.0
+            extra = {"expires_in": int(expires_in)} if expires_in else {}
+            # The session's CRYPTOPAY_TIMEOUT keeps the request from hanging
+            invoice = await client.create_invoice(
+                amount=amount_usdt,
+                currency_type="crypto",
+                asset="USDT",
+                description=description,
+                **extra
             )
         except asyncio.TimeoutError:
             print(f"Timeout creating invoice for {amount_usdt} USDT, using mock")
@@ -97,24 +152,76 @@ async def create_cryptopay_invoice(amount_rub: float, description: str = "") ->
 async def check_crypto_invoice_status(invoice_id: str) -> str:
     """
     Check the status of a crypto invoice.
-    Returns 'paid', 'pending', or 'not'.
+    Returns 'paid', 'pending', 'expired', or 'not'.
+    Concurrent checks of one invoice share a single API request; the answer is reused
+    for INVOICE_STATUS_TTL seconds, and 'paid' is reused forever.
     """
-    client = _get_crypto_client()
-    if not client or not invoice_id:
-        return "not"
+    hit = _status_cache.get(invoice_id)
+    if hit and (hit[1] is None or hit[1] > time.monotonic()):
+        _status_cache.move_to_end(invoice_id)
+        return hit[0]
+
+    task = _status_inflight.get(invoice_id)
+    if task is None:
+        task = asyncio.create_task(_fetch_invoice_status(invoice_id))
+        _status_inflight[invoice_id] = task
+        task.add_done_callback(lambda done: _remember_status(invoice_id, done))
     try:
-        try:
-            info = await asyncio.wait_for(
-                client.get_invoices(invoice_ids=[invoice_id], count=1),
-                timeout=15.0
-            )
-        except (asyncio.TimeoutError, ConnectionError):
-            return "not"
-            
-        if isinstance(info, list) and len(info) > 0:
-            item = info[0]
-            status = getattr(item, "status", None) or (item.get("status") if isinstance(item, dict) else None)
-            return "paid" if status == "paid" else "pending" if status == "pending" else "not"
-        return "not"
+        # shield: if one waiter is cancelled, the request still finishes for the others
+        return await asyncio.shield(task)
     except Exception:
+        # Errors are not cached (see _remember_status): every waiter gets 'not', the next check asks again
         return "not"
+
+def _remember_status(invoice_id: str, task: asyncio.Task):
+    _status_inflight.pop(invoice_id, None)
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        print(f"Error checking invoice {invoice_id}: {task.exception()!r}")
+        return
+    status = task.result()
+    _status_cache[invoice_id] = (status, None if status == "paid" else time.monotonic() + INVOICE_STATUS_TTL)
+    _status_cache.move_to_end(invoice_id)
+    while len(_status_cache) > INVOICE_STATUS_CACHE_SIZE:
+        _status_cache.popitem(last=False)
+
+async def _fetch_invoice_status(invoice_id: str) -> str:
+    """
+    Asks Crypto Pay once. Transport and API errors propagate, so the failed answer
+    is not cached; only a real status (or 'not' for an unknown invoice) is.
+    """
+    client = _get_crypto_client()
+    if not client or not invoice_id:
+        return "not"
+    info = await client.get_invoices(invoice_ids=[invoice_id], count=1)
+    if isinstance(info, list) and len(info) > 0:
+        return _normalize_status(info[0])
+    return "not"
+
+async def get_invoice_statuses(invoice_ids) -> Dict[str, str]:
+    """
+    Statuses of several invoices in one getInvoices request: {invoice_id: status}.
+    Invoices Crypto Pay does not know are missing from the result. Errors propagate:
+    without an answer the caller must not treat the invoices as unpaid.
+    """
+    client = _get_crypto_client()
+    ids = [invoice_id for invoice_id in invoice_ids if invoice_id]
+    if not client or not ids:
+        return {}
+    items = await client.get_invoices(invoice_ids=ids, count=len(ids))
+    statuses = {}
+    for item in items or []:
+        invoice_id = getattr(item, "invoice_id", None) or (item.get("invoice_id") if isinstance(item, dict) else None)
+        if invoice_id is not None:
+            statuses[str(invoice_id)] = _normalize_status(item)
+    return statuses
+
+def _normalize_status(item) -> str:
+    status = getattr(item, "status", None) or (item.get("status") if isinstance(item, dict) else None)
+    # Crypto Pay calls an unpaid invoice 'active'
+    if status == "active":
+        status = "pending"
+    if status in ("paid", "pending", "expired"):
+        return status
+    return "not"
@@ -1,10 +1,27 @@
+import os
+import time
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional
-from db_helpers import DB_PATH
+from db_helpers import (
+    get_connection, cached_page, invalidate_page_cache, keyset_page, init_db, ensure_products_fts, detect_products_fts
+)
+from archive import move_to_archive, restore_from_archive, ensure_archive_tables
+from sales import ensure_sales_tables, record_sale
+from broadcast import ensure_broadcast_tables
+from images import ensure_photo_tables
+
+# Версия схемы, записываемая в PRAGMA user_version. Увеличивать при любом изменении init_db()
+# или ensure_*-функций: иначе на уже развёрнутых базах они не выполнятся.
+SCHEMA_VERSION = 10
+
+# Сколько просроченных резервов снимать за одну транзакцию
+RESERVATION_SWEEP_BATCH = int(os.getenv("RESERVATION_SWEEP_BATCH", "500"))
+# Сколько просроченных платежей обрабатывать за одну транзакцию
+PAYMENT_EXPIRE_BATCH = int(os.getenv("PAYMENT_EXPIRE_BATCH", "200"))
 
 def ensure_promos_table():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS promocodes (
@@ -16,11 +33,20 @@ def ensure_promos_table():
         created_at TEXT
     )
     """)
+    # Кто уже погасил промокод: каждый пользователь может применить код только один раз
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS promo_redemptions (
+        promo_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        created_at TEXT,
+        UNIQUE(promo_id, user_id)
+    )
+    """)
     conn.commit()
     conn.close()
 
 def create_promo_in_db(code: str, amount: int, uses_left):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(
         "INSERT OR REPLACE INTO promocodes(code, amount, uses_left, active, created_at) VALUES (?, ?, ?, 1, ?)",
@@ -28,17 +54,35 @@ def create_promo_in_db(code: str, amount: int, uses_left):
     )
     conn.commit()
     conn.close()
+    invalidate_page_cache(catalog=False)
 
 def get_promos_from_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, code, amount, uses_left, active, created_at FROM promocodes ORDER BY id DESC")
     rows = cursor.fetchall()
     conn.close()
     return rows
 
+def get_promos_page(cursor_id: int = 0, limit: int = 10, backward: bool = False):
+    """
+    Страница промокодов от новых к старым по ключу id.
+    """
+    def load():
+        conn = get_connection()
+        cursor = conn.cursor()
+        rows = keyset_page(
+            cursor,
+            "SELECT id, code, amount, uses_left, active, created_at FROM promocodes WHERE id < ? ORDER BY id DESC LIMIT ?",
+            "SELECT id, code, amount, uses_left, active, created_at FROM promocodes WHERE id > ? ORDER BY id LIMIT ?",
+            (), cursor_id or (2 ** 63 - 1), limit, backward
+        )
+        conn.close()
+        return rows
+    return cached_page(("promos", None, cursor_id, backward, limit), load)
+
 def get_promo_by_code(code: str):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, code, amount, uses_left, active FROM promocodes WHERE code = ?", (code.upper(),))
     row = cursor.fetchone()
@@ -46,7 +90,7 @@ def get_promo_by_code(code: str):
     return row
 
 def get_promo_by_id(pid: int):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, code, amount, uses_left, active FROM promocodes WHERE id = ?", (pid,))
     row = cursor.fetchone()
@@ -54,14 +98,16 @@ def get_promo_by_id(pid: int):
     return row
 
 def delete_promo_from_db(pid: int):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM promocodes WHERE id = ?", (pid,))
+    cursor.execute("DELETE FROM promo_redemptions WHERE promo_id = ?", (pid,))
     conn.commit()
     conn.close()
+    invalidate_page_cache(catalog=False)
 
 def toggle_promo_active(pid: int):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT active FROM promocodes WHERE id = ?", (pid,))
     row = cursor.fetchone()
@@ -72,10 +118,11 @@ def toggle_promo_active(pid: int):
     cursor.execute("UPDATE promocodes SET active = ? WHERE id = ?", (new_state, pid))
     conn.commit()
     conn.close()
+    invalidate_page_cache(catalog=False)
     return new_state
 
 def ensure_payments_table():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS payments (
@@ -85,14 +132,20 @@ def ensure_payments_table():
         pay_url TEXT,
         method TEXT,
         status TEXT DEFAULT 'pending',
-        created_at TEXT
+        created_at TEXT,
+        paid_at TEXT
     )
     """)
+    cursor.execute("PRAGMA table_info(payments)")
+    if "paid_at" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE payments ADD COLUMN paid_at TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_purchase ON payments(purchase_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_pending ON payments(created_at) WHERE status = 'pending'")
     conn.commit()
     conn.close()
 
 def create_payment_entry(purchase_id: int, invoice_id: Optional[str], pay_url: Optional[str], method: str = "crypto"):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("INSERT INTO payments(purchase_id, invoice_id, pay_url, method, status, created_at) VALUES (?, ?, ?, ?, 'pending', ?)",
                    (purchase_id, invoice_id, pay_url, method, datetime.utcnow().isoformat()))
@@ -102,23 +155,104 @@ def create_payment_entry(purchase_id: int, invoice_id: Optional[str], pay_url: O
     return pid
 
 def get_payment_by_id(payment_id: int):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, purchase_id, invoice_id, pay_url, method, status FROM payments WHERE id = ?", (payment_id,))
+    # Истёкшие платежи со временем уезжают в архив, но пользователь всё ещё может нажать «Проверить оплату»
+    cursor.execute("SELECT id, purchase_id, invoice_id, pay_url, method, status FROM payments_all WHERE id = ?", (payment_id,))
     row = cursor.fetchone()
     conn.close()
     return row
 
 def update_payment_status_by_id(payment_id: int, status: str):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE payments SET status = ? WHERE id = ?", (status, payment_id))
     conn.commit()
     conn.close()
 
+def mark_payment_paid(payment_id: int) -> bool:
+    """
+    Переводит платёж в paid, запоминая время оплаты, и в той же транзакции добавляет покупку
+    в агрегаты продаж. Истёкший платёж, уже перенесённый в архив, сначала возвращается
+    в горячие таблицы вместе с покупкой, а истёкшая покупка снова ждёт выдачи.
+    Возвращает False, если платёж уже был оплачен (повторная проверка) или не найден.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    paid_at = datetime.utcnow().isoformat()
+    mark_paid = "UPDATE payments SET status = 'paid', paid_at = ? WHERE id = ? AND status != 'paid'"
+    cursor.execute(mark_paid, (paid_at, payment_id))
+    if cursor.rowcount == 0:
+        cursor.execute("SELECT purchase_id FROM payments_archive WHERE id = ? AND status != 'paid'", (payment_id,))
+        row = cursor.fetchone()
+        if row and row[0] is not None:
+            restore_from_archive(cursor, [row[0]])
+            cursor.execute(mark_paid, (paid_at, payment_id))
+    changed = cursor.rowcount > 0
+    if changed:
+        cursor.execute("SELECT purchase_id FROM payments WHERE id = ?", (payment_id,))
+        purchase_id = cursor.fetchone()[0]
+        if purchase_id is not None:
+            cursor.execute("UPDATE purchases SET status = NULL WHERE id = ? AND status = 'expired'", (purchase_id,))
+            record_sale(cursor, purchase_id, paid_at)
+    conn.commit()
+    conn.close()
+    return changed
+
+def get_stale_payments(max_age_seconds: int, after_id: int = 0, batch_size: int = PAYMENT_EXPIRE_BATCH):
+    """
+    Пачка pending-платежей старше max_age_seconds с id больше after_id: [(id, purchase_id, invoice_id)].
+    Перед expire_payments их статус нужно проверить в Crypto Pay.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cutoff = (datetime.utcnow() - timedelta(seconds=max_age_seconds)).isoformat()
+    cursor.execute(
+        "SELECT id, purchase_id, invoice_id FROM payments WHERE status = 'pending' AND created_at < ? AND id > ? ORDER BY id LIMIT ?",
+        (cutoff, after_id, batch_size)
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def expire_payments(payment_ids) -> int:
+    """
+    Помечает pending-платежи expired, их покупки без других живых платежей — тоже, снимает резервы
+    и уносит покупки с платежами в архив. Одна транзакция. Платёж, который тем временем успели
+    отметить оплаченным, не трогается. Возвращает число истёкших платежей.
+    """
+    ids = list(payment_ids)
+    if not ids:
+        return 0
+    conn = get_connection()
+    cursor = conn.cursor()
+    placeholders = ",".join("?" * len(ids))
+    cursor.execute(f"UPDATE payments SET status = 'expired' WHERE id IN ({placeholders}) AND status = 'pending'", ids)
+    expired = cursor.rowcount
+    cursor.execute(f"SELECT DISTINCT purchase_id FROM payments WHERE id IN ({placeholders}) AND status = 'expired'", ids)
+    purchase_ids = [row[0] for row in cursor.fetchall() if row[0] is not None]
+    if purchase_ids:
+        placeholders = ",".join("?" * len(purchase_ids))
+        cursor.execute(f"""
+            SELECT id FROM purchases p
+            WHERE id IN ({placeholders}) AND status IS NULL
+              AND NOT EXISTS (SELECT 1 FROM payments pm WHERE pm.purchase_id = p.id AND pm.status IN ('pending', 'paid'))
+        """, purchase_ids)
+        orphaned = [row[0] for row in cursor.fetchall()]
+    else:
+        orphaned = []
+    if orphaned:
+        placeholders = ",".join("?" * len(orphaned))
+        cursor.execute(f"UPDATE purchases SET status = 'expired' WHERE id IN ({placeholders})", orphaned)
+        cursor.execute(f"DELETE FROM stock_reservations WHERE purchase_id IN ({placeholders})", orphaned)
+        move_to_archive(cursor, orphaned)
+    conn.commit()
+    conn.close()
+    return expired
+
 def mark_purchase_paid(purchase_id: int):
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         cur = conn.cursor()
         cur.execute("UPDATE purchases SET status = 'paid' WHERE id = ?", (purchase_id,))
         conn.commit()
@@ -126,8 +260,151 @@ def mark_purchase_paid(purchase_id: int):
     except Exception:
         pass
 
+def claim_order_for_delivery(purchase_id: int) -> bool:
+    """
+    Помечает оплаченный заказ как выдаваемый одним условным UPDATE, чтобы его не выдали дважды
+    (фоновая доставка и немедленная выдача после оплаты с баланса). False — заказ уже забрали.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("UPDATE purchases SET status = 'delivering' WHERE id = ? AND status IS NULL", (purchase_id,))
+    claimed = cur.rowcount > 0
+    conn.commit()
+    conn.close()
+    return claimed
+
+def set_purchase_status(purchase_id: int, status: Optional[str]):
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("UPDATE purchases SET status = ? WHERE id = ?", (status, purchase_id))
+    conn.commit()
+    conn.close()
+
+def ensure_balance_ledger():
+    """
+    Журнал движений по балансу. Только добавление: изменить или удалить запись не дадут триггеры.
+    users.balance — сумма журнала, её поддерживает add_ledger_entry. При создании журнала
+    текущие балансы переносятся в него начальными записями.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'balance_ledger'")
+    created = cursor.fetchone() is None
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS balance_ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        delta INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        purchase_id INTEGER,
+        created_at TEXT DEFAULT (datetime('now'))
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON balance_ledger(user_id, id)")
+    # Одна покупка списывается с баланса не больше одного раза
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_ledger_purchase ON balance_ledger(purchase_id) WHERE reason = 'purchase'")
+    for event in ("UPDATE", "DELETE"):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS balance_ledger_no_{event.lower()} BEFORE {event} ON balance_ledger BEGIN
+            SELECT RAISE(ABORT, 'balance_ledger is append-only');
+        END
+        """)
+    if created:
+        cursor.execute("""
+            INSERT INTO balance_ledger(user_id, delta, reason)
+            SELECT id, balance, 'opening' FROM users WHERE COALESCE(balance, 0) != 0
+        """)
+    conn.commit()
+    conn.close()
+
+def add_ledger_entry(cursor, user_id: int, delta: int, reason: str, purchase_id: Optional[int] = None) -> bool:
+    """
+    Меняет баланс на delta и пишет запись в журнал в текущей транзакции курсора.
+    Списание, после которого баланс ушёл бы в минус, не выполняется — тогда False.
+    """
+    cursor.execute(
+        "UPDATE users SET balance = COALESCE(balance, 0) + ? WHERE id = ? AND COALESCE(balance, 0) + ? >= 0",
+        (delta, user_id, delta)
+    )
+    if cursor.rowcount == 0:
+        return False
+    cursor.execute(
+        "INSERT INTO balance_ledger(user_id, delta, reason, purchase_id) VALUES (?, ?, ?, ?)",
+        (user_id, delta, reason, purchase_id)
+    )
+    return True
+
+def pay_purchase_from_balance(purchase_id: int) -> bool:
+    """
+    Оплачивает покупку с баланса одной транзакцией: списание с записью в журнале, платёж
+    со статусом paid и строка в агрегатах продаж. False — денег не хватает или покупка
+    уже не ждёт оплаты; тогда ничего не меняется.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT user_id, amount FROM purchases WHERE id = ? AND status IS NULL", (purchase_id,))
+        row = cursor.fetchone()
+        if not row or row[1] is None:
+            return False
+        user_id, amount = row
+        if not add_ledger_entry(cursor, user_id, -amount, "purchase", purchase_id):
+            conn.rollback()
+            return False
+        paid_at = datetime.utcnow().isoformat()
+        cursor.execute(
+            "INSERT INTO payments(purchase_id, invoice_id, pay_url, method, status, created_at, paid_at) VALUES (?, NULL, NULL, 'balance', 'paid', ?, ?)",
+            (purchase_id, paid_at, paid_at)
+        )
+        record_sale(cursor, purchase_id, paid_at)
+        conn.commit()
+        return True
+    except sqlite3.IntegrityError:
+        # Покупку уже списали параллельным нажатием
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+def redeem_promo(promo_id: int, user_id: int) -> Optional[int]:
+    """
+    Погашает промокод одной транзакцией: отметка в promo_redemptions, условное списание
+    использования (на последнем код отключается) и зачисление на баланс с записью в журнале.
+    Возвращает зачисленную сумму; None — пользователь уже применял этот код, код отключён,
+    использования кончились или зачислить не удалось. Тогда ничего не меняется.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "INSERT INTO promo_redemptions(promo_id, user_id, created_at) VALUES (?, ?, ?)",
+            (promo_id, user_id, datetime.utcnow().isoformat())
+        )
+        cursor.execute(
+            "UPDATE promocodes SET uses_left = uses_left - 1 WHERE id = ? AND active = 1 AND (uses_left IS NULL OR uses_left > 0)",
+            (promo_id,)
+        )
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return None
+        cursor.execute("UPDATE promocodes SET active = 0 WHERE id = ? AND uses_left <= 0", (promo_id,))
+        cursor.execute("SELECT amount FROM promocodes WHERE id = ?", (promo_id,))
+        amount = cursor.fetchone()[0]
+        if not add_ledger_entry(cursor, user_id, amount, "promo"):
+            conn.rollback()
+            return None
+        conn.commit()
+    except sqlite3.IntegrityError:
+        # Этот пользователь уже применял код
+        conn.rollback()
+        return None
+    finally:
+        conn.close()
+    invalidate_page_cache(catalog=False)
+    return amount
+
 def ensure_autodeliveries_table():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS autodeliveries (
@@ -142,7 +419,7 @@ def ensure_autodeliveries_table():
     conn.close()
 
 def create_autodelivery(product_id: int, enabled: int, content_text: Optional[str], file_path: Optional[str]):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(
         "INSERT OR REPLACE INTO autodeliveries(product_id, enabled, content_text, file_path, created_at) VALUES (?, ?, ?, ?, ?)",
@@ -152,23 +429,298 @@ def create_autodelivery(product_id: int, enabled: int, content_text: Optional[st
     conn.close()
 
 def get_autodelivery_for_product(product_id: int):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT product_id, enabled, content_text, file_path FROM autodeliveries WHERE product_id = ?", (product_id,))
     row = cursor.fetchone()
     conn.close()
     return row
 
+def ensure_stock_tables():
+    """
+    Пул уникальных единиц товара (ключи, коды) и счётчик свободных единиц по товару.
+    Счётчик ведут триггеры, поэтому остаток читается без COUNT(*).
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stock_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        purchase_id INTEGER,
+        claimed_at TEXT,
+        created_at TEXT,
+        UNIQUE(product_id, content)
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS product_stock (
+        product_id INTEGER PRIMARY KEY,
+        available INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_free ON stock_items(product_id, id) WHERE purchase_id IS NULL")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_stock_purchase ON stock_items(purchase_id) WHERE purchase_id IS NOT NULL")
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS stock_items_ai AFTER INSERT ON stock_items WHEN new.purchase_id IS NULL BEGIN
+        INSERT OR IGNORE INTO product_stock(product_id, available) VALUES (new.product_id, 0);
+        UPDATE product_stock SET available = available + 1 WHERE product_id = new.product_id;
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS stock_items_claim AFTER UPDATE OF purchase_id ON stock_items
+    WHEN old.purchase_id IS NULL AND new.purchase_id IS NOT NULL BEGIN
+        UPDATE product_stock SET available = available - 1 WHERE product_id = new.product_id;
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS stock_items_ad AFTER DELETE ON stock_items WHEN old.purchase_id IS NULL BEGIN
+        UPDATE product_stock SET available = available - 1 WHERE product_id = old.product_id;
+    END
+    """)
+
+    # Резервы единиц под неоплаченные счета; reserved в product_stock ведут триггеры
+    cursor.execute("PRAGMA table_info(product_stock)")
+    if "reserved" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE product_stock ADD COLUMN reserved INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stock_reservations (
+        purchase_id INTEGER PRIMARY KEY,
+        product_id INTEGER NOT NULL,
+        expires_at TEXT NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reservations_expires ON stock_reservations(expires_at)")
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS stock_reservations_ai AFTER INSERT ON stock_reservations BEGIN
+        UPDATE product_stock SET reserved = reserved + 1 WHERE product_id = new.product_id;
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS stock_reservations_ad AFTER DELETE ON stock_reservations BEGIN
+        UPDATE product_stock SET reserved = reserved - 1 WHERE product_id = old.product_id;
+    END
+    """)
+    conn.commit()
+    conn.close()
+
+def load_stock_items(product_id: int, items, chunk_size: int = 1000):
+    """
+    Массовая загрузка единиц товара пачками через executemany; дубликаты пропускаются.
+    items — любой итерируемый источник строк (например, открытый файл). Возвращает число добавленных.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    added = 0
+    now = datetime.utcnow().isoformat()
+    chunk = []
+    for item in items:
+        content = (item or "").strip()
+        if not content:
+            continue
+        chunk.append((product_id, content, now))
+        if len(chunk) >= chunk_size:
+            cursor.executemany("INSERT OR IGNORE INTO stock_items(product_id, content, created_at) VALUES (?, ?, ?)", chunk)
+            added += cursor.rowcount
+            conn.commit()
+            chunk = []
+    if chunk:
+        cursor.executemany("INSERT OR IGNORE INTO stock_items(product_id, content, created_at) VALUES (?, ?, ?)", chunk)
+        added += cursor.rowcount
+    # Заказы, ждавшие поступления, снова попадут в очередь доставки
+    cursor.execute("UPDATE purchases SET status = NULL WHERE product_id = ? AND status = 'awaiting_stock'", (product_id,))
+    conn.commit()
+    conn.close()
+    return added
+
+def claim_stock_item(product_id: int, purchase_id: int) -> Optional[str]:
+    """
+    Атомарно закрепляет за покупкой одну свободную единицу товара одним условным UPDATE.
+    Резерв покупки при этом погашается. Без резерва единица берётся только из незарезервированного
+    остатка, чтобы не забрать чужую. Повторный вызов для той же покупки вернёт ту же единицу.
+    None — товар закончился.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT content FROM stock_items WHERE purchase_id = ?", (purchase_id,))
+    row = cursor.fetchone()
+    if row:
+        conn.close()
+        return row[0]
+    cursor.execute("DELETE FROM stock_reservations WHERE purchase_id = ?", (purchase_id,))
+    had_reservation = cursor.rowcount > 0
+    cursor.execute("""
+        UPDATE stock_items SET purchase_id = ?, claimed_at = ?
+        WHERE id = (SELECT id FROM stock_items WHERE product_id = ? AND purchase_id IS NULL ORDER BY id LIMIT 1)
+          AND purchase_id IS NULL
+          AND (? OR (SELECT available - reserved FROM product_stock WHERE product_id = ?) > 0)
+    """, (purchase_id, datetime.utcnow().isoformat(), product_id, had_reservation, product_id))
+    if cursor.rowcount == 0:
+        conn.rollback()
+        conn.close()
+        return None
+    conn.commit()
+    cursor.execute("SELECT content FROM stock_items WHERE purchase_id = ?", (purchase_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def reserve_stock(product_id: int, purchase_id: int, ttl_seconds: int) -> bool:
+    """
+    Резервирует единицу товара под покупку на ttl_seconds одним условным INSERT:
+    резерв создаётся, только если свободных незарезервированных единиц больше нуля.
+    Товар без пула единиц не ограничен — всегда True. False — зарезервировать нечего.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM product_stock WHERE product_id = ?", (product_id,))
+    if cursor.fetchone() is None:
+        conn.close()
+        return True
+    expires_at = (datetime.utcnow() + timedelta(seconds=ttl_seconds)).isoformat()
+    cursor.execute("""
+        INSERT OR IGNORE INTO stock_reservations(purchase_id, product_id, expires_at)
+        SELECT ?, ?, ? WHERE (SELECT available - reserved FROM product_stock WHERE product_id = ?) > 0
+    """, (purchase_id, product_id, expires_at, product_id))
+    reserved = cursor.rowcount > 0
+    if not reserved:
+        # Повторный вызов для той же покупки: резерв уже есть
+        cursor.execute("SELECT 1 FROM stock_reservations WHERE purchase_id = ?", (purchase_id,))
+        reserved = cursor.fetchone() is not None
+    conn.commit()
+    conn.close()
+    return reserved
+
+def release_reservation(purchase_id: int):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM stock_reservations WHERE purchase_id = ?", (purchase_id,))
+    conn.commit()
+    conn.close()
+
+def release_expired_reservations(batch_size: int = RESERVATION_SWEEP_BATCH) -> int:
+    """
+    Снимает одну пачку просроченных резервов, идя по индексу на expires_at.
+    Резервы уже оплаченных покупок не трогаем — их погасит доставка. Возвращает число снятых.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        DELETE FROM stock_reservations WHERE purchase_id IN (
+            SELECT r.purchase_id FROM stock_reservations r
+            WHERE r.expires_at <= ?
+              AND NOT EXISTS (SELECT 1 FROM payments pm WHERE pm.purchase_id = r.purchase_id AND pm.status = 'paid')
+            ORDER BY r.expires_at LIMIT ?
+        )
+    """, (datetime.utcnow().isoformat(), batch_size))
+    released = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return released
+
+def get_stock_levels(product_ids):
+    """
+    Доступные остатки по товарам из счётчиков product_stock (свободные минус зарезервированные):
+    {product_id: available}. Товаров без пула единиц в ответе нет — у них остаток не ограничен.
+    """
+    ids = list(product_ids)
+    if not ids:
+        return {}
+    conn = get_connection()
+    cursor = conn.cursor()
+    placeholders = ",".join("?" * len(ids))
+    cursor.execute(f"SELECT product_id, available - reserved FROM product_stock WHERE product_id IN ({placeholders})", ids)
+    levels = dict(cursor.fetchall())
+    conn.close()
+    return levels
+
+
+def ensure_leases_table():
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """)
+    conn.commit()
+    conn.close()
+
+def acquire_lease(name: str, owner: str, ttl_seconds: float) -> bool:
+    """
+    Захватывает или продлевает аренду name одним upsert: запись переписывается, только если
+    аренда уже наша или истекла. True — аренда у owner ещё ttl_seconds секунд.
+    """
+    now = time.time()
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO leases(name, owner, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+        WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+    """, (name, owner, now + ttl_seconds, now))
+    acquired = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return acquired
+
+def release_lease(name: str, owner: str):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+    conn.commit()
+    conn.close()
+
 def update_promo_uses_db(pid: int, uses_left):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE promocodes SET uses_left = ? WHERE id = ?", (uses_left if uses_left is not None else None, pid))
     conn.commit()
     conn.close()
+    invalidate_page_cache(catalog=False)
 
 def deactivate_promo_db(pid: int):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE promocodes SET active = 0 WHERE id = ?", (pid,))
     conn.commit()
     conn.close()
+    invalidate_page_cache(catalog=False)
+
+def ensure_schema(force: bool = False) -> bool:
+    """
+    Создаёт и мигрирует все таблицы магазина. Если в базе уже записана текущая SCHEMA_VERSION,
+    проверки пропускаются — старт стоит одного соединения и двух запросов.
+    Возвращает True, если схема проверялась.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA user_version")
+    current = cursor.fetchone()[0] >= SCHEMA_VERSION and not force
+    if current:
+        detect_products_fts(cursor)
+    conn.close()
+    if current:
+        return False
+
+    init_db()
+    ensure_products_fts()
+    ensure_promos_table()
+    ensure_autodeliveries_table()
+    ensure_payments_table()
+    ensure_stock_tables()
+    ensure_archive_tables()
+    ensure_sales_tables()
+    ensure_balance_ledger()
+    ensure_broadcast_tables()
+    ensure_photo_tables()
+    ensure_leases_table()
+
+    conn = get_connection()
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+    conn.close()
+    return True
@@ -1,13 +1,82 @@
 import sqlite3
 import os
+import re
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime
 from dotenv import load_dotenv
 
+from db_trace import TracingConnection
+
 # Загрузка переменных окружения
 load_dotenv()
 DB_PATH = os.getenv("DB_PATH", "shop.db")
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", "30"))
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "2000"))
+
+# Мягкое удаление: товары и категории сразу скрываются, а физически удаляются фоновой задачей
+SOFT_DELETE = os.getenv("SOFT_DELETE", "0") not in ("0", "false", "False", "")
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "200"))
+
+# Выставляется в ensure_products_fts()
+FTS_AVAILABLE = False
+
+# (kind, scope, cursor_id, backward, limit) -> (expires_at, rows); не больше PAGE_CACHE_SIZE страниц,
+# вытесняются давно не запрошенные. Кэш свой у каждого процесса: invalidate_page_cache() сбрасывает
+# только его, поэтому при WORKERS > 1 остальные воркеры видят изменения каталога в пределах
+# PAGE_CACHE_TTL секунд (на админские экраны это не влияет — запрос и изменение идут в одном воркере,
+# так как апдейты раздаются по chat_id).
+_page_cache = OrderedDict()
+
+# telegram_id -> users.id уже записанных пользователей и буфер новых, ещё не записанных в базу
+_user_ids = {}
+_pending_users = set()
+
+# Увеличивается при каждом изменении каталога; по нему in-memory индексы понимают, что устарели
+catalog_version = 0
+
+def get_connection():
+    """
+    Соединение с базой магазина; все запросы через него попадают в статистику db_trace.
+    """
+    return sqlite3.connect(DB_PATH, factory=TracingConnection)
+
+def _create_purchases_table(cursor, name: str):
+    # AUTOINCREMENT: id покупок, перенесённых в purchases_archive, не должны выдаваться повторно
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            product_id INTEGER,
+            payment_status TEXT DEFAULT 'pending',
+            status TEXT,
+            amount INTEGER,
+            discount INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT (datetime('now')),
+            FOREIGN KEY(user_id) REFERENCES users(id),
+            FOREIGN KEY(product_id) REFERENCES products(id)
+        )
+    """)
+
+def _rebuild_purchases_autoincrement(cursor):
+    """
+    Пересобирает purchases, созданную без AUTOINCREMENT: без него SQLite после удаления
+    последних строк выдаёт их id повторно. Представление purchases_all пересоздаст ensure_archive_tables.
+    """
+    cursor.execute("DROP VIEW IF EXISTS purchases_all")
+    cursor.execute("DROP TABLE IF EXISTS purchases_new")
+    _create_purchases_table(cursor, "purchases_new")
+    cursor.execute("PRAGMA table_info(purchases_new)")
+    new_columns = {column[1] for column in cursor.fetchall()}
+    cursor.execute("PRAGMA table_info(purchases)")
+    columns = ", ".join(column[1] for column in cursor.fetchall() if column[1] in new_columns)
+    cursor.execute(f"INSERT INTO purchases_new ({columns}) SELECT {columns} FROM purchases")
+    cursor.execute("DROP TABLE purchases")
+    cursor.execute("ALTER TABLE purchases_new RENAME TO purchases")
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -32,18 +101,7 @@ def init_db():
             category_id INTEGER REFERENCES categories(id)
         )
     """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS purchases (
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER,
-            product_id INTEGER,
-            payment_status TEXT DEFAULT 'pending',
-            status TEXT,
-            created_at DATETIME DEFAULT (datetime('now')),
-            FOREIGN KEY(user_id) REFERENCES users(id),
-            FOREIGN KEY(product_id) REFERENCES products(id)
-        )
-    """)
+    _create_purchases_table(cursor, "purchases")
     conn.commit()
 
     cursor.execute("PRAGMA table_info(users)")
@@ -58,6 +116,20 @@ def init_db():
         cursor.execute("ALTER TABLE purchases ADD COLUMN status TEXT")
         conn.commit()
 
+    # Сумма к оплате и скидка по промокоду на момент заказа; у старых покупок amount пустой
+    if "amount" not in purchase_columns:
+        cursor.execute("ALTER TABLE purchases ADD COLUMN amount INTEGER")
+        conn.commit()
+
+    if "discount" not in purchase_columns:
+        cursor.execute("ALTER TABLE purchases ADD COLUMN discount INTEGER DEFAULT 0")
+        conn.commit()
+
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'purchases'")
+    if "AUTOINCREMENT" not in cursor.fetchone()[0].upper():
+        _rebuild_purchases_autoincrement(cursor)
+        conn.commit()
+
     cursor.execute("PRAGMA table_info(products)")
     product_columns = [column[1] for column in cursor.fetchall()]
     if "category_id" not in product_columns:
@@ -68,75 +140,382 @@ def init_db():
         cursor.execute("ALTER TABLE products ADD COLUMN photo_path TEXT")
         conn.commit()
 
+    if "deleted_at" not in product_columns:
+        cursor.execute("ALTER TABLE products ADD COLUMN deleted_at TEXT")
+        conn.commit()
+
+    cursor.execute("PRAGMA table_info(categories)")
+    category_columns = [column[1] for column in cursor.fetchall()]
+    if "deleted_at" not in category_columns:
+        cursor.execute("ALTER TABLE categories ADD COLUMN deleted_at TEXT")
+        conn.commit()
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products(category_id, id)")
+    # Поиск товаров по названию при импорте каталога
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_name ON products(name, category_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_purchases_created ON purchases(created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_purchases_product ON purchases(product_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_deleted ON products(deleted_at) WHERE deleted_at IS NOT NULL")
+    conn.commit()
+
     conn.close()
 
-def add_user(telegram_id):
-    conn = sqlite3.connect(DB_PATH)
+def ensure_products_fts():
+    """
+    Полнотекстовый индекс FTS5 по названию и описанию товаров, синхронизируемый триггерами.
+    Если SQLite собран без FTS5, поиск работает через LIKE.
+    """
+    global FTS_AVAILABLE
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("INSERT OR IGNORE INTO users (telegram_id) VALUES (?)", (telegram_id,))
-    conn.commit()
+    try:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+        existed = cursor.fetchone() is not None
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                name, description,
+                content='products', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+                INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+                INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description ON products BEGIN
+                INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+                INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+            END
+        """)
+        if not existed:
+            cursor.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+        conn.commit()
+        FTS_AVAILABLE = True
+    except sqlite3.OperationalError as e:
+        logging.warning(f"FTS5 unavailable, falling back to LIKE search: {e}")
+        FTS_AVAILABLE = False
+    conn.close()
+
+def detect_products_fts(cursor):
+    """
+    Выставляет FTS_AVAILABLE по уже созданной схеме, не выполняя ensure_products_fts().
+    """
+    global FTS_AVAILABLE
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+    FTS_AVAILABLE = cursor.fetchone() is not None
+
+def _fts_tokens(text):
+    return re.findall(r"\w+", (text or "").lower())
+
+def search_products(query, limit=10):
+    """
+    Поиск товаров по названию и описанию с учётом префиксов, лучшие совпадения первыми.
+    Возвращает [(id, name, description, price, photo_path), ...].
+    """
+    tokens = _fts_tokens(query)
+    if not tokens:
+        return []
+    conn = get_connection()
+    cursor = conn.cursor()
+    if FTS_AVAILABLE:
+        match = " ".join(f'"{token}"*' for token in tokens)
+        cursor.execute("""
+            SELECT p.id, p.name, p.description, p.price, p.photo_path
+            FROM products_fts
+            JOIN products p ON p.id = products_fts.rowid
+            WHERE products_fts MATCH ? AND p.deleted_at IS NULL
+            ORDER BY bm25(products_fts, 10.0, 1.0)
+            LIMIT ?
+        """, (match, limit))
+    else:
+        cursor.execute(
+            "SELECT id, name, description, price, photo_path FROM products WHERE (name LIKE ? OR description LIKE ?) AND deleted_at IS NULL ORDER BY id LIMIT ?",
+            (f"%{query.strip()}%", f"%{query.strip()}%", limit)
+        )
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def find_products_by_name(name, limit=10):
+    """
+    Товары, в названии которых есть все слова из name: [(id, name), ...].
+    Точные совпадения (без учёта регистра) идут первыми.
+    """
+    tokens = _fts_tokens(name)
+    if not tokens:
+        return []
+    conn = get_connection()
+    cursor = conn.cursor()
+    if FTS_AVAILABLE:
+        match = "name : " + " ".join(f'"{token}"' for token in tokens)
+        cursor.execute("""
+            SELECT p.id, p.name
+            FROM products_fts
+            JOIN products p ON p.id = products_fts.rowid
+            WHERE products_fts MATCH ? AND p.deleted_at IS NULL
+            ORDER BY bm25(products_fts)
+            LIMIT ?
+        """, (match, limit))
+    else:
+        cursor.execute("SELECT id, name FROM products WHERE name = ? AND deleted_at IS NULL LIMIT ?", (name, limit))
+    rows = cursor.fetchall()
+    conn.close()
+    wanted = name.strip().lower()
+    return sorted(rows, key=lambda row: row[1].strip().lower() != wanted)
+
+def invalidate_page_cache(catalog=True):
+    """
+    Сбрасывает кэш страниц; вызывается после любых изменений категорий, товаров и промокодов.
+    catalog=False — изменились только промокоды или данные, которых нет в поиске: индекс
+    inline-поиска (см. catalog_version) тогда не перестраивается.
+    """
+    global catalog_version
+    _page_cache.clear()
+    if catalog:
+        catalog_version += 1
+
+def cached_page(key, loader):
+    now = time.monotonic()
+    hit = _page_cache.get(key)
+    if hit and hit[0] > now:
+        _page_cache.move_to_end(key)
+        return hit[1]
+    rows = loader()
+    _page_cache[key] = (now + PAGE_CACHE_TTL, rows)
+    _page_cache.move_to_end(key)
+    while len(_page_cache) > PAGE_CACHE_SIZE:
+        _page_cache.popitem(last=False)
+    return rows
+
+def keyset_page(cursor, sql_forward, sql_backward, params, cursor_id, limit, backward):
+    """
+    Выбирает limit + 1 строк после (или до) cursor_id; лишняя строка показывает, есть ли следующая страница.
+    Строки всегда возвращаются в порядке отображения.
+    """
+    if backward:
+        cursor.execute(sql_backward, (*params, cursor_id, limit + 1))
+        return cursor.fetchall()[::-1]
+    cursor.execute(sql_forward, (*params, cursor_id, limit + 1))
+    return cursor.fetchall()
+
+def load_known_users():
+    """
+    Загружает в память соответствие telegram_id -> users.id, чтобы add_user и create_purchase
+    не ходили в базу за уже известными пользователями.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT telegram_id, id FROM users")
+    _user_ids.update(cursor.fetchall())
     conn.close()
+    return len(_user_ids)
+
+def add_user(telegram_id):
+    """
+    Регистрирует пользователя без обращения к базе: новые telegram_id копятся в буфере
+    и записываются одним executemany в flush_new_users().
+    """
+    if telegram_id not in _user_ids:
+        _pending_users.add(telegram_id)
+
+def flush_new_users():
+    """
+    Записывает накопленных новых пользователей одной транзакцией и кэширует их id.
+    Возвращает число записанных.
+    """
+    global _pending_users
+    if not _pending_users:
+        return 0
+    pending, _pending_users = _pending_users, set()
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.executemany("INSERT OR IGNORE INTO users (telegram_id) VALUES (?)", [(telegram_id,) for telegram_id in pending])
+        conn.commit()
+        ids = list(pending)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            cursor.execute(f"SELECT telegram_id, id FROM users WHERE telegram_id IN ({','.join('?' * len(chunk))})", chunk)
+            _user_ids.update(cursor.fetchall())
+        conn.close()
+    except Exception:
+        # Не потеряем регистрации: вернём их в буфер до следующей попытки
+        _pending_users |= pending
+        raise
+    return len(pending)
+
+def resolve_user_id(cursor, telegram_id):
+    """
+    users.id по telegram_id из кэша; пользователя, которого ещё нет в базе, записывает сразу.
+    """
+    user_id = _user_ids.get(telegram_id)
+    if user_id is not None:
+        return user_id
+    cursor.execute("INSERT OR IGNORE INTO users (telegram_id) VALUES (?)", (telegram_id,))
+    # Фиксируем сразу: в кэш должен попасть только id записанной строки
+    cursor.connection.commit()
+    cursor.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    _user_ids[telegram_id] = row[0]
+    _pending_users.discard(telegram_id)
+    return row[0]
 
 def get_products():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, name, description, price FROM products")
+    cursor.execute("SELECT id, name, description, price FROM products WHERE deleted_at IS NULL")
     products = cursor.fetchall()
     conn.close()
     return products
 
 def get_product_by_id(product_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, name, description, price FROM products WHERE id = ?", (product_id,))
+    cursor.execute("SELECT id, name, description, price FROM products WHERE id = ? AND deleted_at IS NULL", (product_id,))
     product = cursor.fetchone()
     conn.close()
     return product
 
-def create_purchase(telegram_id, product_id):
-    conn = sqlite3.connect(DB_PATH)
+def create_purchase(telegram_id, product_id, amount=None, discount=0):
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("INSERT OR IGNORE INTO users (telegram_id) VALUES (?)", (telegram_id,))
-    conn.commit()
-    cursor.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,))
-    user_row = cursor.fetchone()
-    if not user_row:
+    user_id = resolve_user_id(cursor, telegram_id)
+    if user_id is None:
         conn.close()
         raise RuntimeError("Не удалось получить user id для telegram_id")
-    user_id = user_row[0]
-    cursor.execute("INSERT INTO purchases (user_id, product_id) VALUES (?, ?)", (user_id, product_id))
+    cursor.execute("INSERT INTO purchases (user_id, product_id, amount, discount) VALUES (?, ?, ?, ?)",
+                   (user_id, product_id, amount, discount))
     purchase_id = cursor.lastrowid
     conn.commit()
     conn.close()
     return purchase_id
 
 def add_category(name):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
+    cursor.execute("UPDATE categories SET deleted_at = NULL WHERE name = ? AND deleted_at IS NOT NULL", (name,))
     cursor.execute("INSERT OR IGNORE INTO categories (name) VALUES (?)", (name,))
     conn.commit()
     conn.close()
+    invalidate_page_cache()
 
 def get_categories():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM categories")
+    cursor.execute("SELECT id, name FROM categories WHERE deleted_at IS NULL")
     categories = cursor.fetchall()
     conn.close()
     return categories
 
 def add_product(name, description, price, category_id, photo_path):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("INSERT INTO products (name, description, price, category_id, photo_path) VALUES (?, ?, ?, ?, ?)",
                    (name, description, price, category_id, photo_path))
     conn.commit()
     conn.close()
+    invalidate_page_cache()
+
+def set_product_photo(product_id, photo_path):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE products SET photo_path = ? WHERE id = ? AND deleted_at IS NULL", (photo_path, product_id))
+    updated = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    invalidate_page_cache(catalog=False)
+    return updated
+
+def get_product_photo(product_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT photo_path FROM products WHERE id = ?", (product_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def get_categories_page(cursor_id=0, limit=10, backward=False):
+    """
+    Страница категорий по ключу id: [(id, name), ...], не больше limit + 1 строк.
+    """
+    def load():
+        conn = get_connection()
+        cursor = conn.cursor()
+        rows = keyset_page(
+            cursor,
+            "SELECT id, name FROM categories WHERE id > ? AND deleted_at IS NULL ORDER BY id LIMIT ?",
+            "SELECT id, name FROM categories WHERE id < ? AND deleted_at IS NULL ORDER BY id DESC LIMIT ?",
+            (), cursor_id, limit, backward
+        )
+        conn.close()
+        return rows
+    return cached_page(("categories", None, cursor_id, backward, limit), load)
+
+def get_products_page(category_id, cursor_id=0, limit=10, backward=False):
+    """
+    Страница товаров категории по ключу id: [(id, name, description, price, photo_path), ...].
+    """
+    def load():
+        conn = get_connection()
+        cursor = conn.cursor()
+        rows = keyset_page(
+            cursor,
+            "SELECT id, name, description, price, photo_path FROM products WHERE category_id = ? AND id > ? AND deleted_at IS NULL ORDER BY id LIMIT ?",
+            "SELECT id, name, description, price, photo_path FROM products WHERE category_id = ? AND id < ? AND deleted_at IS NULL ORDER BY id DESC LIMIT ?",
+            (category_id,), cursor_id, limit, backward
+        )
+        conn.close()
+        return rows
+    return cached_page(("products", category_id, cursor_id, backward, limit), load)
+
+def get_product_counts(category_ids):
+    """
+    Количество товаров по категориям одним сгруппированным запросом: {category_id: count}.
+    Категории без товаров в ответ не попадают.
+    """
+    ids = list(category_ids)
+    if not ids:
+        return {}
+    conn = get_connection()
+    cursor = conn.cursor()
+    placeholders = ",".join("?" * len(ids))
+    cursor.execute(
+        f"SELECT category_id, COUNT(*) FROM products WHERE category_id IN ({placeholders}) AND deleted_at IS NULL GROUP BY category_id",
+        ids
+    )
+    counts = dict(cursor.fetchall())
+    conn.close()
+    return counts
+
+def get_category_with_count(category_id):
+    """
+    Категория вместе с количеством товаров: (id, name, count) или None.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.id, c.name, (SELECT COUNT(*) FROM products p WHERE p.category_id = c.id AND p.deleted_at IS NULL)
+        FROM categories c
+        WHERE c.id = ? AND c.deleted_at IS NULL
+    """, (category_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row
 
 def get_products_by_category(category_id):
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, name, description, price, photo_path FROM products WHERE category_id = ?", (category_id,))
+    cursor.execute("SELECT id, name, description, price, photo_path FROM products WHERE category_id = ? AND deleted_at IS NULL", (category_id,))
     products = cursor.fetchall()
     conn.close()
     return products
@@ -145,22 +524,30 @@ def get_user_profile(telegram_id):
     """
     Получить профиль пользователя: имя и счет.
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT telegram_id, stars FROM users WHERE telegram_id = ?", (telegram_id,))
     user = cursor.fetchone()
     conn.close()
     return user  # (telegram_id, stars) или None
 
+def get_user_balance(telegram_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(balance, 0) FROM users WHERE telegram_id = ?", (telegram_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else 0
+
 def get_purchase_history(telegram_id):
     """
-    Получить историю покупок пользователя.
+    Получить историю покупок пользователя (включая перенесённые в архив).
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT p.id, pr.name, pr.price, p.created_at
-        FROM purchases p
+        FROM purchases_all p
         JOIN users u ON p.user_id = u.id
         JOIN products pr ON p.product_id = pr.id
         WHERE u.telegram_id = ?
@@ -169,3 +556,118 @@ def get_purchase_history(telegram_id):
     purchases = cursor.fetchall()
     conn.close()
     return purchases  # [(purchase_id, product_name, price, created_at), ...]
+
+def _delete_products_where(cursor, where, params=()):
+    """
+    Удаляет товары, подходящие под условие where, вместе с автовыдачей, пулом единиц, покупками и платежами —
+    по одному set-based запросу на таблицу вместо цикла по товарам.
+    """
+    products = f"SELECT id FROM products WHERE {where}"
+    cursor.execute(f"DELETE FROM autodeliveries WHERE product_id IN ({products})", params)
+    cursor.execute(f"DELETE FROM stock_items WHERE product_id IN ({products})", params)
+    cursor.execute(f"DELETE FROM stock_reservations WHERE product_id IN ({products})", params)
+    cursor.execute(f"DELETE FROM product_stock WHERE product_id IN ({products})", params)
+    cursor.execute(f"DELETE FROM payments WHERE purchase_id IN (SELECT id FROM purchases WHERE product_id IN ({products}))", params)
+    cursor.execute(f"DELETE FROM purchases WHERE product_id IN ({products})", params)
+    cursor.execute(f"DELETE FROM products WHERE {where}", params)
+    return cursor.rowcount
+
+def delete_category(category_id, soft=None):
+    """
+    Удаляет категорию со всеми товарами одной транзакцией.
+    В режиме мягкого удаления только скрывает их; физически удалит purge_soft_deleted().
+    Возвращает число удалённых товаров или None, если категории нет.
+    """
+    soft = SOFT_DELETE if soft is None else soft
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM categories WHERE id = ? AND deleted_at IS NULL", (category_id,))
+    if not cursor.fetchone():
+        conn.close()
+        return None
+    if soft:
+        now = datetime.utcnow().isoformat()
+        cursor.execute("UPDATE products SET deleted_at = ? WHERE category_id = ? AND deleted_at IS NULL", (now, category_id))
+        count = cursor.rowcount
+        cursor.execute("UPDATE categories SET deleted_at = ? WHERE id = ?", (now, category_id))
+    else:
+        count = _delete_products_where(cursor, "category_id = ?", (category_id,))
+        cursor.execute("DELETE FROM categories WHERE id = ?", (category_id,))
+    conn.commit()
+    conn.close()
+    invalidate_page_cache()
+    return count
+
+def get_category_id_by_name(name):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM categories WHERE name = ? AND deleted_at IS NULL", (name,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def delete_product(product_id, soft=None):
+    """
+    Удаляет товар вместе с автовыдачей, покупками и платежами (или скрывает его в режиме мягкого удаления).
+    Возвращает True, если товар был.
+    """
+    soft = SOFT_DELETE if soft is None else soft
+    conn = get_connection()
+    cursor = conn.cursor()
+    if soft:
+        cursor.execute("UPDATE products SET deleted_at = ? WHERE id = ? AND deleted_at IS NULL",
+                       (datetime.utcnow().isoformat(), product_id))
+        found = cursor.rowcount > 0
+    else:
+        found = _delete_products_where(cursor, "id = ?", (product_id,)) > 0
+    conn.commit()
+    conn.close()
+    invalidate_page_cache()
+    return found
+
+def delete_catalog(soft=None):
+    """
+    Удаляет весь каталог: категории, товары, автовыдачу, покупки и платежи.
+    """
+    soft = SOFT_DELETE if soft is None else soft
+    conn = get_connection()
+    cursor = conn.cursor()
+    if soft:
+        now = datetime.utcnow().isoformat()
+        cursor.execute("UPDATE products SET deleted_at = ? WHERE deleted_at IS NULL", (now,))
+        cursor.execute("UPDATE categories SET deleted_at = ? WHERE deleted_at IS NULL", (now,))
+    else:
+        cursor.execute("DELETE FROM autodeliveries")
+        cursor.execute("DELETE FROM stock_items")
+        cursor.execute("DELETE FROM stock_reservations")
+        cursor.execute("DELETE FROM product_stock")
+        cursor.execute("DELETE FROM payments")
+        cursor.execute("DELETE FROM purchases")
+        cursor.execute("DELETE FROM products")
+        cursor.execute("DELETE FROM categories")
+    conn.commit()
+    conn.close()
+    invalidate_page_cache()
+
+def purge_soft_deleted(batch_size=PURGE_BATCH_SIZE):
+    """
+    Физически удаляет одну пачку скрытых товаров (и пустые скрытые категории) короткой транзакцией,
+    чтобы не держать блокировку записи. Возвращает число удалённых товаров; 0 — чистить больше нечего.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM products WHERE deleted_at IS NOT NULL LIMIT ?", (batch_size,))
+    ids = [row[0] for row in cursor.fetchall()]
+    count = 0
+    if ids:
+        placeholders = ",".join("?" * len(ids))
+        count = _delete_products_where(cursor, f"id IN ({placeholders})", ids)
+    else:
+        cursor.execute("""
+            DELETE FROM categories
+            WHERE deleted_at IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM products p WHERE p.category_id = categories.id)
+        """)
+    conn.commit()
+    conn.close()
+    return count
@@ -0,0 +1,109 @@
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "50"))
+
+# normalized sql -> [count, total_ms, max_ms]
+query_stats = {}
+_stats_lock = threading.Lock()
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Приводит запрос к шаблону: литералы заменяются на ?, списки IN (?, ?, ...) схлопываются.
+    """
+    text = _SPACE_RE.sub(" ", sql).strip()
+    text = _STRING_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    return _IN_LIST_RE.sub("(?)", text)
+
+
+def _explain(conn: sqlite3.Connection, sql: str, parameters) -> str:
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return ""
+    try:
+        cur = sqlite3.Cursor(conn)
+        cur.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+        rows = cur.fetchall()
+        cur.close()
+        return "\n".join(f"  {row[-1]}" for row in rows)
+    except Exception as e:
+        return f"  (EXPLAIN failed: {e})"
+
+
+def _record(conn: sqlite3.Connection, sql: str, parameters, elapsed_ms: float, many: bool = False):
+    key = normalize_sql(sql)
+    with _stats_lock:
+        entry = query_stats.get(key)
+        if entry is None:
+            query_stats[key] = [1, elapsed_ms, elapsed_ms]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed_ms
+            if elapsed_ms > entry[2]:
+                entry[2] = elapsed_ms
+
+    if elapsed_ms >= SQL_SLOW_MS:
+        plan = "" if many else _explain(conn, sql, parameters)
+        logging.warning(f"Slow query ({elapsed_ms:.1f} ms): {key}" + (f"\n{plan}" if plan else ""))
+
+
+class TracingCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(self.connection, sql, parameters, (time.perf_counter() - started) * 1000)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record(self.connection, sql, (), (time.perf_counter() - started) * 1000, many=True)
+
+
+class TracingConnection(sqlite3.Connection):
+    """
+    Соединение, которое замеряет каждый запрос. Используется как factory для sqlite3.connect.
+    """
+
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def get_top_queries(limit: int = 10):
+    """
+    Худшие запросы по суммарному времени: [(sql, count, total_ms, max_ms), ...].
+    """
+    with _stats_lock:
+        rows = [(sql, count, total, peak) for sql, (count, total, peak) in query_stats.items()]
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:limit]
+
+
+def format_top_queries(limit: int = 10) -> str:
+    rows = get_top_queries(limit)
+    if not rows:
+        return ""
+    lines = [f"Top {len(rows)} queries by total time:"]
+    for sql, count, total, peak in rows:
+        lines.append(f"{total:9.1f} ms total | {count:6d} calls | {total / count:7.2f} avg | {peak:7.1f} max | {sql[:200]}")
+    return "\n".join(lines)
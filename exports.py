@@ -0,0 +1,56 @@
+import csv
+import gzip
+from datetime import date, timedelta
+from typing import Optional
+
+from db_helpers import get_connection
+
+EXPORT_FETCH_SIZE = 1000
+
+EXPORT_COLUMNS = (
+    "purchase_id", "created_at", "telegram_id", "product_id", "product_name", "amount",
+    "delivery_status", "payment_id", "invoice_id", "payment_method", "payment_status", "payment_created_at"
+)
+
+
+def export_orders_csv(path: str, date_from: date, date_to: date, status: Optional[str] = None) -> int:
+    """
+    Пишет покупки с платежами за [date_from, date_to] в gzip-CSV, читая курсор пачками по
+    EXPORT_FETCH_SIZE строк — память не зависит от размера таблиц.
+    Читает purchases_all/payments_all, поэтому в выгрузку попадают и заказы, уже перенесённые в архив.
+    amount — сумма, выставленная при заказе (у старых покупок без неё — цена товара).
+    status фильтрует по статусу платежа или доставки. Возвращает число строк.
+    Синхронная функция — из бота вызывать через asyncio.to_thread.
+    """
+    sql = """
+        SELECT p.id, p.created_at, u.telegram_id, p.product_id, pr.name, COALESCE(p.amount, pr.price),
+               p.status, pm.id, pm.invoice_id, pm.method, pm.status, pm.created_at
+        FROM purchases_all p
+        LEFT JOIN users u ON u.id = p.user_id
+        LEFT JOIN products pr ON pr.id = p.product_id
+        LEFT JOIN payments_all pm ON pm.purchase_id = p.id
+        WHERE p.created_at >= ? AND p.created_at < ?
+    """
+    params = [date_from.isoformat(), (date_to + timedelta(days=1)).isoformat()]
+    if status:
+        sql += " AND ? IN (pm.status, p.status)"
+        params.append(status)
+    sql += " ORDER BY p.created_at, p.id"
+
+    count = 0
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS)
+            while True:
+                rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                count += len(rows)
+    finally:
+        conn.close()
+    return count
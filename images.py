@@ -0,0 +1,183 @@
+import io
+import os
+import time
+import hashlib
+from datetime import datetime
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+from config import PHOTO_DIR, PHOTO_MAX_SIDE, PHOTO_JPEG_QUALITY
+from db_helpers import get_connection
+
+# Больше этого числа пикселей не открываем — защита от «бомб» из крошечных файлов с огромными размерами
+MAX_SOURCE_PIXELS = 50_000_000
+
+# Файл без ссылок из products моложе этого срока не удаляется: его могли только что сохранить
+# для товара, который ещё не записан (store_photo и add_product/set_product_photo — разные шаги)
+ORPHAN_GRACE_SECONDS = 3600
+
+# photo_path -> file_id, под которым Telegram уже хранит это фото. Файлы адресуются по содержимому,
+# поэтому путь однозначно определяет картинку и file_id можно переиспользовать для всех отправок.
+_file_ids = {}
+
+
+def ensure_photo_tables():
+    """
+    file_id загруженных в Telegram фото: переживают перезапуск и общие для всех воркеров.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS photo_file_ids (
+            photo_path TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            created_at TEXT
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+
+def normalize_image(data: bytes) -> bytes:
+    """
+    Приводит картинку к виду, удобному для Telegram: поворот по EXIF, RGB, длинная сторона
+    не больше PHOTO_MAX_SIDE, JPEG с качеством PHOTO_JPEG_QUALITY. Метаданные (EXIF, GPS, ICC)
+    не копируются. Бросает ValueError, если это не картинка или она слишком велика.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.width * image.height > MAX_SOURCE_PIXELS:
+            raise ValueError(f"изображение слишком большое: {image.width}×{image.height}")
+        # JPEG декодируется сразу в уменьшенном масштабе — на больших фото это в разы быстрее
+        image.draft("RGB", (PHOTO_MAX_SIDE, PHOTO_MAX_SIDE))
+        image = ImageOps.exif_transpose(image)
+    except Image.DecompressionBombError as e:
+        raise ValueError("изображение слишком большое") from e
+    except OSError as e:
+        raise ValueError("файл не похож на изображение") from e
+
+    if image.mode in ("RGBA", "LA", "P"):
+        # Прозрачность в JPEG не поддерживается — кладём на белый фон
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((PHOTO_MAX_SIDE, PHOTO_MAX_SIDE), Image.LANCZOS)
+
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=PHOTO_JPEG_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def store_photo(data: bytes) -> str:
+    """
+    Нормализует картинку и сохраняет её в PHOTO_DIR под именем sha256 результата.
+    Одинаковые картинки ложатся в один файл. Возвращает путь для products.photo_path.
+    """
+    normalized = normalize_image(data)
+    digest = hashlib.sha256(normalized).hexdigest()
+    directory = os.path.join(PHOTO_DIR, digest[:2])
+    path = os.path.join(directory, f"{digest}.jpg")
+    if os.path.exists(path):
+        # Продлеваем срок, в течение которого sweep_unused_photos не тронет ещё не привязанный файл
+        os.utime(path)
+    else:
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(normalized)
+        os.replace(tmp_path, path)
+    return path
+
+
+def get_photo_file_id(photo_path: str) -> Optional[str]:
+    file_id = _file_ids.get(photo_path)
+    if file_id is None:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT file_id FROM photo_file_ids WHERE photo_path = ?", (photo_path,))
+        row = cursor.fetchone()
+        conn.close()
+        if row:
+            file_id = _file_ids[photo_path] = row[0]
+    return file_id
+
+
+def remember_photo_file_id(photo_path: str, file_id: Optional[str]):
+    """
+    Запоминает file_id после первой загрузки фото; None — забыть (Telegram его больше не принимает).
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    if file_id:
+        _file_ids[photo_path] = file_id
+        cursor.execute(
+            "INSERT OR REPLACE INTO photo_file_ids(photo_path, file_id, created_at) VALUES (?, ?, ?)",
+            (photo_path, file_id, datetime.utcnow().isoformat())
+        )
+    else:
+        _file_ids.pop(photo_path, None)
+        cursor.execute("DELETE FROM photo_file_ids WHERE photo_path = ?", (photo_path,))
+    conn.commit()
+    conn.close()
+
+
+def _forget_photo(cursor, photo_path: str):
+    _file_ids.pop(photo_path, None)
+    cursor.execute("DELETE FROM photo_file_ids WHERE photo_path = ?", (photo_path,))
+    try:
+        os.remove(photo_path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_unused_photos(paths) -> int:
+    """
+    Удаляет из хранилища фото, на которые больше не ссылается ни один товар (например, после
+    замены фото). Файлы вне PHOTO_DIR не трогаются. Возвращает число удалённых файлов.
+    """
+    root = os.path.abspath(PHOTO_DIR) + os.sep
+    candidates = {path for path in paths if path and os.path.abspath(path).startswith(root)}
+    if not candidates:
+        return 0
+    conn = get_connection()
+    cursor = conn.cursor()
+    removed = 0
+    for path in candidates:
+        cursor.execute("SELECT 1 FROM products WHERE photo_path = ? LIMIT 1", (path,))
+        if cursor.fetchone() is None:
+            _forget_photo(cursor, path)
+            removed += 1
+    conn.commit()
+    conn.close()
+    return removed
+
+
+def sweep_unused_photos(grace_seconds: float = ORPHAN_GRACE_SECONDS) -> int:
+    """
+    Удаляет файлы PHOTO_DIR, на которые не ссылается ни один товар, включая скрытые, — остатки
+    удалённых товаров и категорий. Синхронная функция — из бота вызывать через asyncio.to_thread.
+    """
+    if not os.path.isdir(PHOTO_DIR):
+        return 0
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT photo_path FROM products WHERE photo_path IS NOT NULL")
+    used = {os.path.abspath(row[0]) for row in cursor.fetchall()}
+    deadline = time.time() - grace_seconds
+    removed = 0
+    for directory in os.scandir(PHOTO_DIR):
+        if not directory.is_dir():
+            continue
+        for entry in os.scandir(directory.path):
+            if not entry.name.endswith(".jpg") or os.path.abspath(entry.path) in used:
+                continue
+            if entry.stat().st_mtime < deadline:
+                _forget_photo(cursor, os.path.join(PHOTO_DIR, directory.name, entry.name))
+                removed += 1
+    conn.commit()
+    conn.close()
+    return removed
@@ -0,0 +1,134 @@
+import re
+import time
+import bisect
+import asyncio
+import logging
+from typing import List, Optional
+
+import db_helpers
+from config import INLINE_INDEX_TTL
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+class CatalogPrefixIndex:
+    """
+    In-memory индекс каталога для inline-режима: отсортированные слова и параллельный им список
+    id товаров, префиксный поиск — двумя bisect'ами. Перестраивается, когда меняется каталог или истекает TTL.
+    Перестройка идёт в отдельном потоке, а запросы до её окончания обслуживает прежний индекс.
+    """
+
+    def __init__(self, ttl: int = INLINE_INDEX_TTL):
+        self.ttl = ttl
+        self.version = None
+        self.built_at = 0.0
+        # Два плоских списка вместо списка пар: строки и числа сборщик мусора не обходит,
+        # а сотни тысяч кортежей заметно удлиняли бы каждую полную сборку в процессе
+        self.tokens: List[str] = []
+        self.ids: List[int] = []
+        self.name_tokens = {}
+        self.products = {}
+        self.order: List[int] = []
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _stale(self) -> bool:
+        return self.version != db_helpers.catalog_version or time.monotonic() - self.built_at > self.ttl
+
+    @staticmethod
+    def _build():
+        """
+        Читает каталог и строит индекс. Синхронная функция — выполняется в asyncio.to_thread.
+        """
+        # Версию берём до чтения: изменение каталога во время перестройки снова сделает индекс устаревшим
+        version = db_helpers.catalog_version
+        products = {}
+        name_tokens = {}
+        postings = {}
+        for product_id, name, description, price in db_helpers.get_products():
+            products[product_id] = (product_id, name, description, price)
+            names = set(_tokens(name))
+            name_tokens[product_id] = tuple(names)
+            for token in names | set(_tokens(description)):
+                postings.setdefault(token, []).append(product_id)
+        # Сортируем только уникальные слова, а не все пары: одна сортировка держит GIL целиком
+        # и на большом каталоге останавливала бы цикл событий, хоть и идёт в другом потоке
+        tokens = []
+        ids = []
+        for token in sorted(postings):
+            product_ids = postings[token]
+            tokens.extend([token] * len(product_ids))
+            ids.extend(sorted(product_ids))
+        return version, tokens, ids, name_tokens, products, sorted(products)
+
+    async def _rebuild(self):
+        try:
+            built = await asyncio.to_thread(self._build)
+            # Освобождение сотен тысяч объектов прежнего индекса тоже заметно, поэтому последняя
+            # ссылка на него отпускается в потоке
+            garbage = [(self.tokens, self.ids, self.name_tokens, self.products, self.order)]
+            # Подмена целиком в потоке цикла событий: поиск не увидит наполовину обновлённый индекс
+            self.version, self.tokens, self.ids, self.name_tokens, self.products, self.order = built
+            self.built_at = time.monotonic()
+            del built
+            await asyncio.to_thread(garbage.clear)
+        finally:
+            self._refresh_task = None
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Error rebuilding inline catalog index: {task.exception()}")
+
+    async def refresh(self):
+        """
+        Запускает перестройку, если индекс устарел. Пока индекса нет совсем, ждёт её окончания.
+        """
+        if not self._stale():
+            return
+        task = self._refresh_task
+        if task is None:
+            task = self._refresh_task = asyncio.create_task(self._rebuild())
+            task.add_done_callback(self._log_refresh_error)
+        if self.version is None:
+            await asyncio.shield(task)
+
+    def _prefix_ids(self, prefix: str) -> set:
+        lo = bisect.bisect_left(self.tokens, prefix)
+        hi = bisect.bisect_left(self.tokens, prefix + "\uffff")
+        return set(self.ids[lo:hi])
+
+    async def search(self, query: str, offset: int = 0, limit: int = 20):
+        """
+        Товары, где каждое слово запроса — префикс слова из названия или описания.
+        Совпадения по названию идут первыми. Возвращает (products, next_offset или None).
+        """
+        await self.refresh()
+
+        tokens = _tokens(query)
+        if not tokens:
+            ids = self.order
+        else:
+            matched = None
+            for token in tokens:
+                found = self._prefix_ids(token)
+                matched = found if matched is None else matched & found
+                if not matched:
+                    return [], None
+
+            def rank(product_id):
+                names = self.name_tokens[product_id]
+                hits = sum(1 for token in tokens if any(name.startswith(token) for name in names))
+                return -hits, product_id
+
+            ids = sorted(matched, key=rank)
+
+        page = [self.products[product_id] for product_id in ids[offset:offset + limit]]
+        next_offset = offset + limit if offset + limit < len(ids) else None
+        return page, next_offset
+
+
+catalog_index = CatalogPrefixIndex()
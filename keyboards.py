@@ -1,60 +1,78 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from callbacks import cb
+
 def admin_menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="Управление категориями", callback_data="manage_categories"),
-             InlineKeyboardButton(text="Управление товарами", callback_data="manage_products")],
-            [InlineKeyboardButton(text="Добавить товар", callback_data="add_product_menu")],
-            [InlineKeyboardButton(text="Удалить каталог", callback_data="delete_catalog")],
-            [InlineKeyboardButton(text="Промокоды 🎟️", callback_data="manage_promos")],
-            [InlineKeyboardButton(text="Каталог 🛒", callback_data="catalog")]
+            [InlineKeyboardButton(text="Управление категориями", callback_data=cb("manage_categories")),
+             InlineKeyboardButton(text="Управление товарами", callback_data=cb("manage_products"))],
+            [InlineKeyboardButton(text="Добавить товар", callback_data=cb("add_product_menu")),
+             InlineKeyboardButton(text="Импорт товаров 📥", callback_data=cb("import_catalog"))],
+            [InlineKeyboardButton(text="Удалить каталог", callback_data=cb("delete_catalog")),
+             InlineKeyboardButton(text="Рассылка 📣", callback_data=cb("broadcast"))],
+            [InlineKeyboardButton(text="Промокоды 🎟️", callback_data=cb("manage_promos")),
+             InlineKeyboardButton(text="Продажи 📊", callback_data=cb("sales_dashboard"))],
+            [InlineKeyboardButton(text="Каталог 🛒", callback_data=cb("catalog"))]
         ]
     )
 
+def page_nav_row(action: str, rows, has_prev: bool, has_next: bool, *args) -> list:
+    """
+    Кнопки «назад/вперёд» для keyset-страницы; курсором служит id первой/последней строки.
+    args — аргументы действия перед курсором (например, id категории); обработчик получает
+    их и затем cursor_id, backward.
+    """
+    nav = []
+    if rows and has_prev:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=cb(action, *args, rows[0][0], True)))
+    if rows and has_next:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=cb(action, *args, rows[-1][0])))
+    return nav
+
 def main_menu_keyboard(uid: int = None) -> InlineKeyboardMarkup:
     """
     Главное меню с 2 категориями сверху, профилем посередине, 
     поддержкой и калькулятором, и FAQ внизу.
     """
     from config import ADMIN_IDS
-    from db_helpers import get_categories
+    from db_helpers import get_categories_page
     
-    categories = get_categories()
+    categories = get_categories_page(0, 2)[:2]
     inline = []
     
     # Добавляем первые 2 категории в верхний ряд
     if len(categories) >= 2:
         inline.append([
-            InlineKeyboardButton(text=f" {categories[0][1]}", callback_data=f"category_{categories[0][0]}"),
-            InlineKeyboardButton(text=f" {categories[1][1]}", callback_data=f"category_{categories[1][0]}")
+            InlineKeyboardButton(text=f" {categories[0][1]}", callback_data=cb("category", categories[0][0])),
+            InlineKeyboardButton(text=f" {categories[1][1]}", callback_data=cb("category", categories[1][0]))
         ])
     elif len(categories) == 1:
         inline.append([
-            InlineKeyboardButton(text=f" {categories[0][1]}", callback_data=f"category_{categories[0][0]}")
+            InlineKeyboardButton(text=f" {categories[0][1]}", callback_data=cb("category", categories[0][0]))
         ])
     
     # Профиль посередине
     inline.append([
-        InlineKeyboardButton(text="👤 Профиль", callback_data="profile")
+        InlineKeyboardButton(text="👤 Профиль", callback_data=cb("profile"))
     ])
     
     # Поддержка и Калькулятор рядом
     inline.append([
-        InlineKeyboardButton(text="💬 Поддержка", callback_data="support"),
-        InlineKeyboardButton(text="🧮 Калькулятор", callback_data="calculator")
+        InlineKeyboardButton(text="💬 Поддержка", callback_data=cb("support")),
+        InlineKeyboardButton(text="🧮 Калькулятор", callback_data=cb("calculator"))
     ])
     
     # Каталог (все категории) и FAQ внизу
     inline.append([
-        InlineKeyboardButton(text="📚 Каталог", callback_data="catalog"),
-        InlineKeyboardButton(text="❓ FAQ", callback_data="faq")
+        InlineKeyboardButton(text="📚 Каталог", callback_data=cb("catalog")),
+        InlineKeyboardButton(text="❓ FAQ", callback_data=cb("faq"))
     ])
     
     # Если админ, добавляем админ панель
     if uid and uid in ADMIN_IDS:
         inline.append([
-            InlineKeyboardButton(text="🔐 Админ-панель", callback_data="admin_panel")
+            InlineKeyboardButton(text="🔐 Админ-панель", callback_data=cb("admin_panel"))
         ])
     
     return InlineKeyboardMarkup(inline_keyboard=inline)
@@ -1,88 +1,165 @@
 import os
+import gc
 import asyncio
-import sqlite3
+import tempfile
 import logging
-from aiogram import Bot, Dispatcher, F
-from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from typing import Optional
+from datetime import datetime, date, timedelta
+from aiogram import Bot, Dispatcher
+from aiogram.filters import Command, CommandObject
+from aiogram.types import (
+    Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile,
+    InlineQuery, InlineQueryResultArticle, InputTextMessageContent, ChatMemberUpdated
+)
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 
-from config import BOT_TOKEN, ADMIN_IDS, USDT2RUB_RATE
+from config import (
+    BOT_TOKEN, ADMIN_IDS, USDT2RUB_RATE, SQL_REPORT_INTERVAL, SQL_REPORT_TOP, CATALOG_PAGE_SIZE,
+    INLINE_CACHE_TIME, PURGE_INTERVAL, ARCHIVE_INTERVAL, RESERVATION_TTL, RESERVATION_SWEEP_INTERVAL,
+    INVOICE_EXPIRES_IN, PENDING_PAYMENT_TTL, PAYMENT_CLEANUP_INTERVAL, WORKERS,
+    USER_FLUSH_INTERVAL, BROADCAST_POLL_INTERVAL, TELEGRAM_API_URL
+)
 from decorators import admin_only
-from keyboards import admin_menu_keyboard, main_menu_keyboard
-from utils import send_or_edit
-from states import AddProductState, PromoAdminState, UserPromoState, PurchaseState, DeleteState
+from keyboards import admin_menu_keyboard, main_menu_keyboard, page_nav_row
+from utils import send_or_edit, split_page
+from callbacks import cb, callback_router
+from profiler import ProfilerMiddleware, get_slowest_handlers
+from throttle import AntiFloodMiddleware, get_flood_stats
+from db_trace import format_top_queries
+from inline_search import catalog_index
+from catalog_import import import_catalog, IMPORT_FIELDS
+from exports import export_orders_csv
+from archive import archive_old_orders
+from sales import get_sales_summary
+from images import store_photo, remove_unused_photos, sweep_unused_photos
+from broadcast import create_broadcast, get_broadcast, cancel_broadcast, get_running_broadcast, run_broadcast, set_user_blocked
+from states import (
+    AddProductState, PromoAdminState, UserPromoState, PurchaseState, DeleteState, ImportState, StockState, BroadcastState,
+    ProductPhotoState
+)
 from database import (
-    ensure_promos_table, create_promo_in_db, get_promos_from_db, get_promo_by_id,
+    ensure_schema, create_promo_in_db, get_promos_page, get_promo_by_id,
     delete_promo_from_db, toggle_promo_active, get_promo_by_code,
-    ensure_payments_table, create_payment_entry, get_payment_by_id, update_payment_status_by_id, mark_purchase_paid,
-    ensure_autodeliveries_table, create_autodelivery, get_autodelivery_for_product
+    create_payment_entry, get_payment_by_id, update_payment_status_by_id, mark_purchase_paid,
+    create_autodelivery, get_autodelivery_for_product,
+    load_stock_items, claim_stock_item, get_stock_levels, set_purchase_status,
+    reserve_stock, release_reservation, release_expired_reservations, get_stale_payments, expire_payments, mark_payment_paid,
+    claim_order_for_delivery, pay_purchase_from_balance, redeem_promo
 )
-from crypto_payments import create_cryptopay_invoice, check_crypto_invoice_status
+from crypto_payments import create_cryptopay_invoice, check_crypto_invoice_status, get_invoice_statuses, close_crypto_client
 from db_helpers import (
-    init_db, add_user, get_categories, add_category, add_product,
-    get_products_by_category, get_product_by_id, create_purchase, DB_PATH
+    add_user, get_categories, add_category, add_product,
+    get_products_by_category, get_product_by_id, create_purchase, get_connection, DB_PATH,
+    get_categories_page, get_products_page, invalidate_page_cache, get_product_counts, get_category_with_count,
+    search_products, find_products_by_name,
+    get_category_id_by_name, delete_category, delete_product, delete_catalog, purge_soft_deleted,
+    load_known_users, flush_new_users, resolve_user_id, get_user_balance, set_product_photo, get_product_photo
 )
 
 logging.basicConfig(level=logging.INFO)
 
-# Initialize database BEFORE creating bot and dispatcher
-init_db()
-ensure_promos_table()
-ensure_autodeliveries_table()
-ensure_payments_table()
-
-bot = Bot(token=BOT_TOKEN)
+# Bot создаётся при запуске (см. __main__), а не при импорте модуля
+bot: Optional[Bot] = None
 dp = Dispatcher(storage=MemoryStorage())
+# Одно хранилище вёдер на сообщения и кнопки; антифлуд стоит первым, чтобы отброшенное не профилировалось
+anti_flood = AntiFloodMiddleware()
+dp.message.middleware(anti_flood)
+dp.callback_query.middleware(anti_flood)
+dp.message.middleware(ProfilerMiddleware())
+dp.callback_query.middleware(ProfilerMiddleware())
+
+@dp.callback_query(callback_router.resolve)
+async def route_callback(callback: CallbackQuery, state: FSMContext, callback_route, callback_args):
+    """
+    Единая точка входа для кнопок: обработчик выбирается по тегу действия в callback_router.
+    """
+    if callback_args is None:
+        await callback.answer("Кнопка устарела. Откройте меню заново.", show_alert=True)
+        return
+    await callback_route(callback, callback_args, state)
 
 @dp.message(Command("start"))
-async def start_command(message: Message):
+async def start_command(message: Message, state: FSMContext, command: CommandObject):
     add_user(message.from_user.id)
+
+    # Deep link из inline-режима: /start buy_<product_id>
+    args = (command.args or "").strip()
+    if args.startswith("buy_"):
+        try:
+            product_id = int(args.split("_", 1)[1])
+        except ValueError:
+            product_id = None
+        if product_id:
+            await show_product_for_purchase(message.chat.id, message, state, product_id)
+            return
+
     uid = message.from_user.id if message.from_user else None
     keyboard = main_menu_keyboard(uid)
     await send_or_edit(bot, message.chat.id, message, text="Добро пожаловать! Выберите действие:", reply_markup=keyboard)
 
-@dp.callback_query(F.data == "catalog")
-async def catalog_callback(callback: CallbackQuery):
-    categories = get_categories()
+@dp.message(Command("search"))
+async def search_command(message: Message, command: CommandObject):
+    query = (command.args or "").strip()
+    if not query:
+        await message.reply("Использование: /search <название или описание товара>")
+        return
+
+    products = search_products(query, limit=CATALOG_PAGE_SIZE)
+    if not products:
+        await send_or_edit(bot, message.chat.id, message, text=f"По запросу «{query}» ничего не найдено.",
+                           reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="◀️ Назад", callback_data=cb("back_to_start"))]]))
+        return
+
+    inline = []
+    for product_id, name, description, price, photo_path in products:
+        inline.append([InlineKeyboardButton(text=f" {name} — {price}₽", callback_data=cb("buy", product_id))])
+    inline.append([InlineKeyboardButton(text="◀️ Назад", callback_data=cb("back_to_start"))])
+    keyboard = InlineKeyboardMarkup(inline_keyboard=inline)
+    await send_or_edit(bot, message.chat.id, message, text=f"🔎 Результаты по запросу «{query}»:", reply_markup=keyboard)
+
+@callback_router("catalog")
+async def catalog_callback(callback: CallbackQuery, cursor_id: int = 0, backward: bool = False):
+    rows = get_categories_page(cursor_id, CATALOG_PAGE_SIZE, backward)
+    categories, has_prev, has_next = split_page(rows, CATALOG_PAGE_SIZE, cursor_id, backward)
     if not categories:
         await send_or_edit(bot, callback.message.chat.id, callback, text="Каталог пуст.")
         await callback.answer()
         return
 
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            *[
-                [InlineKeyboardButton(text=category_name, callback_data=f"category_{category_id}")]
-                for category_id, category_name in categories
-            ],
-            [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_start")]
-        ]
-    )
+    inline = [
+        [InlineKeyboardButton(text=category_name, callback_data=cb("category", category_id))]
+        for category_id, category_name in categories
+    ]
+    nav = page_nav_row("catalog", categories, has_prev, has_next)
+    if nav:
+        inline.append(nav)
+    inline.append([InlineKeyboardButton(text="◀️ Назад", callback_data=cb("back_to_start"))])
+    keyboard = InlineKeyboardMarkup(inline_keyboard=inline)
     await send_or_edit(bot, callback.message.chat.id, callback, text="Выберите категорию:", reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("category_"))
-async def category_callback(callback: CallbackQuery):
-    try:
-        category_id = int(callback.data.split("_", 1)[1])
-    except ValueError:
-        await callback.answer("Неверный ID категории.", show_alert=True)
-        return
-
-    products = get_products_by_category(category_id)
+@callback_router("category")
+async def category_callback(callback: CallbackQuery, category_id: int, cursor_id: int = 0, backward: bool = False):
+    rows = get_products_page(category_id, cursor_id, CATALOG_PAGE_SIZE, backward)
+    products, has_prev, has_next = split_page(rows, CATALOG_PAGE_SIZE, cursor_id, backward)
     if not products:
         await callback.message.reply("В этой категории пока нет товаров.")
         await callback.answer()
         return
 
-    # Показываем все товары как кнопки
+    # Показываем товары текущей страницы как кнопки
+    stock = get_stock_levels(p[0] for p in products)
     inline = []
     for product_id, name, description, price, photo_path in products:
         label = f" {name} — {price}₽"
-        inline.append([InlineKeyboardButton(text=label, callback_data=f"buy_{product_id}")])
-    inline.append([InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_start")])
+        if product_id in stock:
+            label += f" ({stock[product_id]} шт.)" if stock[product_id] > 0 else " (нет в наличии)"
+        inline.append([InlineKeyboardButton(text=label, callback_data=cb("buy", product_id))])
+    nav = page_nav_row("category", products, has_prev, has_next, category_id)
+    if nav:
+        inline.append(nav)
+    inline.append([InlineKeyboardButton(text="◀️ Назад", callback_data=cb("back_to_start"))])
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=inline)
     await send_or_edit(bot, callback.message.chat.id, callback, text="Товары в категории:", reply_markup=keyboard)
@@ -92,16 +169,8 @@ async def category_callback(callback: CallbackQuery):
 # async def show_product(callback: CallbackQuery, products, index, category_id):
 #     ...
 
-@dp.callback_query(F.data.startswith("product_"))
-async def product_navigation_callback(callback: CallbackQuery):
-    try:
-        _, category_id, index = callback.data.split("_")
-        category_id = int(category_id)
-        index = int(index)
-    except ValueError:
-        await callback.answer("Ошибка навигации.", show_alert=True)
-        return
-
+@callback_router("product")
+async def product_navigation_callback(callback: CallbackQuery, category_id: int, index: int):
     products = get_products_by_category(category_id)
     if not products or index < 0 or index >= len(products):
         await callback.answer("Товар не найден.", show_alert=True)
@@ -109,19 +178,19 @@ async def product_navigation_callback(callback: CallbackQuery):
 
     await show_product(callback, products, index, category_id)
 
-@dp.callback_query(F.data.startswith("buy_"))
-async def handle_buy_callback(callback: CallbackQuery, state: FSMContext):
-    try:
-        product_id = int(callback.data.split("_", 1)[1])
-    except ValueError:
-        await callback.answer("Неверный ID товара.", show_alert=True)
-        return
+@callback_router("buy")
+async def handle_buy_callback(callback: CallbackQuery, product_id: int, state: FSMContext):
+    await show_product_for_purchase(callback.message.chat.id, callback, state, product_id)
+    await callback.answer()
 
+async def show_product_for_purchase(chat_id: int, source_obj, state: FSMContext, product_id: int):
+    """
+    Карточка товара с вариантами оплаты; общая для кнопки «Купить» и deep link /start buy_<id>.
+    """
     product = get_product_by_id(product_id)
     if not product:
-        await send_or_edit(bot, callback.message.chat.id, callback, text="Товар не найден.")
-        await callback.answer()
-        await send_main_menu(callback.message.chat.id, callback)
+        await send_or_edit(bot, chat_id, source_obj, text="Товар не найден.")
+        await send_main_menu(chat_id, source_obj)
         return
 
     product_id, name, description, price = product
@@ -129,28 +198,91 @@ async def handle_buy_callback(callback: CallbackQuery, state: FSMContext):
     
     # Показываем информацию о товаре с фото
     text = f" <b>{name}</b>\n💰 Цена: {price} ₽\n\n{description}\n\n"
+    photo_path = get_product_photo(product_id)
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Ввести промокод", callback_data="apply_promo_in_purchase")],
-        [InlineKeyboardButton(text="Оплатить без промокода", callback_data="skip_promo_purchase")],
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_start")]
-    ])
-    await send_or_edit(bot, callback.message.chat.id, callback, text=text, reply_markup=keyboard, parse_mode="HTML")
-    await callback.answer()
+    stock = get_stock_levels([product_id])
+    if product_id in stock:
+        if stock[product_id] <= 0:
+            text += "❌ Нет в наличии"
+            keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("back_to_start"))]
+            ])
+            await send_or_edit(bot, chat_id, source_obj, text=text, photo_path=photo_path, reply_markup=keyboard, parse_mode="HTML")
+            return
+        text += f"📦 В наличии: {stock[product_id]} шт."
+    
+    rows = [
+        [InlineKeyboardButton(text="Ввести промокод", callback_data=cb("apply_promo_in_purchase"))],
+        [InlineKeyboardButton(text="Оплатить без промокода", callback_data=cb("skip_promo_purchase"))],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("back_to_start"))]
+    ]
+    balance = get_user_balance(source_obj.from_user.id)
+    if balance >= price:
+        rows.insert(0, [InlineKeyboardButton(text=f"💰 Оплатить с баланса ({balance} ₽)", callback_data=cb("pay_balance"))])
+    keyboard = InlineKeyboardMarkup(inline_keyboard=rows)
+    await send_or_edit(bot, chat_id, source_obj, text=text, photo_path=photo_path, reply_markup=keyboard, parse_mode="HTML")
+
+@dp.inline_query()
+async def inline_catalog_query(inline_query: InlineQuery):
+    try:
+        offset = int(inline_query.offset or 0)
+    except ValueError:
+        offset = 0
+
+    products, next_offset = await catalog_index.search(inline_query.query, offset=offset, limit=20)
+    me = await bot.me()
+
+    results = []
+    for product_id, name, description, price in products:
+        deep_link = f"https://t.me/{me.username}?start=buy_{product_id}"
+        results.append(InlineQueryResultArticle(
+            id=str(product_id),
+            title=f"{name} — {price} ₽",
+            description=(description or "")[:100],
+            input_message_content=InputTextMessageContent(message_text=f"🛒 {name}\n💰 Цена: {price} ₽\n\n{description or ''}"),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🛒 Купить", url=deep_link)]])
+        ))
+
+    # Результаты одинаковы для всех пользователей — пусть Telegram кэширует их на своей стороне
+    await inline_query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=str(next_offset) if next_offset is not None else ""
+    )
 
-@dp.callback_query(F.data == "apply_promo_in_purchase")
+@callback_router("apply_promo_in_purchase")
 async def apply_promo_in_purchase(callback: CallbackQuery, state: FSMContext):
     await callback.message.reply("Введите ваш промокод:")
     await state.set_state(PurchaseState.waiting_for_promo)
     await callback.answer()
 
+async def open_purchase(callback: CallbackQuery, product_id: int, final_price: int, state: FSMContext) -> Optional[int]:
+    """
+    Создаёт покупку с финальной ценой и резервирует под неё единицу товара.
+    None — товар закончился, пользователь уже предупреждён.
+    """
+    data = await state.get_data()
+    discount = max(0, (data.get("original_price") or final_price) - final_price)
+    purchase_id = create_purchase(callback.from_user.id, product_id, amount=final_price, discount=discount)
+    if not reserve_stock(product_id, purchase_id, RESERVATION_TTL):
+        set_purchase_status(purchase_id, "cancelled")
+        await bot.send_message(chat_id=callback.from_user.id, text="😔 Товар закончился или все единицы уже зарезервированы. Попробуйте позже.")
+        await state.clear()
+        return None
+    return purchase_id
+
 async def create_payment_with_data(callback: CallbackQuery, product_id: int, product_name: str, final_price: int, state: FSMContext):
     """
     Создаёт платёж с финальной ценой (после применения промокода).
     """
-    purchase_id = create_purchase(callback.from_user.id, product_id)
+    purchase_id = await open_purchase(callback, product_id, final_price, state)
+    if purchase_id is None:
+        return
 
-    invoice = await create_cryptopay_invoice(amount_rub=final_price, description=f"Order {purchase_id}: {product_name}")
+    invoice = await create_cryptopay_invoice(
+        amount_rub=final_price, description=f"Order {purchase_id}: {product_name}", expires_in=INVOICE_EXPIRES_IN
+    )
     if invoice:
         invoice_id, pay_url = invoice
         payment_id = create_payment_entry(purchase_id=purchase_id, invoice_id=invoice_id, pay_url=pay_url, method="crypto")
@@ -165,16 +297,48 @@ async def create_payment_with_data(callback: CallbackQuery, product_id: int, pro
 
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="Оплатить", url=pay_url)],
-            [InlineKeyboardButton(text="Проверить оплату", callback_data=f"checkpay_{payment_id}")],
-            [InlineKeyboardButton(text="Отменить заказ", callback_data=f"cancel_buy_{purchase_id}")]
+            [InlineKeyboardButton(text="Проверить оплату", callback_data=cb("checkpay", payment_id))],
+            [InlineKeyboardButton(text="Отменить заказ", callback_data=cb("cancel_buy", purchase_id))]
         ])
 
         await bot.send_message(chat_id=callback.from_user.id, text=text, reply_markup=keyboard)
     else:
+        release_reservation(purchase_id)
+        set_purchase_status(purchase_id, "cancelled")
         await bot.send_message(chat_id=callback.from_user.id, text="Не удалось создать платёжную ссылку. Свяжитесь с поддержкой.")
     
     await state.clear()
 
+@callback_router("pay_balance")
+async def pay_balance_callback(callback: CallbackQuery, state: FSMContext, with_promo: bool = False):
+    """
+    Оплата с баланса: без счёта в Cryptopay, заказ выдаётся сразу после списания.
+    """
+    data = await state.get_data()
+    product_id = data.get("product_id")
+    price = data.get("final_price") if with_promo else data.get("original_price")
+    if not product_id or price is None:
+        await send_main_menu(callback.message.chat.id, callback)
+        await callback.answer()
+        return
+
+    purchase_id = await open_purchase(callback, product_id, price, state)
+    if purchase_id is None:
+        await callback.answer()
+        return
+    if not pay_purchase_from_balance(purchase_id):
+        release_reservation(purchase_id)
+        set_purchase_status(purchase_id, "cancelled")
+        await callback.answer("❌ Недостаточно средств на балансе.", show_alert=True)
+        await state.clear()
+        return
+
+    await state.clear()
+    await callback.answer("✅ Оплачено с баланса")
+    await send_or_edit(bot, callback.message.chat.id, callback, text=f"✅ Заказ #{purchase_id} оплачен с баланса. Спасибо за покупку!")
+    await deliver_order(purchase_id, callback.from_user.id, product_id)
+    await notify_admins_about_purchase(purchase_id, callback.from_user)
+
 @dp.message(PurchaseState.waiting_for_promo)
 async def process_promo_in_purchase(message: Message, state: FSMContext):
     code = message.text.strip().upper()
@@ -217,14 +381,18 @@ async def process_promo_in_purchase(message: Message, state: FSMContext):
             from database import deactivate_promo_db
             deactivate_promo_db(pid)
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Подтвердить", callback_data="confirm_purchase_with_promo")],
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_purchase")]
-    ])
+    rows = [
+        [InlineKeyboardButton(text="✅ Подтвердить", callback_data=cb("confirm_purchase_with_promo"))],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data=cb("cancel_purchase"))]
+    ]
+    balance = get_user_balance(message.from_user.id)
+    if balance >= final_price:
+        rows.insert(1, [InlineKeyboardButton(text=f"💰 Оплатить с баланса ({balance} ₽)", callback_data=cb("pay_balance", True))])
+    keyboard = InlineKeyboardMarkup(inline_keyboard=rows)
     text = f"✅ Промокод применён!\n\n {product_name}\n💰 Исходная цена: {original_price} ₽\n🎟️ Скидка: -{amount} ₽\n💵 Итого: {final_price} ₽"
     await message.reply(text=text, reply_markup=keyboard)
 
-@dp.callback_query(F.data == "skip_promo_purchase")
+@callback_router("skip_promo_purchase")
 async def skip_promo_purchase(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     product_id = data.get("product_id")
@@ -239,7 +407,7 @@ async def skip_promo_purchase(callback: CallbackQuery, state: FSMContext):
     await create_payment_with_data(callback, product_id, product_name, original_price, state)
     await callback.answer()
 
-@dp.callback_query(F.data == "confirm_purchase_with_promo")
+@callback_router("confirm_purchase_with_promo")
 async def confirm_purchase_with_promo(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     product_id = data.get("product_id")
@@ -255,26 +423,26 @@ async def confirm_purchase_with_promo(callback: CallbackQuery, state: FSMContext
     await create_payment_with_data(callback, product_id, product_name, final_price, state)
     await callback.answer()
 
-@dp.callback_query(F.data == "cancel_purchase")
+@callback_router("cancel_purchase")
 async def cancel_purchase(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await send_main_menu(callback.message.chat.id, callback)
     await callback.answer()
 
-@dp.callback_query(F.data == "manage_promos")
+@callback_router("manage_promos")
 @admin_only
 async def manage_promos_callback(callback: CallbackQuery):
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="Добавить промокод", callback_data="add_promo")],
-            [InlineKeyboardButton(text="Список/Редактирование", callback_data="list_promos")],
-            [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_start")]
+            [InlineKeyboardButton(text="Добавить промокод", callback_data=cb("add_promo"))],
+            [InlineKeyboardButton(text="Список/Редактирование", callback_data=cb("list_promos"))],
+            [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("back_to_start"))]
         ]
     )
     await send_or_edit(bot, callback.message.chat.id, callback, text="Управление промокодами:", reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data == "add_promo")
+@callback_router("add_promo")
 @admin_only
 async def add_promo_start(callback: CallbackQuery, state: FSMContext):
     await callback.message.reply("Введите код промокода (текст):")
@@ -316,12 +484,13 @@ async def process_promo_uses(message: Message, state: FSMContext):
     await state.clear()
     await send_admin_menu(message.chat.id, message)
 
-@dp.callback_query(F.data == "list_promos")
+@callback_router("list_promos")
 @admin_only
-async def list_promos_callback(callback: CallbackQuery):
-    promos = get_promos_from_db()
+async def list_promos_callback(callback: CallbackQuery, cursor_id: int = 0, backward: bool = False):
+    rows = get_promos_page(cursor_id, CATALOG_PAGE_SIZE, backward)
+    promos, has_prev, has_next = split_page(rows, CATALOG_PAGE_SIZE, cursor_id, backward)
     if not promos:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="◀️ Назад", callback_data="manage_promos")]])
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="◀️ Назад", callback_data=cb("manage_promos"))]])
         await send_or_edit(bot, callback.message.chat.id, callback, text="Промокодов пока нет.", reply_markup=keyboard)
         await callback.answer()
         return
@@ -329,22 +498,20 @@ async def list_promos_callback(callback: CallbackQuery):
     inline = []
     for pid, code, amount, uses_left, active, created_at in promos:
         label = f"{code} — +{amount}₽ — uses: {uses_left if uses_left is not None else '∞'} — {'ON' if active==1 else 'OFF'}"
-        inline.append([InlineKeyboardButton(text=label, callback_data=f"promo_info_{pid}")])
-        inline.append([InlineKeyboardButton(text="Вкл/Выкл", callback_data=f"toggle_promo_{pid}"),
-                       InlineKeyboardButton(text="Удалить", callback_data=f"delete_promo_{pid}")])
-    inline.append([InlineKeyboardButton(text="◀️ Назад", callback_data="manage_promos")])
+        inline.append([InlineKeyboardButton(text=label, callback_data=cb("promo_info", pid))])
+        inline.append([InlineKeyboardButton(text="Вкл/Выкл", callback_data=cb("toggle_promo", pid)),
+                       InlineKeyboardButton(text="Удалить", callback_data=cb("delete_promo", pid))])
+    nav = page_nav_row("list_promos", promos, has_prev, has_next)
+    if nav:
+        inline.append(nav)
+    inline.append([InlineKeyboardButton(text="◀️ Назад", callback_data=cb("manage_promos"))])
     keyboard = InlineKeyboardMarkup(inline_keyboard=inline)
     await send_or_edit(bot, callback.message.chat.id, callback, text="Список промокодов:", reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("promo_info_"))
+@callback_router("promo_info")
 @admin_only
-async def promo_info_callback(callback: CallbackQuery):
-    try:
-        pid = int(callback.data.split("_")[2])
-    except ValueError:
-        await callback.answer("Неверный ID.", show_alert=True)
-        return
+async def promo_info_callback(callback: CallbackQuery, pid: int):
     promo = get_promo_by_id(pid)
     if not promo:
         await callback.answer("Промокод не найден.", show_alert=True)
@@ -352,33 +519,23 @@ async def promo_info_callback(callback: CallbackQuery):
     pid, code, amount, uses_left, active = promo
     text = f"Код: {code}\nСумма: {amount} ₽\nИспользований осталось: {uses_left if uses_left is not None else '∞'}\nСтатус: {'активен' if active==1 else 'отключён'}"
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Вкл/Выкл", callback_data=f"toggle_promo_{pid}"), InlineKeyboardButton(text="Удалить", callback_data=f"delete_promo_{pid}")],
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="list_promos")]
+        [InlineKeyboardButton(text="Вкл/Выкл", callback_data=cb("toggle_promo", pid)), InlineKeyboardButton(text="Удалить", callback_data=cb("delete_promo", pid))],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("list_promos"))]
     ])
     await send_or_edit(bot, callback.message.chat.id, callback, text=text, reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("delete_promo_"))
+@callback_router("delete_promo")
 @admin_only
-async def delete_promo_callback(callback: CallbackQuery):
-    try:
-        pid = int(callback.data.split("_")[2])
-    except ValueError:
-        await callback.answer("Неверный ID.", show_alert=True)
-        return
+async def delete_promo_callback(callback: CallbackQuery, pid: int):
     delete_promo_from_db(pid)
     await callback.answer("Промокод удалён.")
     await send_or_edit(bot, callback.message.chat.id, callback, text="Промокод удалён.")
     await send_admin_menu(callback.message.chat.id, callback)
     
-@dp.callback_query(F.data.startswith("toggle_promo_"))
+@callback_router("toggle_promo")
 @admin_only
-async def toggle_promo_callback(callback: CallbackQuery):
-    try:
-        pid = int(callback.data.split("_")[2])
-    except ValueError:
-        await callback.answer("Неверный ID.", show_alert=True)
-        return
+async def toggle_promo_callback(callback: CallbackQuery, pid: int):
     new_state = toggle_promo_active(pid)
     if new_state is None:
         await callback.answer("Промокод не найден.", show_alert=True)
@@ -387,7 +544,7 @@ async def toggle_promo_callback(callback: CallbackQuery):
     await send_or_edit(bot, callback.message.chat.id, callback, text="Статус промокода изменён.")
     await send_admin_menu(callback.message.chat.id, callback)
 
-@dp.callback_query(F.data == "promo")
+@callback_router("promo")
 async def user_promo_prompt(callback: CallbackQuery, state: FSMContext):
     await callback.message.reply("Введите ваш промокод (текст):")
     await state.set_state(UserPromoState.waiting_for_code)
@@ -414,20 +571,18 @@ async def apply_promo_code(message: Message, state: FSMContext):
         await send_main_menu(message.chat.id, message)
         return
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET balance = COALESCE(balance, 0) + ? WHERE telegram_id = ?", (amount, message.from_user.id))
-    if cursor.rowcount == 0:
-        cursor.execute("INSERT OR REPLACE INTO users(telegram_id, balance) VALUES (?, ?)", (message.from_user.id, amount))
-    if uses_left is not None:
-        new_uses = uses_left - 1
-        cursor.execute("UPDATE promocodes SET uses_left = ? WHERE id = ?", (new_uses, pid))
-        if new_uses <= 0:
-            cursor.execute("UPDATE promocodes SET active = 0 WHERE id = ?", (pid,))
-    conn.commit()
+    conn = get_connection()
+    user_id = resolve_user_id(conn.cursor(), message.from_user.id)
     conn.close()
+    credited = redeem_promo(pid, user_id) if user_id is not None else None
+    if credited is None:
+        # Код уже применён этим пользователем или последнее использование забрали параллельно
+        await message.reply("Промокод уже использован или больше недоступен.")
+        await state.clear()
+        await send_main_menu(message.chat.id, message)
+        return
 
-    await message.reply(f"Промокод применён! Вам зачислено {amount} ₽.")
+    await message.reply(f"Промокод применён! Вам зачислено {credited} ₽.")
     await state.clear()
     await send_main_menu(message.chat.id, message)
 
@@ -438,6 +593,86 @@ async def admin_command(message: Message):
     else:
         await message.reply("Доступ запрещён. Эта команда доступна только администраторам.")
 
+@dp.message(Command("slow"))
+async def slow_handlers_command(message: Message):
+    if message.from_user and message.from_user.id not in ADMIN_IDS:
+        await message.reply("Доступ запрещён. Команда доступна только администраторам.")
+        return
+
+    rows = get_slowest_handlers()
+    if not rows:
+        await message.reply("Медленных обработчиков пока не зафиксировано.")
+        return
+
+    lines = ["🐢 Самые медленные обработчики:\n"]
+    for name, elapsed_ms, ts, path in rows:
+        when = datetime.fromtimestamp(ts).strftime("%d.%m %H:%M:%S")
+        lines.append(f"{name} — {elapsed_ms:.0f} мс ({when})" + (f"\n  {path}" if path else ""))
+    await message.reply("\n".join(lines))
+
+@dp.message(Command("floodstats"))
+async def flood_stats_command(message: Message):
+    if message.from_user and message.from_user.id not in ADMIN_IDS:
+        await message.reply("Доступ запрещён. Команда доступна только администраторам.")
+        return
+
+    totals, top = get_flood_stats()
+    if not totals:
+        await message.reply("Отклонённых запросов пока нет.")
+        return
+
+    lines = ["🚦 Отклонено антифлудом: " + ", ".join(f"{kind} — {count}" for kind, count in totals.items()), ""]
+    lines.extend(f"{name} ({kind}) — {count}" for kind, name, count in top)
+    await message.reply("\n".join(lines))
+
+@dp.message(Command("sqlstats"))
+async def sql_stats_command(message: Message):
+    if message.from_user and message.from_user.id not in ADMIN_IDS:
+        await message.reply("Доступ запрещён. Команда доступна только администраторам.")
+        return
+
+    report = format_top_queries(SQL_REPORT_TOP)
+    if not report:
+        await message.reply("Статистика запросов пока пуста.")
+        return
+    await message.reply(report[:4000])
+
+@dp.message(Command("export"))
+async def export_orders_command(message: Message, command: CommandObject):
+    if message.from_user and message.from_user.id not in ADMIN_IDS:
+        await message.reply("Доступ запрещён. Команда доступна только администраторам.")
+        return
+
+    # /export [с YYYY-MM-DD] [по YYYY-MM-DD] [статус]
+    args = (command.args or "").split()
+    try:
+        date_to = date.fromisoformat(args[1]) if len(args) > 1 else date.today()
+        date_from = date.fromisoformat(args[0]) if args else date_to - timedelta(days=30)
+    except ValueError:
+        await message.reply("Использование: /export [YYYY-MM-DD] [YYYY-MM-DD] [pending|paid|delivered|...]")
+        return
+    status = args[2] if len(args) > 2 else None
+
+    await message.reply("⏳ Готовлю выгрузку...")
+    fd, tmp_path = tempfile.mkstemp(suffix=".csv.gz")
+    os.close(fd)
+    try:
+        count = await asyncio.to_thread(export_orders_csv, tmp_path, date_from, date_to, status)
+        filename = f"orders_{date_from.isoformat()}_{date_to.isoformat()}{'_' + status if status else ''}.csv.gz"
+        await bot.send_document(
+            chat_id=message.chat.id,
+            document=FSInputFile(tmp_path, filename=filename),
+            caption=f"📄 Заказы с {date_from.isoformat()} по {date_to.isoformat()}: {count} строк"
+        )
+    except Exception as e:
+        logging.error(f"Error exporting orders: {e}")
+        await message.reply(f"❌ Ошибка выгрузки: {str(e)}")
+    finally:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
 @dp.message(Command("delete_category"))
 async def delete_category_command(message: Message, state: FSMContext):
     if message.from_user and message.from_user.id not in ADMIN_IDS:
@@ -452,41 +687,16 @@ async def process_delete_category_name(message: Message, state: FSMContext):
     category_name = message.text.strip()
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute("PRAGMA foreign_keys = OFF")
-        cur = conn.cursor()
-        
-        # Получаем ID категории по названию
-        cur.execute("SELECT id FROM categories WHERE name = ?", (category_name,))
-        cat_row = cur.fetchone()
-        
-        if not cat_row:
+        cat_id = get_category_id_by_name(category_name)
+        if not cat_id:
             await message.reply(f"❌ Категория '{category_name}' не найдена.")
             await state.clear()
             return
         
-        cat_id = cat_row[0]
+        # Удаляем категорию вместе с товарами, покупками и платежами
+        count = delete_category(cat_id) or 0
         
-        # Получаем все товары в этой категории
-        cur.execute("SELECT id FROM products WHERE category_id = ?", (cat_id,))
-        products = cur.fetchall()
-        
-        # Удаляем платежи и покупки связанные с товарами
-        for (prod_id,) in products:
-            cur.execute("DELETE FROM autodeliveries WHERE product_id = ?", (prod_id,))
-            cur.execute("DELETE FROM payments WHERE purchase_id IN (SELECT id FROM purchases WHERE product_id = ?)", (prod_id,))
-            cur.execute("DELETE FROM purchases WHERE product_id = ?", (prod_id,))
-        
-        # Удаляем товары
-        cur.execute("DELETE FROM products WHERE category_id = ?", (cat_id,))
-        
-        # Удаляем категорию
-        cur.execute("DELETE FROM categories WHERE id = ?", (cat_id,))
-        
-        conn.commit()
-        conn.close()
-        
-        await message.reply(f"✅ Категория '{category_name}' удалена вместе с {len(products)} товарами.")
+        await message.reply(f"✅ Категория '{category_name}' удалена вместе с {count} товарами.")
         await state.clear()
     except Exception as e:
         logging.error(f"Error deleting category by name: {e}")
@@ -507,33 +717,23 @@ async def process_delete_product_name(message: Message, state: FSMContext):
     product_name = message.text.strip()
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute("PRAGMA foreign_keys = OFF")
-        cur = conn.cursor()
-        
-        # Получаем ID товара по названию
-        cur.execute("SELECT id FROM products WHERE name = ?", (product_name,))
-        prod_row = cur.fetchone()
+        # Ищем товар по названию через полнотекстовый индекс
+        matches = find_products_by_name(product_name)
+        exact = [pid for pid, name in matches if name.strip().lower() == product_name.lower()]
         
-        if not prod_row:
-            await message.reply(f"❌ Товар '{product_name}' не найден.")
+        if not exact:
+            if matches:
+                suggestions = "\n".join(f"• {name}" for _, name in matches)
+                await message.reply(f"❌ Товар '{product_name}' не найден. Похожие товары:\n{suggestions}")
+            else:
+                await message.reply(f"❌ Товар '{product_name}' не найден.")
             await state.clear()
             return
         
-        prod_id = prod_row[0]
-        
-        # Удаляем автодоставку
-        cur.execute("DELETE FROM autodeliveries WHERE product_id = ?", (prod_id,))
+        prod_id = exact[0]
         
-        # Удаляем связанные платежи и покупки
-        cur.execute("DELETE FROM payments WHERE purchase_id IN (SELECT id FROM purchases WHERE product_id = ?)", (prod_id,))
-        cur.execute("DELETE FROM purchases WHERE product_id = ?", (prod_id,))
-        
-        # Удаляем сам товар
-        cur.execute("DELETE FROM products WHERE id = ?", (prod_id,))
-        
-        conn.commit()
-        conn.close()
+        # Удаляем товар вместе с автовыдачей, покупками и платежами
+        delete_product(prod_id)
         
         await message.reply(f"✅ Товар '{product_name}' удалён.")
         await state.clear()
@@ -542,106 +742,182 @@ async def process_delete_product_name(message: Message, state: FSMContext):
         await message.reply(f"❌ Ошибка при удалении товара: {str(e)}")
         await state.clear()
 
-@dp.callback_query(F.data == "admin_panel")
+@callback_router("admin_panel")
 @admin_only
 async def admin_panel_callback(callback: CallbackQuery):
     await send_admin_menu(callback.message.chat.id, callback)
     await callback.answer()
 
-@dp.callback_query(F.data == "manage_categories")
+@callback_router("sales_dashboard")
+@admin_only
+async def sales_dashboard_callback(callback: CallbackQuery):
+    summary = get_sales_summary()
+    lines = ["📊 <b>Продажи</b>\n"]
+    for label, orders, revenue, discount in summary["windows"]:
+        lines.append(f"<b>{label}:</b> заказов {orders}, выручка {revenue} ₽, скидки {discount} ₽")
+    for title, rows in (("Топ категорий за 30 дней", summary["categories"]), ("Топ товаров за 30 дней", summary["products"])):
+        if rows:
+            lines.append(f"\n<b>{title}:</b>")
+            lines.extend(f"{i}. {name} — {revenue} ₽ ({orders})" for i, (name, orders, revenue) in enumerate(rows, 1))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔄 Обновить", callback_data=cb("sales_dashboard"))],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("admin_panel"))]
+    ])
+    await send_or_edit(bot, callback.message.chat.id, callback, text="\n".join(lines), reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
+
+BROADCAST_STATUS_NAMES = {"running": "идёт", "done": "завершена", "cancelled": "остановлена"}
+
+@callback_router("broadcast")
+@admin_only
+async def broadcast_callback(callback: CallbackQuery):
+    await show_broadcast_status(callback)
+
+async def show_broadcast_status(callback: CallbackQuery, notice: Optional[str] = None):
+    """
+    Экран состояния последней рассылки; notice — текст ответа на нажатие кнопки.
+    """
+    row = get_broadcast()
+    rows = []
+    if row:
+        broadcast_id, status, sent, failed, blocked, created_at, finished_at = row
+        text = (
+            f"📣 Рассылка #{broadcast_id}: {BROADCAST_STATUS_NAMES.get(status, status)}\n"
+            f"Доставлено: {sent}, ошибок: {failed}, заблокировали бота: {blocked}"
+        )
+        if status == "running":
+            rows.append([InlineKeyboardButton(text="⏹ Остановить", callback_data=cb("cancel_broadcast", broadcast_id))])
+            rows.append([InlineKeyboardButton(text="🔄 Обновить", callback_data=cb("broadcast"))])
+    else:
+        text = "📣 Рассылок ещё не было."
+    if not row or row[1] != "running":
+        rows.append([InlineKeyboardButton(text="Новая рассылка", callback_data=cb("new_broadcast"))])
+    rows.append([InlineKeyboardButton(text="◀️ Назад", callback_data=cb("admin_panel"))])
+    await send_or_edit(bot, callback.message.chat.id, callback, text=text, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+    await callback.answer(notice)
+
+@callback_router("new_broadcast")
+@admin_only
+async def new_broadcast_callback(callback: CallbackQuery, state: FSMContext):
+    await callback.message.reply("Отправьте текст рассылки (форматирование сохранится):")
+    await state.set_state(BroadcastState.waiting_for_text)
+    await callback.answer()
+
+@dp.message(BroadcastState.waiting_for_text)
+async def process_broadcast_text(message: Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_IDS:
+        await state.clear()
+        return
+    if not message.text:
+        await message.reply("Нужен текст сообщения.")
+        return
+    await state.update_data(broadcast_text=message.html_text)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Отправить всем", callback_data=cb("confirm_broadcast"))],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data=cb("broadcast"))]
+    ])
+    await message.reply("Так будет выглядеть рассылка:\n\n" + message.html_text, reply_markup=keyboard, parse_mode="HTML")
+
+@callback_router("confirm_broadcast")
+@admin_only
+async def confirm_broadcast_callback(callback: CallbackQuery, state: FSMContext):
+    text = (await state.get_data()).get("broadcast_text")
+    await state.clear()
+    if not text:
+        await callback.answer("Текст рассылки потерян, начните заново.", show_alert=True)
+        return
+    broadcast_id = create_broadcast(text, callback.from_user.id)
+    if broadcast_id is None:
+        await callback.answer("Другая рассылка ещё идёт.", show_alert=True)
+        return
+    await callback.answer(f"Рассылка #{broadcast_id} запущена")
+    await send_or_edit(bot, callback.message.chat.id, callback, text=f"📣 Рассылка #{broadcast_id} поставлена в очередь. Итоги придут сообщением.")
+
+@callback_router("cancel_broadcast")
+@admin_only
+async def cancel_broadcast_callback(callback: CallbackQuery, broadcast_id: int):
+    # На нажатие можно ответить только один раз — ответ отправляет экран состояния
+    notice = None if cancel_broadcast(broadcast_id) else "Рассылка уже завершена."
+    await show_broadcast_status(callback, notice)
+
+@dp.my_chat_member()
+async def track_bot_blocked(update: ChatMemberUpdated):
+    """
+    Пользователь заблокировал или разблокировал бота: рассылки его пропускают или снова включают.
+    """
+    if update.chat.type != "private":
+        return
+    status = update.new_chat_member.status
+    if status == "kicked":
+        set_user_blocked(update.chat.id, True)
+    elif status == "member":
+        set_user_blocked(update.chat.id, False)
+
+@callback_router("manage_categories")
 @admin_only
 async def manage_categories_callback(callback: CallbackQuery):
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="Добавить категорию", callback_data="add_category")],
-            [InlineKeyboardButton(text="Список категорий", callback_data="list_categories")],
-            [InlineKeyboardButton(text="◀️ Назад", callback_data="admin_panel")]
+            [InlineKeyboardButton(text="Добавить категорию", callback_data=cb("add_category"))],
+            [InlineKeyboardButton(text="Список категорий", callback_data=cb("list_categories"))],
+            [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("admin_panel"))]
         ]
     )
     await send_or_edit(bot, callback.message.chat.id, callback, text="Управление категориями:", reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data == "add_category")
+@callback_router("add_category")
 @admin_only
 async def add_category_callback(callback: CallbackQuery, state: FSMContext):
     await callback.message.reply("Введите название новой категории:")
     await state.set_state(AddProductState.waiting_for_category)
     await callback.answer()
 
-@dp.callback_query(F.data == "list_categories")
+@callback_router("list_categories")
 @admin_only
-async def list_categories_callback(callback: CallbackQuery):
-    categories = get_categories()
+async def list_categories_callback(callback: CallbackQuery, cursor_id: int = 0, backward: bool = False):
+    rows = get_categories_page(cursor_id, CATALOG_PAGE_SIZE, backward)
+    categories, has_prev, has_next = split_page(rows, CATALOG_PAGE_SIZE, cursor_id, backward)
     if not categories:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="◀️ Назад", callback_data="manage_categories")]])
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="◀️ Назад", callback_data=cb("manage_categories"))]])
         await send_or_edit(bot, callback.message.chat.id, callback, text="Категорий не найдено.", reply_markup=keyboard)
         await callback.answer()
         return
     
     inline = []
     for cat_id, cat_name in categories:
-        inline.append([InlineKeyboardButton(text=f"📁 {cat_name}", callback_data=f"category_info_{cat_id}")])
-    inline.append([InlineKeyboardButton(text="◀️ Назад", callback_data="manage_categories")])
+        inline.append([InlineKeyboardButton(text=f"📁 {cat_name}", callback_data=cb("category_info", cat_id))])
+    nav = page_nav_row("list_categories", categories, has_prev, has_next)
+    if nav:
+        inline.append(nav)
+    inline.append([InlineKeyboardButton(text="◀️ Назад", callback_data=cb("manage_categories"))])
     keyboard = InlineKeyboardMarkup(inline_keyboard=inline)
     await send_or_edit(bot, callback.message.chat.id, callback, text="Список категорий:", reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("category_info_"))
+@callback_router("category_info")
 @admin_only
-async def category_info_callback(callback: CallbackQuery):
-    try:
-        cat_id = int(callback.data.split("_")[2])
-    except ValueError:
-        await callback.answer("Ошибка.", show_alert=True)
-        return
-    
-    categories = get_categories()
-    cat_name = next((c[1] for c in categories if c[0] == cat_id), None)
-    if not cat_name:
+async def category_info_callback(callback: CallbackQuery, cat_id: int):
+    category = get_category_with_count(cat_id)
+    if not category:
         await callback.answer("Категория не найдена.", show_alert=True)
         return
     
-    products = get_products_by_category(cat_id)
-    text = f" Категория: {cat_name}\n Товаров: {len(products)}"
+    _, cat_name, product_count = category
+    text = f" Категория: {cat_name}\n Товаров: {product_count}"
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Удалить категорию", callback_data=f"delete_category_{cat_id}")],
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="list_categories")]
+        [InlineKeyboardButton(text="❌ Удалить категорию", callback_data=cb("delete_category", cat_id))],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("list_categories"))]
     ])
     await send_or_edit(bot, callback.message.chat.id, callback, text=text, reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("delete_category_"))
+@callback_router("delete_category")
 @admin_only
-async def delete_category_callback(callback: CallbackQuery):
+async def delete_category_callback(callback: CallbackQuery, cat_id: int):
     try:
-        cat_id = int(callback.data.split("_")[2])
-    except ValueError:
-        await callback.answer("Ошибка.", show_alert=True)
-        return
-    
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute("PRAGMA foreign_keys = OFF")
-        cur = conn.cursor()
-        
-        # Получаем все товары в этой категории
-        cur.execute("SELECT id FROM products WHERE category_id = ?", (cat_id,))
-        products = cur.fetchall()
-        
-        # Удаляем платежи и покупки связанные с товарами в категории
-        for (prod_id,) in products:
-            cur.execute("DELETE FROM autodeliveries WHERE product_id = ?", (prod_id,))
-            cur.execute("DELETE FROM payments WHERE purchase_id IN (SELECT id FROM purchases WHERE product_id = ?)", (prod_id,))
-            cur.execute("DELETE FROM purchases WHERE product_id = ?", (prod_id,))
-        
-        # Удаляем товары
-        cur.execute("DELETE FROM products WHERE category_id = ?", (cat_id,))
-        
-        # Удаляем категорию
-        cur.execute("DELETE FROM categories WHERE id = ?", (cat_id,))
-        
-        conn.commit()
-        conn.close()
+        # Удаляем категорию вместе с товарами, покупками и платежами
+        delete_category(cat_id)
         
         await callback.answer("Категория удалена.")
         await send_or_edit(bot, callback.message.chat.id, callback, text="Категория удалена.")
@@ -651,20 +927,20 @@ async def delete_category_callback(callback: CallbackQuery):
         logging.error(f"Error deleting category: {e}")
         await callback.answer(f"Ошибка при удалении категории: {str(e)}", show_alert=True)
 
-@dp.callback_query(F.data == "manage_products")
+@callback_router("manage_products")
 @admin_only
 async def manage_products_callback(callback: CallbackQuery):
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="Добавить товар", callback_data="add_product_menu")],
-            [InlineKeyboardButton(text="Список товаров", callback_data="list_products")],
-            [InlineKeyboardButton(text="◀️ Назад", callback_data="admin_panel")]
+            [InlineKeyboardButton(text="Добавить товар", callback_data=cb("add_product_menu"))],
+            [InlineKeyboardButton(text="Список товаров", callback_data=cb("list_products"))],
+            [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("admin_panel"))]
         ]
     )
     await send_or_edit(bot, callback.message.chat.id, callback, text="Управление товарами:", reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data == "add_product_menu")
+@callback_router("add_product_menu")
 @admin_only
 async def add_product_menu_callback(callback: CallbackQuery, state: FSMContext):
     await callback.message.reply("Введите название категории для товара:")
@@ -705,44 +981,134 @@ async def process_product_price(message: Message, state: FSMContext):
         await message.reply("Цена должна быть числом. Попробуйте снова.")
         return
     
+    await state.update_data(price=price)
+    await message.reply("Отправьте фото товара или «-», чтобы добавить товар без фото:")
+    await state.set_state(AddProductState.waiting_for_photo)
+
+@dp.message(AddProductState.waiting_for_photo)
+@admin_only
+async def process_product_photo(message: Message, state: FSMContext):
+    photo_path = None
+    if (message.text or "").strip() != "-":
+        try:
+            photo_path = await save_message_photo(message)
+        except ValueError as e:
+            await message.reply(f"❌ {e}. Отправьте другое фото или «-».")
+            return
+        if photo_path is None:
+            await message.reply("Отправьте фото (можно файлом) или «-», чтобы добавить товар без фото.")
+            return
+
     data = await state.get_data()
-    add_product(data["name"], data["description"], price, data["category_id"], None)
+    add_product(data["name"], data["description"], data["price"], data["category_id"], photo_path)
     
     await message.reply(f"✅ Товар '{data['name']}' добавлен.")
     await state.clear()
     await send_admin_menu(message.chat.id, message)
 
-@dp.callback_query(F.data == "list_products")
+async def save_message_photo(message: Message) -> Optional[str]:
+    """
+    Скачивает картинку из сообщения (фото или файл-изображение), нормализует и кладёт в хранилище.
+    None — в сообщении нет картинки; ValueError — файл не читается как изображение.
+    """
+    if message.photo:
+        source = message.photo[-1]
+    elif message.document and (message.document.mime_type or "").startswith("image/"):
+        source = message.document
+    else:
+        return None
+    data = await bot.download(source)
+    # Декодирование и сжатие нагружают процессор — не держим на них цикл событий
+    return await asyncio.to_thread(store_photo, data.getvalue())
+
+@callback_router("import_catalog")
 @admin_only
-async def list_products_callback(callback: CallbackQuery):
-    categories = get_categories()
+async def import_catalog_callback(callback: CallbackQuery, state: FSMContext):
+    await callback.message.reply(
+        "Отправьте файл CSV или JSON с товарами.\n"
+        f"Поля: {', '.join(IMPORT_FIELDS)} (category, name и price обязательны).\n"
+        "Товары с тем же названием в той же категории будут обновлены."
+    )
+    await state.set_state(ImportState.waiting_for_file)
+    await callback.answer()
+
+@dp.message(ImportState.waiting_for_file)
+@admin_only
+async def process_import_file(message: Message, state: FSMContext):
+    document = message.document
+    if not document:
+        await message.reply("Нужен файл .csv или .json. Попробуйте ещё раз.")
+        return
+
+    filename = (document.file_name or "").lower()
+    if not filename.endswith((".csv", ".json", ".jsonl", ".ndjson")):
+        await message.reply("Поддерживаются только файлы .csv, .json, .jsonl.")
+        return
+
+    await state.clear()
+    await message.reply("⏳ Импортирую товары...")
+    fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    try:
+        await bot.download(document, destination=tmp_path)
+        summary = await asyncio.to_thread(import_catalog, tmp_path)
+    except Exception as e:
+        logging.error(f"Error importing catalog: {e}")
+        await message.reply(f"❌ Ошибка импорта: {str(e)}")
+        return
+    finally:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+    # Кэши каталога сбрасываем один раз на весь импорт
+    invalidate_page_cache()
+
+    text = (
+        f"✅ Импорт завершён\n\n"
+        f"Строк прочитано: {summary['rows']}\n"
+        f"Добавлено товаров: {summary['inserted']}\n"
+        f"Обновлено товаров: {summary['updated']}\n"
+        f"Новых категорий: {summary['categories_created']}\n"
+        f"Автовыдач записано: {summary['deliveries']}\n"
+        f"Пропущено строк: {summary['skipped']}"
+    )
+    if summary["errors"]:
+        text += "\n\nОшибки:\n" + "\n".join(summary["errors"])
+    await message.reply(text)
+    await send_admin_menu(message.chat.id, message)
+
+@callback_router("list_products")
+@admin_only
+async def list_products_callback(callback: CallbackQuery, cursor_id: int = 0, backward: bool = False):
+    rows = get_categories_page(cursor_id, CATALOG_PAGE_SIZE, backward)
+    categories, has_prev, has_next = split_page(rows, CATALOG_PAGE_SIZE, cursor_id, backward)
     if not categories:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="◀️ Назад", callback_data="manage_products")]])
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="◀️ Назад", callback_data=cb("manage_products"))]])
         await send_or_edit(bot, callback.message.chat.id, callback, text="Категорий не найдено.", reply_markup=keyboard)
         await callback.answer()
         return
 
+    counts = get_product_counts(cat_id for cat_id, _ in categories)
     inline = []
     for cat_id, cat_name in categories:
-        products = get_products_by_category(cat_id)
-        inline.append([InlineKeyboardButton(text=f" {cat_name} ({len(products)})", callback_data=f"cat_products_{cat_id}")])
-    inline.append([InlineKeyboardButton(text="◀️ Назад", callback_data="manage_products")])
+        inline.append([InlineKeyboardButton(text=f" {cat_name} ({counts.get(cat_id, 0)})", callback_data=cb("cat_products", cat_id))])
+    nav = page_nav_row("list_products", categories, has_prev, has_next)
+    if nav:
+        inline.append(nav)
+    inline.append([InlineKeyboardButton(text="◀️ Назад", callback_data=cb("manage_products"))])
     keyboard = InlineKeyboardMarkup(inline_keyboard=inline)
     await send_or_edit(bot, callback.message.chat.id, callback, text="Выберите категорию:", reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("cat_products_"))
+@callback_router("cat_products")
 @admin_only
-async def cat_products_callback(callback: CallbackQuery):
-    try:
-        cat_id = int(callback.data.split("_")[2])
-    except ValueError:
-        await callback.answer("Ошибка.", show_alert=True)
-        return
-    
-    products = get_products_by_category(cat_id)
+async def cat_products_callback(callback: CallbackQuery, cat_id: int, cursor_id: int = 0, backward: bool = False):
+    rows = get_products_page(cat_id, cursor_id, CATALOG_PAGE_SIZE, backward)
+    products, has_prev, has_next = split_page(rows, CATALOG_PAGE_SIZE, cursor_id, backward)
     if not products:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="◀️ Назад", callback_data="list_products")]])
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="◀️ Назад", callback_data=cb("list_products"))]])
         await send_or_edit(bot, callback.message.chat.id, callback, text="Товаров не найдено.", reply_markup=keyboard)
         await callback.answer()
         return
@@ -751,21 +1117,18 @@ async def cat_products_callback(callback: CallbackQuery):
     for prod in products:
         prod_id, name, description, price, photo_path = prod
         label = f" {name} — {price}₽"
-        inline.append([InlineKeyboardButton(text=label, callback_data=f"product_detail_{prod_id}")])
-    inline.append([InlineKeyboardButton(text="◀️ Назад", callback_data="list_products")])
+        inline.append([InlineKeyboardButton(text=label, callback_data=cb("product_detail", prod_id))])
+    nav = page_nav_row("cat_products", products, has_prev, has_next, cat_id)
+    if nav:
+        inline.append(nav)
+    inline.append([InlineKeyboardButton(text="◀️ Назад", callback_data=cb("list_products"))])
     keyboard = InlineKeyboardMarkup(inline_keyboard=inline)
     await send_or_edit(bot, callback.message.chat.id, callback, text="Товары в категории:", reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("product_detail_"))
+@callback_router("product_detail")
 @admin_only
-async def product_detail_callback(callback: CallbackQuery):
-    try:
-        prod_id = int(callback.data.split("_")[2])
-    except ValueError:
-        await callback.answer("Ошибка.", show_alert=True)
-        return
-    
+async def product_detail_callback(callback: CallbackQuery, prod_id: int):
     product = get_product_by_id(prod_id)
     if not product:
         await callback.answer("Товар не найден.", show_alert=True)
@@ -773,39 +1136,114 @@ async def product_detail_callback(callback: CallbackQuery):
     
     pid, name, description, price = product
     text = f" {name}\n\n{description}\n\n💰 Цена: {price}₽"
+    stock = get_stock_levels([prod_id])
+    if prod_id in stock:
+        text += f"\n📦 Свободных единиц: {stock[prod_id]}"
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Удалить товар", callback_data=f"delete_product_{prod_id}")],
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="list_products")]
+        [InlineKeyboardButton(text="📦 Загрузить ключи", callback_data=cb("stock_upload", prod_id))],
+        [InlineKeyboardButton(text="🖼 Загрузить фото", callback_data=cb("product_photo", prod_id))],
+        [InlineKeyboardButton(text="❌ Удалить товар", callback_data=cb("delete_product", prod_id))],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("list_products"))]
     ])
-    await send_or_edit(bot, callback.message.chat.id, callback, text=text, reply_markup=keyboard)
+    await send_or_edit(bot, callback.message.chat.id, callback, text=text, photo_path=get_product_photo(prod_id), reply_markup=keyboard)
+    await callback.answer()
+
+@callback_router("product_photo")
+@admin_only
+async def product_photo_callback(callback: CallbackQuery, prod_id: int, state: FSMContext):
+    await state.update_data(photo_product_id=prod_id)
+    await callback.message.reply(
+        "Отправьте фото товара. Для лучшего качества — файлом без сжатия: "
+        "бот сам уменьшит его и уберёт метаданные."
+    )
+    await state.set_state(ProductPhotoState.waiting_for_photo)
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("delete_product_"))
+@dp.message(ProductPhotoState.waiting_for_photo)
 @admin_only
-async def delete_product_callback(callback: CallbackQuery):
+async def process_product_photo_upload(message: Message, state: FSMContext):
+    data = await state.get_data()
+    prod_id = data.get("photo_product_id")
     try:
-        prod_id = int(callback.data.split("_")[2])
-    except ValueError:
-        await callback.answer("Ошибка.", show_alert=True)
+        photo_path = await save_message_photo(message)
+    except ValueError as e:
+        await message.reply(f"❌ {e}. Отправьте другое фото.")
         return
-    
+    except Exception as e:
+        logging.error(f"Error saving product photo: {e}")
+        await message.reply(f"❌ Ошибка загрузки: {str(e)}")
+        await state.clear()
+        return
+    if photo_path is None:
+        await message.reply("Это не изображение. Отправьте фото или файл-картинку.")
+        return
+
+    await state.clear()
+    old_photo = get_product_photo(prod_id) if prod_id else None
+    if not prod_id or not set_product_photo(prod_id, photo_path):
+        await message.reply("Товар не найден.")
+        await send_admin_menu(message.chat.id, message)
+        return
+    if old_photo and old_photo != photo_path:
+        remove_unused_photos([old_photo])
+    await message.reply(f"✅ Фото товара обновлено ({os.path.getsize(photo_path) // 1024} КБ).")
+    await send_admin_menu(message.chat.id, message)
+
+@callback_router("stock_upload")
+@admin_only
+async def stock_upload_callback(callback: CallbackQuery, prod_id: int, state: FSMContext):
+    await state.update_data(stock_product_id=prod_id)
+    await callback.message.reply(
+        "Отправьте единицы товара (ключи, коды) — по одной в строке.\n"
+        "Можно текстом или файлом .txt. Повторяющиеся строки будут пропущены."
+    )
+    await state.set_state(StockState.waiting_for_items)
+    await callback.answer()
+
+@dp.message(StockState.waiting_for_items)
+@admin_only
+async def process_stock_items(message: Message, state: FSMContext):
+    data = await state.get_data()
+    prod_id = data.get("stock_product_id")
+    await state.clear()
+    if not prod_id:
+        await send_admin_menu(message.chat.id, message)
+        return
+
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute("PRAGMA foreign_keys = OFF")
-        cur = conn.cursor()
-        
-        # Удаляем автодоставку если она существует
-        cur.execute("DELETE FROM autodeliveries WHERE product_id = ?", (prod_id,))
-        
-        # Удаляем связанные платежи и покупки
-        cur.execute("DELETE FROM payments WHERE purchase_id IN (SELECT id FROM purchases WHERE product_id = ?)", (prod_id,))
-        cur.execute("DELETE FROM purchases WHERE product_id = ?", (prod_id,))
-        
-        # Удаляем сам товар
-        cur.execute("DELETE FROM products WHERE id = ?", (prod_id,))
-        
-        conn.commit()
-        conn.close()
+        if message.document:
+            fd, tmp_path = tempfile.mkstemp(suffix=".txt")
+            os.close(fd)
+            try:
+                await bot.download(message.document, destination=tmp_path)
+
+                def load_file():
+                    with open(tmp_path, "r", encoding="utf-8-sig") as f:
+                        return load_stock_items(prod_id, f)
+
+                added = await asyncio.to_thread(load_file)
+            finally:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        else:
+            added = load_stock_items(prod_id, (message.text or "").splitlines())
+    except Exception as e:
+        logging.error(f"Error loading stock items: {e}")
+        await message.reply(f"❌ Ошибка загрузки: {str(e)}")
+        return
+
+    available = get_stock_levels([prod_id]).get(prod_id, 0)
+    await message.reply(f"✅ Добавлено единиц: {added}\n📦 Свободно сейчас: {available}")
+    await send_admin_menu(message.chat.id, message)
+
+@callback_router("delete_product")
+@admin_only
+async def delete_product_callback(callback: CallbackQuery, prod_id: int):
+    try:
+        # Удаляем товар вместе с автовыдачей, покупками и платежами
+        delete_product(prod_id)
         
         await callback.answer("Товар удалён.")
         await send_or_edit(bot, callback.message.chat.id, callback, text="Товар удалён.")
@@ -815,7 +1253,7 @@ async def delete_product_callback(callback: CallbackQuery):
         logging.error(f"Error deleting product: {e}")
         await callback.answer(f"Ошибка при удалении товара: {str(e)}", show_alert=True)
 
-@dp.callback_query(F.data == "back_to_main")
+@callback_router("back_to_main")
 async def back_to_main_callback(callback: CallbackQuery):
     try:
         await send_main_menu(callback.message.chat.id, callback)
@@ -827,7 +1265,7 @@ async def back_to_main_callback(callback: CallbackQuery):
             pass
         await callback.answer()
 
-@dp.callback_query(F.data == "back_to_start")
+@callback_router("back_to_start")
 async def back_to_start_callback(callback: CallbackQuery):
     try:
         await send_main_menu(callback.message.chat.id, callback)
@@ -838,18 +1276,12 @@ async def back_to_start_callback(callback: CallbackQuery):
             pass
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("cancel_buy_"))
-async def cancel_buy_callback(callback: CallbackQuery):
-    try:
-        purchase_id = int(callback.data.split("_", 1)[1])
-    except Exception:
-        await send_main_menu(callback.message.chat.id, callback)
-        return
-
+@callback_router("cancel_buy")
+async def cancel_buy_callback(callback: CallbackQuery, purchase_id: int):
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         cur = conn.cursor()
-        cur.execute("SELECT user_id, product_id FROM purchases WHERE id = ?", (purchase_id,))
+        cur.execute("SELECT u.telegram_id, p.product_id FROM purchases p LEFT JOIN users u ON u.id = p.user_id WHERE p.id = ?", (purchase_id,))
         row = cur.fetchone()
         if not row:
             conn.close()
@@ -864,8 +1296,18 @@ async def cancel_buy_callback(callback: CallbackQuery):
             await callback.answer("Отмена доступна только владельцу заказа или администратору.", show_alert=True)
             return
 
+        # Оплаченный заказ не удаляем: деньги уже получены, а продажа учтена в агрегатах sales_daily*
+        cur.execute(
+            "DELETE FROM purchases WHERE id = ? AND NOT EXISTS (SELECT 1 FROM payments WHERE purchase_id = ? AND status = 'paid')",
+            (purchase_id, purchase_id)
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+            conn.close()
+            await callback.answer("Заказ уже оплачен, отменить его нельзя. Свяжитесь с поддержкой.", show_alert=True)
+            return
+        cur.execute("DELETE FROM stock_reservations WHERE purchase_id = ?", (purchase_id,))
         cur.execute("DELETE FROM payments WHERE purchase_id = ?", (purchase_id,))
-        cur.execute("DELETE FROM purchases WHERE id = ?", (purchase_id,))
         conn.commit()
         conn.close()
     except Exception:
@@ -874,7 +1316,7 @@ async def cancel_buy_callback(callback: CallbackQuery):
 
     if product_id:
         try:
-            conn = sqlite3.connect(DB_PATH)
+            conn = get_connection()
             cur = conn.cursor()
             cur.execute("SELECT category_id FROM products WHERE id = ?", (product_id,))
             c_row = cur.fetchone()
@@ -889,10 +1331,10 @@ async def cancel_buy_callback(callback: CallbackQuery):
                     keyboard = InlineKeyboardMarkup(inline_keyboard=[
                         [
                             InlineKeyboardButton(text="⬅️ Предыдущий", callback_data="disabled"),
-                            InlineKeyboardButton(text="➡️ Следующий", callback_data=f"product_{category_id}_1" if len(products) > 1 else "disabled")
+                            InlineKeyboardButton(text="➡️ Следующий", callback_data=cb("product", category_id, 1) if len(products) > 1 else "disabled")
                         ],
-                        [InlineKeyboardButton(text="🛒 Купить", callback_data=f"buy_{pid}")],
-                        [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_start")]
+                        [InlineKeyboardButton(text="🛒 Купить", callback_data=cb("buy", pid))],
+                        [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("back_to_start"))]
                     ])
                     await bot.send_message(chat_id=callback.message.chat.id, text=text, reply_markup=keyboard, parse_mode="HTML")
                     await callback.answer("Покупка отменена. Возврат к товарам категории.")
@@ -904,7 +1346,7 @@ async def cancel_buy_callback(callback: CallbackQuery):
     await callback.answer()
     await send_main_menu(callback.message.chat.id, callback)
 
-@dp.callback_query(F.data == "start_command")
+@callback_router("start_command")
 async def start_command_callback(callback: CallbackQuery):
     try:
         if callback.from_user and callback.from_user.id:
@@ -914,77 +1356,60 @@ async def start_command_callback(callback: CallbackQuery):
     await send_main_menu(callback.message.chat.id, callback)
     await callback.answer()
 
-@dp.callback_query(F.data == "profile")
+@callback_router("profile")
 async def profile_callback(callback: CallbackQuery):
     uid = callback.from_user.id if callback.from_user else None
     text = f"👤 Ваш профиль\n\nID: {uid}\n\nЗдесь будет информация о вашем профиле."
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_start")]
+        [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("back_to_start"))]
     ])
     await send_or_edit(bot, callback.message.chat.id, callback, text=text, reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data == "support")
+@callback_router("support")
 async def support_callback(callback: CallbackQuery):
     text = "💬 Служба поддержки\n\nhttps://t.me/grumpaaa\n\n"
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_start")]
+        [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("back_to_start"))]
     ])
     await send_or_edit(bot, callback.message.chat.id, callback, text=text, reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data == "calculator")
+@callback_router("calculator")
 async def calculator_callback(callback: CallbackQuery):
     text = "🧮 Калькулятор\n\nЭта функция в разработке."
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_start")]
+        [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("back_to_start"))]
     ])
     await send_or_edit(bot, callback.message.chat.id, callback, text=text, reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data == "faq")
+@callback_router("faq")
 async def faq_callback(callback: CallbackQuery):
     text = "✨ CosmaStars — Часто задаваемые вопросы ✨\n\n1. 💳 Как происходит оплата?\nВ магазине CosmaStars действует система мгновенной покупки. Вы не можете просто пополнить свой баланс. Оплата происходит единовременно и напрямую в момент оформления выбранного товара. Просто добавьте то, что вам понравилось, в корзину и завершите платеж — все просто и безопасно!\n\n2. ⏱️ Сколько ждать выдачи заказа?\nВаш заказ будет обработан и выполнен автоматически в течение 5 минут после успешной оплаты! Пожалуйста, следите за обновлениями на странице заказа.\n\n3. 🔐 Как правильно указать данные для получения?\nПри оформлении заказа крайне важно указать ваш точный и корректный юзернейм (логин). Мы не несем ответственности за ошибки, допущенные при вводе.\n\n❗️ Важно: Если из-за ошибки в логине товар будет отправлен другому пользователю, возврат средств или повторная выдача товара не предусмотрены. Пожалуйста, будьте внимательны!\n\n4.❓ У меня возникла проблема. Что делать?\nНаша дружная команда поддержки всегда готова вам помочь! Пожалуйста, напишите нам в личные сообщения.\nЧтобы мы могли решить ваш вопрос максимально быстро, обязательно укажите в первом же сообщении ваш ID (идентификатор аккаунта или заказа).\n\n5. 🕐 В какое время работает поддержка?\nНаша служба заботы о клиентах работает для вас ежедневно с 10:00 до 19:00 по московскому времени. Обращения, полученные вне рабочего времени, будут обработаны на следующий день с утра.\n\nБлагодарим за выбор CosmaStars! Желаем вам приятных покупок в нашей галактике цифровых товаров! 🌟"
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_start")]
+        [InlineKeyboardButton(text="◀️ Назад", callback_data=cb("back_to_start"))]
     ])
     await send_or_edit(bot, callback.message.chat.id, callback, text=text, reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data == "delete_catalog")
+@callback_router("delete_catalog")
 @admin_only
 async def delete_catalog_callback(callback: CallbackQuery):
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Да, удалить всё", callback_data="confirm_delete_catalog")],
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="admin_panel")]
+        [InlineKeyboardButton(text="✅ Да, удалить всё", callback_data=cb("confirm_delete_catalog"))],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data=cb("admin_panel"))]
     ])
     text = "⚠️ ВНИМАНИЕ!\n\nВы собираетесь удалить весь каталог со всеми категориями и товарами.\n\nЭто действие необратимо!"
     await send_or_edit(bot, callback.message.chat.id, callback, text=text, reply_markup=keyboard)
     await callback.answer()
 
-@dp.callback_query(F.data == "confirm_delete_catalog")
+@callback_router("confirm_delete_catalog")
 @admin_only
 async def confirm_delete_catalog_callback(callback: CallbackQuery):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute("PRAGMA foreign_keys = OFF")
-        cur = conn.cursor()
-        
-        # Удаляем все автодоставки
-        cur.execute("DELETE FROM autodeliveries")
-        
-        # Удаляем все платежи и покупки
-        cur.execute("DELETE FROM payments")
-        cur.execute("DELETE FROM purchases")
-        
-        # Удаляем все товары
-        cur.execute("DELETE FROM products")
-        
-        # Удаляем все категории
-        cur.execute("DELETE FROM categories")
-        
-        conn.commit()
-        conn.close()
+        # Удаляем все категории, товары, автовыдачу, покупки и платежи
+        delete_catalog()
         
         await callback.answer("Каталог полностью удалён.")
         await send_or_edit(bot, callback.message.chat.id, callback, text="✅ Каталог успешно удалён.")
@@ -994,14 +1419,8 @@ async def confirm_delete_catalog_callback(callback: CallbackQuery):
         logging.error(f"Error deleting catalog: {e}")
         await callback.answer(f"Ошибка при удалении каталога: {str(e)}", show_alert=True)
 
-@dp.callback_query(F.data.startswith("checkpay_"))
-async def checkpay_callback(callback: CallbackQuery):
-    try:
-        payment_id = int(callback.data.split("_", 1)[1])
-    except (ValueError, IndexError):
-        await callback.answer("Ошибка при проверке платежа.", show_alert=True)
-        return
-    
+@callback_router("checkpay")
+async def checkpay_callback(callback: CallbackQuery, payment_id: int):
     try:
         payment = get_payment_by_id(payment_id)
         if not payment:
@@ -1018,16 +1437,22 @@ async def checkpay_callback(callback: CallbackQuery):
             # Отправляем информацию об заказе админам
             await notify_admins_about_purchase(purchase_id, callback.from_user)
             
-        elif status == "pending":
-            # Проверяем статус в Cryptopay
+        elif status in ("pending", "expired"):
+            # Проверяем статус в Cryptopay: оплата могла пройти перед самым истечением счёта
             invoice_status = await check_crypto_invoice_status(invoice_id)
             if invoice_status == "paid":
-                update_payment_status_by_id(payment_id, "paid")
+                # False — платёж уже отметила параллельная проверка, админов она тоже уведомила
+                marked = mark_payment_paid(payment_id)
                 await callback.answer("✅ Платёж успешно проведён!", show_alert=True)
                 await send_or_edit(bot, callback.message.chat.id, callback, text="✅ Ваш платёж успешно принят. Спасибо за покупку!")
                 
                 # Отправляем информацию об заказе админам
-                await notify_admins_about_purchase(purchase_id, callback.from_user)
+                if marked:
+                    await notify_admins_about_purchase(purchase_id, callback.from_user)
+            elif invoice_status == "expired" or status == "expired":
+                if status == "pending":
+                    update_payment_status_by_id(payment_id, "expired")
+                await callback.answer("⌛ Срок оплаты счёта истёк. Оформите заказ заново.", show_alert=True)
             else:
                 await callback.answer("⏳ Платёж ещё не поступил. Попробуйте позже.", show_alert=True)
         else:
@@ -1041,11 +1466,11 @@ async def notify_admins_about_purchase(purchase_id: int, user):
     Отправляет информацию об заказе всем администраторам.
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection()
         cur = conn.cursor()
         
         # Получаем информацию о покупке
-        cur.execute("SELECT user_id, product_id FROM purchases WHERE id = ?", (purchase_id,))
+        cur.execute("SELECT u.telegram_id, p.product_id FROM purchases p LEFT JOIN users u ON u.id = p.user_id WHERE p.id = ?", (purchase_id,))
         purchase_row = cur.fetchone()
         
         if not purchase_row:
@@ -1088,6 +1513,22 @@ async def notify_admins_about_purchase(purchase_id: int, user):
     except Exception as e:
         logging.error(f"Error in notify_admins_about_purchase: {e}")
 
+async def notify_admins_out_of_stock(purchase_id: int, product_id: int):
+    """
+    Сообщает администраторам, что оплаченный заказ ждёт пополнения пула единиц товара.
+    """
+    product = get_product_by_id(product_id)
+    product_name = product[1] if product else f"#{product_id}"
+    text = (
+        f"⚠️ Заказ #{purchase_id} оплачен, но товар «{product_name}» закончился.\n"
+        f"Заказ будет выдан автоматически после загрузки новых единиц."
+    )
+    for admin_id in ADMIN_IDS:
+        try:
+            await bot.send_message(chat_id=admin_id, text=text)
+        except Exception as e:
+            logging.error(f"Error sending out-of-stock notification to {admin_id}: {e}")
+
 async def send_main_menu(chat_id: int, source_obj):
     uid = None
     try:
@@ -1104,80 +1545,83 @@ async def send_main_menu(chat_id: int, source_obj):
 async def send_admin_menu(chat_id: int, source_obj):
     await send_or_edit(bot, chat_id, source_obj, text="Админ-панель:", reply_markup=admin_menu_keyboard())
 
+async def deliver_order(order_id: int, telegram_id: int, product_id: int):
+    """
+    Выдаёт оплаченный заказ: единицу из пула, автовыдачу или просто отмечает доставленным.
+    Заказ сначала забирается claim_order_for_delivery, поэтому фоновая доставка и немедленная выдача
+    после оплаты с баланса не выдадут его дважды. При ошибке отправки заказ вернётся в очередь.
+    """
+    if not claim_order_for_delivery(order_id):
+        return
+    try:
+        # Товар с пулом уникальных единиц: закрепляем за заказом одну свободную
+        if get_stock_levels([product_id]):
+            item = claim_stock_item(product_id, order_id)
+            if item is None:
+                set_purchase_status(order_id, "awaiting_stock")
+                await notify_admins_out_of_stock(order_id, product_id)
+                return
+            await bot.send_message(
+                chat_id=telegram_id,
+                text=f"✅ Спасибо за покупку! Ваш товар по заказу #{order_id}:\n\n{item}"
+            )
+            set_purchase_status(order_id, "delivered")
+            return
+
+        # Получаем информацию об автодоставке
+        autodel = get_autodelivery_for_product(product_id)
+        if autodel and autodel[1] == 1:
+            _, _, content_text, file_path = autodel
+            if content_text:
+                await bot.send_message(
+                    chat_id=telegram_id,
+                    text=f"✅ Спасибо за покупку! Ваша автовыдача по заказу #{order_id}:\n\n{content_text}"
+                )
+            elif file_path and os.path.exists(file_path):
+                ext = os.path.splitext(file_path)[1].lower()
+                if ext in (".jpg", ".jpeg", ".png", ".gif", ".webp"):
+                    await bot.send_photo(
+                        chat_id=telegram_id,
+                        photo=FSInputFile(file_path),
+                        caption=f"✅ Спасибо за покупку! Ваша автовыдача по заказу #{order_id}"
+                    )
+                else:
+                    await bot.send_document(
+                        chat_id=telegram_id,
+                        document=FSInputFile(file_path),
+                        caption=f"✅ Спасибо за покупку! Ваша автовыдача по заказу #{order_id}"
+                    )
+
+        # Отмечаем заказ как доставленный (без автовыдачи — сразу)
+        set_purchase_status(order_id, "delivered")
+    except Exception as e:
+        logging.error(f"Error delivering order {order_id}: {e}")
+        set_purchase_status(order_id, None)
+
 async def process_pending_deliveries():
     """
     Фоновая задача: периодически проверяет оплаченные заказы и отправляет автовыдачу.
     """
     while True:
         try:
-            conn = sqlite3.connect(DB_PATH)
+            conn = get_connection()
             cur = conn.cursor()
             
             # Получаем оплаченные, но не доставленные заказы
             cur.execute("""
-                SELECT p.id, p.user_id, p.product_id 
+                SELECT p.id, u.telegram_id, p.product_id 
                 FROM purchases p
                 JOIN payments pm ON p.id = pm.purchase_id
+                JOIN users u ON u.id = p.user_id
                 WHERE pm.status = 'paid' AND p.status IS NULL
                 LIMIT 10
             """)
             orders = cur.fetchall()
             conn.close()
             
-            for order_id, user_id, product_id in orders:
+            for order_id, telegram_id, product_id in orders:
                 try:
-                    # Получаем информацию о пользователе
-                    conn = sqlite3.connect(DB_PATH)
-                    cur = conn.cursor()
-                    cur.execute("SELECT telegram_id FROM users WHERE id = ?", (user_id,))
-                    user_row = cur.fetchone()
-                    conn.close()
-                    
-                    if not user_row:
-                        continue
-                    
-                    telegram_id = user_row[0]
-                    
-                    # Получаем информацию об автодоставке
-                    autodel = get_autodelivery_for_product(product_id)
-                    if autodel and autodel[1] == 1:
-                        _, _, content_text, file_path = autodel
-                        try:
-                            if content_text:
-                                await bot.send_message(
-                                    chat_id=telegram_id,
-                                    text=f"✅ Спасибо за покупку! Ваша автовыдача по заказу #{order_id}:\n\n{content_text}"
-                                )
-                            elif file_path and os.path.exists(file_path):
-                                ext = os.path.splitext(file_path)[1].lower()
-                                if ext in (".jpg", ".jpeg", ".png", ".gif", ".webp"):
-                                    await bot.send_photo(
-                                        chat_id=telegram_id,
-                                        photo=FSInputFile(file_path),
-                                        caption=f"✅ Спасибо за покупку! Ваша автовыдача по заказу #{order_id}"
-                                    )
-                                else:
-                                    await bot.send_document(
-                                        chat_id=telegram_id,
-                                        document=FSInputFile(file_path),
-                                        caption=f"✅ Спасибо за покупку! Ваша автовыдача по заказу #{order_id}"
-                                    )
-                            
-                            # Отмечаем заказ как доставленный
-                            conn = sqlite3.connect(DB_PATH)
-                            cur = conn.cursor()
-                            cur.execute("UPDATE purchases SET status = 'delivered' WHERE id = ?", (order_id,))
-                            conn.commit()
-                            conn.close()
-                        except Exception as e:
-                            logging.error(f"Error delivering autodelivery for order {order_id}: {e}")
-                    else:
-                        # Если нет автодоставки, просто отмечаем как доставленный
-                        conn = sqlite3.connect(DB_PATH)
-                        cur = conn.cursor()
-                        cur.execute("UPDATE purchases SET status = 'delivered' WHERE id = ?", (order_id,))
-                        conn.commit()
-                        conn.close()
+                    await deliver_order(order_id, telegram_id, product_id)
                 except Exception as e:
                     logging.error(f"Error processing delivery for order {order_id}: {e}")
             
@@ -1187,26 +1631,194 @@ async def process_pending_deliveries():
             logging.error(f"Error in process_pending_deliveries: {e}")
             await asyncio.sleep(5)
 
+async def purge_deleted_periodically():
+    """
+    Фоновая задача: дочищает мягко удалённые товары и категории небольшими пачками,
+    затем удаляет из хранилища фото, оставшиеся без товаров.
+    """
+    while True:
+        try:
+            while purge_soft_deleted() > 0:
+                # Между пачками отпускаем цикл событий и блокировку записи
+                await asyncio.sleep(0.1)
+            removed = await asyncio.to_thread(sweep_unused_photos)
+            if removed:
+                logging.info(f"Removed {removed} unused product photos")
+        except Exception as e:
+            logging.error(f"Error in purge_deleted_periodically: {e}")
+        await asyncio.sleep(PURGE_INTERVAL)
+
+async def archive_orders_periodically():
+    """
+    Фоновая задача: переносит старые доставленные и отменённые заказы с платежами в архивные таблицы.
+    """
+    while True:
+        try:
+            total = 0
+            while True:
+                moved = archive_old_orders()
+                if not moved:
+                    break
+                total += moved
+                await asyncio.sleep(0.1)
+            if total:
+                logging.info(f"Archived {total} old orders")
+        except Exception as e:
+            logging.error(f"Error in archive_orders_periodically: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+async def release_reservations_periodically():
+    """
+    Фоновая задача: возвращает в продажу единицы, зарезервированные под неоплаченные счета.
+    """
+    while True:
+        try:
+            total = 0
+            while True:
+                released = release_expired_reservations()
+                if not released:
+                    break
+                total += released
+                await asyncio.sleep(0.1)
+            if total:
+                logging.info(f"Released {total} expired stock reservations")
+        except Exception as e:
+            logging.error(f"Error in release_reservations_periodically: {e}")
+        await asyncio.sleep(RESERVATION_SWEEP_INTERVAL)
+
+async def expire_payments_periodically():
+    """
+    Фоновая задача: закрывает брошенные неоплаченные счета и убирает их заказы в архив пачками.
+    Перед этим статусы счетов пачки спрашиваются у Crypto Pay одним запросом: счёт могли оплатить
+    перед самым истечением, так и не нажав «Проверить оплату». Такие платежи отмечаются оплаченными,
+    а ещё активные счета остаются ждать.
+    """
+    while True:
+        try:
+            total = paid = 0
+            after_id = 0
+            while True:
+                stale = get_stale_payments(PENDING_PAYMENT_TTL, after_id)
+                if not stale:
+                    break
+                after_id = stale[-1][0]
+                statuses = await get_invoice_statuses(invoice_id for _, _, invoice_id in stale)
+                to_expire = []
+                for payment_id, _, invoice_id in stale:
+                    status = statuses.get(str(invoice_id), "not")
+                    if status == "paid":
+                        paid += mark_payment_paid(payment_id)
+                    elif status != "pending":
+                        to_expire.append(payment_id)
+                total += expire_payments(to_expire)
+                await asyncio.sleep(0.1)
+            if total or paid:
+                logging.info(f"Expired {total} abandoned payments, found {paid} paid without a check")
+        except Exception as e:
+            logging.error(f"Error in expire_payments_periodically: {e}")
+        await asyncio.sleep(PAYMENT_CLEANUP_INTERVAL)
+
+async def report_query_stats_periodically():
+    """
+    Фоновая задача: периодически пишет в лог самые тяжёлые запросы по суммарному времени.
+    """
+    while True:
+        await asyncio.sleep(SQL_REPORT_INTERVAL)
+        try:
+            report = format_top_queries(SQL_REPORT_TOP)
+            if report:
+                logging.info(report)
+        except Exception as e:
+            logging.error(f"Error in report_query_stats_periodically: {e}")
+
+async def flush_new_users_periodically():
+    """
+    Фоновая задача: пачкой записывает в базу пользователей, впервые нажавших /start.
+    """
+    while True:
+        await asyncio.sleep(USER_FLUSH_INTERVAL)
+        try:
+            flush_new_users()
+        except Exception as e:
+            logging.error(f"Error in flush_new_users_periodically: {e}")
+
+def start_process_jobs():
+    """
+    Задачи, которые нужны каждому процессу бота: статистика SQL и запись буфера новых пользователей.
+    """
+    return [
+        asyncio.create_task(report_query_stats_periodically()),
+        asyncio.create_task(flush_new_users_periodically()),
+    ]
+
+async def process_broadcasts():
+    """
+    Фоновая задача: выполняет рассылки по очереди. Незавершённая рассылка после перезапуска
+    продолжается с сохранённого места.
+    """
+    while True:
+        try:
+            row = get_running_broadcast()
+            if row:
+                broadcast_id, text, last_user_id, created_by = row
+                logging.info(f"Broadcast {broadcast_id} running from user id {last_user_id}")
+                finished = await run_broadcast(bot, broadcast_id, text, last_user_id)
+                _, status, sent, failed, blocked, _, _ = get_broadcast(broadcast_id)
+                logging.info(f"Broadcast {broadcast_id} {status}: sent {sent}, failed {failed}, blocked {blocked}")
+                if created_by:
+                    await bot.send_message(
+                        chat_id=created_by,
+                        text=f"📣 Рассылка #{broadcast_id} {'завершена' if finished else 'остановлена'}.\n"
+                             f"Доставлено: {sent}, ошибок: {failed}, заблокировали бота: {blocked}"
+                    )
+                continue
+        except Exception as e:
+            logging.error(f"Error in process_broadcasts: {e}")
+        await asyncio.sleep(BROADCAST_POLL_INTERVAL)
+
+def start_background_jobs():
+    """
+    Запускает общие фоновые задачи магазина. В режиме нескольких воркеров их выполняет
+    только держатель аренды (см. workers.py). Возвращает список задач для отмены.
+    """
+    return [
+        asyncio.create_task(process_pending_deliveries()),
+        asyncio.create_task(purge_deleted_periodically()),
+        asyncio.create_task(archive_orders_periodically()),
+        asyncio.create_task(release_reservations_periodically()),
+        asyncio.create_task(expire_payments_periodically()),
+        asyncio.create_task(process_broadcasts()),
+    ]
+
 async def main():
     logging.info("Bot started...")
     logging.info(f"Using database: {DB_PATH}")
     
-    # Запускаем фоновую задачу обработки доставок
-    delivery_task = asyncio.create_task(process_pending_deliveries())
+    # Запускаем фоновые задачи: доставка, очистка, архив, резервы, просроченные счета
+    jobs = start_background_jobs() + start_process_jobs()
     
     try:
         await dp.start_polling(bot)
     except (asyncio.CancelledError, KeyboardInterrupt):
         logging.info("Polling cancelled / interrupted.")
-        delivery_task.cancel()
     except Exception:
         logging.exception("Unexpected error while polling:")
-        delivery_task.cancel()
     finally:
         try:
-            delivery_task.cancel()
+            for task in jobs:
+                task.cancel()
         except Exception:
             pass
+
+        try:
+            flush_new_users()
+        except Exception:
+            logging.exception("Error while flushing new users:")
+
+        try:
+            await close_crypto_client()
+        except Exception:
+            logging.exception("Error while closing Crypto Pay session:")
         
         try:
             if hasattr(dp, "shutdown"):
@@ -1232,4 +1844,23 @@ async def main():
             logging.exception("Error while closing bot session:")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # Схема проверяется до создания бота и до fork'а воркеров
+    ensure_schema()
+    load_known_users()
+    session = None
+    if TELEGRAM_API_URL:
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    bot = Bot(token=BOT_TOKEN, session=session)
+    # Объекты, созданные при запуске (модули aiogram, модели pydantic), живут до конца процесса.
+    # Замороженные, они не обходятся при каждой полной сборке мусора — иначе сборки, которые
+    # вызывает, например, перестройка индекса inline-поиска, останавливали бы цикл событий
+    # на сотни миллисекунд. Заодно воркеры после fork не копируют эти страницы памяти.
+    gc.collect()
+    gc.freeze()
+    if WORKERS > 1:
+        from workers import run_supervisor
+        run_supervisor(dp, bot, WORKERS, start_background_jobs, start_process_jobs)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,236 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from config import PROFILE_SAMPLE_RATE, PROFILE_SLOW_MS, PROFILE_DIR, PROFILE_KEEP, PROFILE_INTERVAL_MS
+
+# Последние медленные вызовы: (handler_name, elapsed_ms, timestamp, profile_path)
+slow_calls = deque(maxlen=200)
+
+# Сколько самых частых стеков каждого вида попадает в файл профиля
+TOP_STACKS = 15
+
+# Запись профилей идёт в фоне; ссылки держим, чтобы задачи не собрал сборщик мусора
+_pending_dumps = set()
+_rotate_lock = threading.Lock()
+
+
+def _handler_name(data: Dict[str, Any]) -> str:
+    # Кнопки проходят через один обработчик-маршрутизатор, поэтому берём имя из маршрута
+    route = data.get("callback_route")
+    if route is not None:
+        return route.name
+    handler_obj = data.get("handler")
+    callback = getattr(handler_obj, "callback", None)
+    return getattr(callback, "__name__", None) or "unknown"
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class _Call:
+    """
+    Один выполняющийся вызов обработчика и снятые с него стеки.
+    """
+    __slots__ = ("frame", "coro", "thread_id", "on_cpu", "waiting")
+
+    def __init__(self, frame, coro, thread_id: int):
+        # frame — кадр ProfilerMiddleware.__call__ этого вызова: по нему стек потока цикла
+        # событий однозначно относится к вызову, даже если параллельно выполняются другие
+        self.frame = frame
+        self.coro = coro
+        self.thread_id = thread_id
+        self.on_cpu = Counter()
+        self.waiting = Counter()
+
+    def sample(self, stack: list, index: Dict[int, int]):
+        position = index.get(id(self.frame))
+        if position is not None:
+            # Вызов сейчас выполняется: кадры от обработчика до текущего, без самого middleware
+            self.on_cpu[tuple(_frame_label(frame) for frame in reversed(stack[:position]))] += 1
+        else:
+            self.waiting[self._await_stack()] += 1
+
+    def _await_stack(self) -> tuple:
+        # Вызов приостановлен: идём по цепочке await от корутины обработчика до того, чего она ждёт
+        labels = []
+        awaitable = self.coro
+        while awaitable is not None:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                # Future, Task и прочее — не корутина, дальше цепочки нет
+                labels.append(type(awaitable).__name__)
+                break
+            labels.append(_frame_label(frame))
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        return tuple(labels)
+
+
+class _Sampler:
+    """
+    Фоновый поток, который каждые interval_ms снимает стек потока цикла событий и раздаёт
+    его выполняющимся вызовам. Поток спит, пока отслеживаемых вызовов нет.
+    """
+
+    def __init__(self, interval_ms: float):
+        self.interval = interval_ms / 1000
+        self.calls = {}
+        # Снимок, начатый до untrack, не должен дописывать стеки, пока вызов сохраняет профиль
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def track(self, call: _Call):
+        self.calls[id(call)] = call
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="handler-sampler", daemon=True)
+            self.thread.start()
+        self.wakeup.set()
+
+    def untrack(self, call: _Call):
+        with self.lock:
+            self.calls.pop(id(call), None)
+
+    def _run(self):
+        while True:
+            if not self.calls:
+                self.wakeup.clear()
+                self.wakeup.wait()
+            time.sleep(self.interval)
+            try:
+                with self.lock:
+                    self._sample(list(self.calls.values()))
+            except Exception as e:
+                logging.error(f"Error sampling handler stacks: {e}")
+
+    @staticmethod
+    def _sample(calls: list):
+        frames = sys._current_frames()
+        stacks = {}
+        for call in calls:
+            if call.thread_id not in stacks:
+                stack = []
+                frame = frames.get(call.thread_id)
+                while frame is not None:
+                    stack.append(frame)
+                    frame = frame.f_back
+                stacks[call.thread_id] = (stack, {id(frame): i for i, frame in enumerate(stack)})
+            call.sample(*stacks[call.thread_id])
+
+
+_sampler = _Sampler(PROFILE_INTERVAL_MS)
+
+
+def _rotate_profiles():
+    try:
+        # Профили пишутся из нескольких потоков сразу: две ротации одновременно удаляли бы одни и те же файлы
+        with _rotate_lock:
+            files = sorted(
+                (os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR) if f.endswith(".txt")),
+                key=os.path.getmtime
+            )
+            for path in files[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else files:
+                os.remove(path)
+    except Exception as e:
+        logging.error(f"Error rotating profiles: {e}")
+
+
+def _format_stacks(title: str, stacks: Counter, total: int, elapsed_ms: float) -> str:
+    # Поток снимков не успевает точно к сроку, пока цикл событий держит GIL, поэтому время
+    # стека считается по его доле среди всех снимков вызова, а не по числу снимков × интервал
+    lines = [f"{title}: {sum(stacks.values())} снимков"]
+    for stack, count in stacks.most_common(TOP_STACKS):
+        lines.append(f"\n  {count} × ≈{elapsed_ms * count / total:.0f} мс")
+        lines.extend(f"    {label}" for label in stack)
+    return "\n".join(lines)
+
+
+def _profile_path(name: str, elapsed_ms: float) -> str:
+    stamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
+    return os.path.join(PROFILE_DIR, f"{stamp}_{name}_{int(elapsed_ms)}ms.txt")
+
+
+def _dump_profile(path: str, call: _Call, name: str, elapsed_ms: float) -> None:
+    """
+    Сохраняет самые частые стеки вызова в текстовый файл и удаляет самые старые файлы.
+    Синхронная функция — выполняется в asyncio.to_thread, чтобы не задерживать цикл событий.
+    """
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        total = max(sum(call.on_cpu.values()) + sum(call.waiting.values()), 1)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"handler: {name}\nelapsed: {elapsed_ms:.1f} ms\nsamples: {total}\n\n")
+            f.write(_format_stacks("Выполнялся (стек от обработчика к текущему кадру)", call.on_cpu, total, elapsed_ms))
+            f.write("\n\n")
+            # Сюда же попадает время, когда ожидание уже закончилось, но цикл событий занят другими задачами
+            f.write(_format_stacks("Ждал (цепочка await от обработчика)", call.waiting, total, elapsed_ms))
+            f.write("\n")
+        _rotate_profiles()
+    except Exception as e:
+        logging.error(f"Error saving profile for {name}: {e}")
+
+
+class ProfilerMiddleware(BaseMiddleware):
+    """
+    Снимает стеки каждого вызова обработчика и сохраняет профиль всех вызовов дольше
+    PROFILE_SLOW_MS и доли PROFILE_SAMPLE_RATE остальных — так в профиль попадает сам медленный вызов.
+    cProfile здесь не годится: включённый на время await, он записывает всё, что цикл событий
+    успел выполнить за других. Снимки же относятся только к своему вызову — к его выполняемым
+    кадрам или к цепочке await, на которой он стоит.
+    """
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, slow_ms: float = PROFILE_SLOW_MS):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = _handler_name(data)
+        coro = handler(event, data)
+        call = _Call(sys._getframe(), coro, threading.get_ident())
+        _sampler.track(call)
+
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            _sampler.untrack(call)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            slow = elapsed_ms >= self.slow_ms
+            path = None
+            if slow or random.random() < self.sample_rate:
+                # Путь известен сразу, а сам файл пишется в фоне: обработчик не ждёт диска
+                path = _profile_path(name, elapsed_ms)
+                task = asyncio.create_task(asyncio.to_thread(_dump_profile, path, call, name, elapsed_ms))
+                _pending_dumps.add(task)
+                task.add_done_callback(_pending_dumps.discard)
+            if slow:
+                slow_calls.append((name, elapsed_ms, time.time(), path))
+                logging.warning(f"Slow handler {name}: {elapsed_ms:.1f} ms" + (f", profile: {path}" if path else ""))
+
+
+def get_slowest_handlers(limit: int = 10):
+    """
+    Самые медленные недавние вызовы, по одному (худшему) на обработчик.
+    """
+    worst = {}
+    for row in slow_calls:
+        if row[0] not in worst or row[1] > worst[row[0]][1]:
+            worst[row[0]] = row
+    return sorted(worst.values(), key=lambda row: row[1], reverse=True)[:limit]
@@ -0,0 +1,147 @@
+from db_helpers import get_connection
+
+# Агрегаты продаж по дням: всего, по товарам и по категориям. Обновляются в той же транзакции,
+# где платёж становится оплаченным, поэтому дашборд читает не больше 30 строк на окно
+# вместо соединения purchases, payments и products.
+SALES_TABLES = ("sales_daily", "sales_daily_products", "sales_daily_categories")
+
+# Окна дашборда: подпись -> сколько дней, включая сегодняшний
+SALES_WINDOWS = (("Сегодня", 1), ("7 дней", 7), ("30 дней", 30))
+
+
+def ensure_sales_tables():
+    """
+    Создаёт таблицы агрегатов. Если их ещё не было, один раз заполняет по уже оплаченным заказам.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sales_daily'")
+    created = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            day TEXT PRIMARY KEY,
+            orders INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0,
+            discount INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    for table, key in (("sales_daily_products", "product_id"), ("sales_daily_categories", "category_id")):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                day TEXT NOT NULL,
+                {key} INTEGER NOT NULL,
+                orders INTEGER NOT NULL DEFAULT 0,
+                revenue INTEGER NOT NULL DEFAULT 0,
+                discount INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, {key})
+            )
+        """)
+    conn.commit()
+    conn.close()
+    if created:
+        backfill_sales()
+
+
+def _add_sale(cursor, day, product_id, category_id, revenue, discount, orders=1):
+    values = (orders, revenue, discount)
+    update = "orders = orders + excluded.orders, revenue = revenue + excluded.revenue, discount = discount + excluded.discount"
+    cursor.execute(
+        f"INSERT INTO sales_daily(day, orders, revenue, discount) VALUES (?, ?, ?, ?) ON CONFLICT(day) DO UPDATE SET {update}",
+        (day, *values)
+    )
+    cursor.execute(
+        f"""INSERT INTO sales_daily_products(day, product_id, orders, revenue, discount) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(day, product_id) DO UPDATE SET {update}""",
+        (day, product_id, *values)
+    )
+    cursor.execute(
+        f"""INSERT INTO sales_daily_categories(day, category_id, orders, revenue, discount) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(day, category_id) DO UPDATE SET {update}""",
+        (day, category_id, *values)
+    )
+
+
+def record_sale(cursor, purchase_id: int, paid_at: str) -> None:
+    """
+    Добавляет оплаченную покупку в агрегаты в текущей транзакции курсора. Вызывать ровно один раз
+    на покупку — при переходе её платежа в paid. День продажи — дата оплаты paid_at (UTC),
+    как и в backfill_sales, чтобы пересчёт давал те же цифры. Сумма заказа без сохранённой
+    цены (старые покупки) берётся по текущей цене товара.
+    """
+    cursor.execute("""
+        SELECT date(?), p.product_id, COALESCE(pr.category_id, 0),
+               COALESCE(p.amount, pr.price, 0), COALESCE(p.discount, 0)
+        FROM purchases p
+        LEFT JOIN products pr ON pr.id = p.product_id
+        WHERE p.id = ?
+    """, (paid_at, purchase_id))
+    row = cursor.fetchone()
+    if row:
+        _add_sale(cursor, *row)
+
+
+def backfill_sales() -> int:
+    """
+    Пересчитывает агрегаты с нуля по всем оплаченным покупкам, включая архивные, одной транзакцией.
+    День продажи — paid_at платежа; у платежей, оплаченных до появления этой колонки, — время
+    создания платежа. Возвращает число учтённых заказов.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    for table in SALES_TABLES:
+        cursor.execute(f"DELETE FROM {table}")
+    cursor.execute("""
+        SELECT date(paid.paid_at), p.product_id, COALESCE(pr.category_id, 0),
+               SUM(COALESCE(p.amount, pr.price, 0)), SUM(COALESCE(p.discount, 0)), COUNT(*)
+        FROM purchases_all p
+        JOIN (
+            SELECT purchase_id, MIN(COALESCE(paid_at, created_at)) AS paid_at
+            FROM payments_all WHERE status = 'paid'
+            GROUP BY purchase_id
+        ) paid ON paid.purchase_id = p.id
+        LEFT JOIN products pr ON pr.id = p.product_id
+        GROUP BY 1, 2, 3
+    """)
+    total = 0
+    for day, product_id, category_id, revenue, discount, orders in cursor.fetchall():
+        _add_sale(cursor, day, product_id, category_id, revenue, discount, orders)
+        total += orders
+    conn.commit()
+    conn.close()
+    return total
+
+
+def get_sales_summary(top: int = 3) -> dict:
+    """
+    Цифры для дашборда: {"windows": [(подпись, заказы, выручка, скидки), ...],
+    "categories": [(название, заказы, выручка), ...], "products": [...]} — лидеры за самое длинное окно.
+    """
+    longest = max(days for _, days in SALES_WINDOWS)
+    since = f"-{longest - 1} days"
+    conn = get_connection()
+    cursor = conn.cursor()
+    sums = ", ".join(
+        f"""COALESCE(SUM(CASE WHEN day >= date('now', '-{days - 1} days') THEN orders END), 0),
+            COALESCE(SUM(CASE WHEN day >= date('now', '-{days - 1} days') THEN revenue END), 0),
+            COALESCE(SUM(CASE WHEN day >= date('now', '-{days - 1} days') THEN discount END), 0)"""
+        for _, days in SALES_WINDOWS
+    )
+    cursor.execute(f"SELECT {sums} FROM sales_daily WHERE day >= date('now', ?)", (since,))
+    row = cursor.fetchone()
+    windows = [(label, *row[i * 3:i * 3 + 3]) for i, (label, _) in enumerate(SALES_WINDOWS)]
+
+    leaders = {}
+    for kind, table, key, names in (("categories", "sales_daily_categories", "category_id", "categories"),
+                                     ("products", "sales_daily_products", "product_id", "products")):
+        cursor.execute(f"""
+            SELECT COALESCE(n.name, '#' || s.{key}), SUM(s.orders), SUM(s.revenue)
+            FROM {table} s
+            LEFT JOIN {names} n ON n.id = s.{key}
+            WHERE s.day >= date('now', ?)
+            GROUP BY s.{key}
+            ORDER BY SUM(s.revenue) DESC
+            LIMIT ?
+        """, (since, top))
+        leaders[kind] = cursor.fetchall()
+    conn.close()
+    return {"windows": windows, **leaders}
@@ -5,6 +5,7 @@ class AddProductState(StatesGroup):
     waiting_for_name = State()
     waiting_for_description = State()
     waiting_for_price = State()
+    waiting_for_photo = State()
     waiting_for_product_data = State()
 
 class PromoAdminState(StatesGroup):
@@ -23,3 +24,15 @@ class PurchaseState(StatesGroup):
 class DeleteState(StatesGroup):
     waiting_for_category_name = State()
     waiting_for_product_name = State()
+
+class ImportState(StatesGroup):
+    waiting_for_file = State()
+
+class StockState(StatesGroup):
+    waiting_for_items = State()
+
+class BroadcastState(StatesGroup):
+    waiting_for_text = State()
+
+class ProductPhotoState(StatesGroup):
+    waiting_for_photo = State()
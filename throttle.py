@@ -0,0 +1,121 @@
+import time
+import logging
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from config import (
+    ADMIN_IDS, FLOOD_NAV_RATE, FLOOD_NAV_BURST, FLOOD_EXPENSIVE_RATE, FLOOD_EXPENSIVE_BURST, FLOOD_MAX_USERS
+)
+from states import PurchaseState, UserPromoState
+
+# Кнопки, за которыми стоят запись в БД или внешний API: оформление заказа, проверка оплаты, промокоды
+EXPENSIVE_ACTIONS = {
+    "skip_promo_purchase", "confirm_purchase_with_promo", "pay_balance", "checkpay",
+    "apply_promo_in_purchase", "promo",
+}
+# Сообщения в этих состояниях — ввод промокода
+EXPENSIVE_STATES = {PurchaseState.waiting_for_promo.state, UserPromoState.waiting_for_code.state}
+
+# (класс, имя обработчика) -> число отклонённых апдейтов с запуска процесса
+rejections = Counter()
+
+
+class TokenBucket:
+    """
+    Ведро на rate токенов в секунду и не больше burst про запас.
+    """
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated_at = now
+
+    def take(self, rate: float, burst: float, now: float) -> bool:
+        self.tokens = min(burst, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class AntiFloodMiddleware(BaseMiddleware):
+    """
+    Ограничивает частоту апдейтов от одного пользователя: у навигации и дорогих действий
+    свои вёдра токенов. Лишнее отбрасывается до обработчика — кнопке отвечаем коротким
+    уведомлением, на сообщения предупреждаем один раз за серию. Вёдра хранятся в LRU
+    не больше чем на max_users пользователей; администраторов не ограничиваем.
+    """
+
+    def __init__(self, nav=(FLOOD_NAV_RATE, FLOOD_NAV_BURST), expensive=(FLOOD_EXPENSIVE_RATE, FLOOD_EXPENSIVE_BURST),
+                 max_users: int = FLOOD_MAX_USERS):
+        self.limits = {"nav": nav, "expensive": expensive}
+        self.max_users = max_users
+        # (user_id, класс) -> TokenBucket
+        self.buckets: "OrderedDict[tuple, TokenBucket]" = OrderedDict()
+        # Пользователи, которых уже предупредили сообщением в текущей серии отказов
+        self.warned = set()
+
+    def _classify(self, event: TelegramObject, data: Dict[str, Any]) -> tuple:
+        route = data.get("callback_route")
+        if route is not None:
+            return ("expensive" if route.action in EXPENSIVE_ACTIONS else "nav"), route.action
+        if isinstance(event, Message) and data.get("raw_state") in EXPENSIVE_STATES:
+            return "expensive", data["raw_state"]
+        handler_obj = data.get("handler")
+        return "nav", getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+
+    def _allow(self, user_id: int, kind: str) -> bool:
+        rate, burst = self.limits[kind]
+        now = time.monotonic()
+        key = (user_id, kind)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(burst, now)
+            if len(self.buckets) > self.max_users:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket.take(rate, burst, now)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id in ADMIN_IDS:
+            return await handler(event, data)
+
+        kind, name = self._classify(event, data)
+        if self._allow(user.id, kind):
+            self.warned.discard(user.id)
+            return await handler(event, data)
+
+        rejections[(kind, name)] += 1
+        try:
+            if isinstance(event, CallbackQuery):
+                await event.answer("⏳ Слишком часто. Подождите пару секунд.")
+            elif isinstance(event, Message) and user.id not in self.warned:
+                if len(self.warned) >= self.max_users:
+                    self.warned.clear()
+                self.warned.add(user.id)
+                await event.answer("⏳ Слишком много сообщений. Подождите пару секунд.")
+        except Exception as e:
+            logging.error(f"Error acknowledging throttled update from {user.id}: {e}")
+        return None
+
+
+def get_flood_stats(limit: int = 10):
+    """
+    Итоги отказов по классам и самые частые отклонённые обработчики: ({класс: число}, [(класс, имя, число), ...]).
+    """
+    totals = Counter()
+    for (kind, _), count in rejections.items():
+        totals[kind] += count
+    top = [(kind, name, count) for (kind, name), count in rejections.most_common(limit)]
+    return dict(totals), top
@@ -1,23 +1,46 @@
 import os
 from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, FSInputFile
 
+from images import get_photo_file_id, remember_photo_file_id
+
+# chat_id -> id сообщений, которые бот удалит перед следующим send_or_edit
 last_message = {}
 
+# Длина подписи к фото в Telegram (текст длиннее уходит отдельным сообщением под фото)
+CAPTION_LIMIT = 1024
+
+async def send_cached_photo(bot: Bot, chat_id: int, photo_path: str, **kwargs):
+    """
+    Отправляет фото по сохранённому file_id; при первой отправке загружает файл и запоминает file_id.
+    """
+    file_id = get_photo_file_id(photo_path)
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            if "file" not in str(e).lower():
+                raise
+            # Telegram больше не знает этот file_id (например, сменился токен бота) — загрузим заново
+            remember_photo_file_id(photo_path, None)
+    sent = await bot.send_photo(chat_id=chat_id, photo=FSInputFile(photo_path), **kwargs)
+    if sent.photo:
+        remember_photo_file_id(photo_path, sent.photo[-1].file_id)
+    return sent
+
 async def send_or_edit(bot: Bot, chat_id: int, source_obj, text: str = None, photo_path: str = None,
                        reply_markup: InlineKeyboardMarkup = None, parse_mode: str = None):
     """
-    Удаляет предыдущее сообщение бота и отправляет новое.
+    Удаляет предыдущее сообщение бота и отправляет новое. Если текст не помещается в подпись
+    к фото, фото отправляется отдельно, а текст с кнопками — следующим сообщением.
     """
-    prev_mid = last_message.get(chat_id)
-
-    # Удаляем старое сообщение если оно есть
-    if prev_mid:
+    # Удаляем старые сообщения если они есть
+    for prev_mid in last_message.pop(chat_id, ()):
         try:
             await bot.delete_message(chat_id=chat_id, message_id=prev_mid)
         except Exception:
             pass
-        last_message.pop(chat_id, None)
 
     # Определяем, нужно ли отправлять ответом на сообщение пользователя
     reply_to = None
@@ -27,17 +50,27 @@ async def send_or_edit(bot: Bot, chat_id: int, source_obj, text: str = None, pho
     except Exception:
         reply_to = None
 
+    sent_ids = []
+    if photo_path and text and len(text) > CAPTION_LIMIT:
+        # Проверяем до отправки: иначе фото загрузилось бы и было отклонено из-за длинной подписи
+        try:
+            photo = await send_cached_photo(bot, chat_id, photo_path, reply_to_message_id=reply_to)
+            sent_ids.append(photo.message_id)
+        except Exception:
+            pass
+        photo_path = None
+
     sent = None
     try:
         if photo_path:
             if reply_to:
-                sent = await bot.send_photo(chat_id=chat_id, photo=FSInputFile(photo_path),
-                                            caption=text, reply_markup=reply_markup,
-                                            parse_mode=parse_mode, reply_to_message_id=reply_to)
+                sent = await send_cached_photo(bot, chat_id, photo_path,
+                                               caption=text, reply_markup=reply_markup,
+                                               parse_mode=parse_mode, reply_to_message_id=reply_to)
             else:
-                sent = await bot.send_photo(chat_id=chat_id, photo=FSInputFile(photo_path),
-                                            caption=text, reply_markup=reply_markup,
-                                            parse_mode=parse_mode)
+                sent = await send_cached_photo(bot, chat_id, photo_path,
+                                               caption=text, reply_markup=reply_markup,
+                                               parse_mode=parse_mode)
         else:
             if reply_to:
                 sent = await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup,
@@ -52,4 +85,15 @@ async def send_or_edit(bot: Bot, chat_id: int, source_obj, text: str = None, pho
             sent = None
 
     if sent:
-        last_message[chat_id] = sent.message_id
+        sent_ids.append(sent.message_id)
+    if sent_ids:
+        last_message[chat_id] = sent_ids
+
+def split_page(rows, limit: int, cursor_id: int, backward: bool):
+    """
+    Отрезает служебную (limit + 1)-ю строку keyset-выборки.
+    Возвращает (rows, has_prev, has_next).
+    """
+    if backward:
+        return rows[-limit:], len(rows) > limit, True
+    return rows[:limit], cursor_id > 0, len(rows) > limit
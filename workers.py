@@ -0,0 +1,216 @@
+import os
+import bisect
+import signal
+import socket
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+
+from config import LEASE_TTL
+from database import acquire_lease, release_lease
+from db_helpers import flush_new_users
+from crypto_payments import close_crypto_client
+
+RING_REPLICAS = 100
+POLL_TIMEOUT = 30
+WORKER_STOP_TIMEOUT = 15
+JOBS_LEASE = "background_jobs"
+
+# Поля обновления, в которых событие привязано к чату
+_CHAT_EVENTS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "my_chat_member", "chat_member", "chat_join_request"
+)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Консистентное хеширование: у каждого воркера RING_REPLICAS точек на кольце, ключ уходит к ближайшей
+    точке по часовой стрелке. При смене числа воркеров переезжает лишь около 1/N чатов.
+    """
+
+    def __init__(self, nodes, replicas: int = RING_REPLICAS):
+        points = sorted((_hash(f"{node}:{i}"), node) for node in nodes for i in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        index = bisect.bisect(self.hashes, _hash(str(key))) % len(self.hashes)
+        return self.nodes[index]
+
+
+def update_chat_id(update: dict):
+    """
+    Ключ маршрутизации сырого обновления: id чата, а для событий без чата (inline-запросы и т.п.) —
+    id пользователя. В личке они совпадают, поэтому все события пользователя попадают к одному воркеру.
+    """
+    for key in _CHAT_EVENTS:
+        event = update.get(key)
+        if event:
+            return event.get("chat", {}).get("id")
+    callback = update.get("callback_query")
+    if callback:
+        chat_id = (callback.get("message") or {}).get("chat", {}).get("id")
+        return chat_id if chat_id is not None else callback.get("from", {}).get("id")
+    for event in update.values():
+        if isinstance(event, dict) and "from" in event:
+            return event["from"].get("id")
+    return update.get("update_id")
+
+
+async def _hold_jobs_lease(owner: str, start_jobs):
+    """
+    Раз в треть LEASE_TTL продлевает аренду фоновых задач. Получили аренду — запускаем задачи,
+    потеряли — останавливаем, чтобы доставку и очистку никогда не выполняли два воркера сразу.
+    """
+    jobs = []
+    try:
+        while True:
+            try:
+                held = acquire_lease(JOBS_LEASE, owner, LEASE_TTL)
+            except Exception as e:
+                logging.error(f"Error renewing lease for {owner}: {e}")
+                held = False
+            if held and not jobs:
+                logging.info(f"{owner} acquired the background jobs lease")
+                jobs = start_jobs()
+            elif not held and jobs:
+                logging.warning(f"{owner} lost the background jobs lease, stopping jobs")
+                for task in jobs:
+                    task.cancel()
+                jobs = []
+            await asyncio.sleep(LEASE_TTL / 3)
+    finally:
+        for task in jobs:
+            task.cancel()
+        if jobs:
+            release_lease(JOBS_LEASE, owner)
+
+
+async def _worker_main(index: int, queue, dp, bot, start_jobs, start_process_jobs):
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    logging.info(f"Worker {index} started as {owner}")
+    lease_task = asyncio.create_task(_hold_jobs_lease(owner, start_jobs))
+    process_jobs = start_process_jobs()
+
+    # chat_id -> [lock, число ждущих обновлений]; asyncio.Lock отдаёт захват по очереди,
+    # поэтому обновления одного чата обрабатываются строго в порядке поступления
+    chat_locks = {}
+    in_flight = set()
+
+    async def handle(chat_id, update: dict):
+        entry = chat_locks[chat_id]
+        try:
+            async with entry[0]:
+                await dp.feed_raw_update(bot, update)
+        except Exception:
+            logging.exception(f"Worker {index} failed to process update {update.get('update_id')}")
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                chat_locks.pop(chat_id, None)
+
+    try:
+        while True:
+            update = await asyncio.to_thread(queue.get)
+            if update is None:
+                break
+            chat_id = update_chat_id(update)
+            entry = chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            task = asyncio.create_task(handle(chat_id, update))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.wait(in_flight, timeout=WORKER_STOP_TIMEOUT)
+    finally:
+        lease_task.cancel()
+        for task in process_jobs:
+            task.cancel()
+        await asyncio.gather(lease_task, *process_jobs, return_exceptions=True)
+        try:
+            flush_new_users()
+        except Exception:
+            logging.exception("Error while flushing new users:")
+        try:
+            await close_crypto_client()
+        except Exception:
+            logging.exception("Error while closing Crypto Pay session:")
+        try:
+            await bot.session.close()
+        except Exception:
+            logging.exception("Error while closing bot session:")
+        logging.info(f"Worker {index} stopped")
+
+
+def _run_worker(index: int, queue, dp, bot, start_jobs, start_process_jobs):
+    # Ctrl+C получает вся группа процессов; останавливаемся только по команде супервизора
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_main(index, queue, dp, bot, start_jobs, start_process_jobs))
+
+
+async def _poll_and_route(dp, bot, queues, processes):
+    """
+    Единственный long polling: забирает обновления и раскладывает их по очередям воркеров по chat_id.
+    """
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    ring = HashRing(range(len(queues)))
+    allowed_updates = dp.resolve_used_update_types()
+    offset = None
+    backoff = 1
+    try:
+        while True:
+            dead = [process.name for process in processes if not process.is_alive()]
+            if dead:
+                logging.error(f"Worker processes exited: {', '.join(dead)}; shutting down")
+                return
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates)
+                backoff = 1
+            except Exception as e:
+                logging.error(f"Error fetching updates: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            for update in updates:
+                data = update.model_dump(mode="json", exclude_unset=True)
+                queues[ring.node_for(update_chat_id(data))].put(data)
+                offset = update.update_id + 1
+    finally:
+        await bot.session.close()
+
+
+def run_supervisor(dp, bot, workers: int, start_jobs, start_process_jobs):
+    """
+    Режим нескольких процессов: fork'ает workers воркеров с копией диспетчера, сам ведёт polling
+    и раздаёт обновления. Состояние FSM и last_message остаются локальными для воркера,
+    потому что чат всегда обслуживает один и тот же процесс.
+    """
+    ctx = multiprocessing.get_context("fork")
+    queues = [ctx.Queue() for _ in range(workers)]
+    processes = [
+        ctx.Process(target=_run_worker, args=(index, queues[index], dp, bot, start_jobs, start_process_jobs), name=f"worker-{index}")
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logging.info(f"Supervisor started {workers} workers")
+
+    try:
+        asyncio.run(_poll_and_route(dp, bot, queues, processes))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logging.info("Supervisor interrupted.")
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        logging.info("Supervisor stopped")